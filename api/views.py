@@ -2,6 +2,7 @@ from rest_framework import viewsets, filters, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
+from django.db.models import Prefetch
 
 from store.models import (
     Category, Product, Color, ColorImage, User,
@@ -9,8 +10,14 @@ from store.models import (
 )
 from store.serializers import (
     CategorySerializer, ProductSerializer, ColorSerializer, ColorImageSerializer,
-    UserSerializer, CartSerializer, CartItemSerializer, OrderSerializer, OrderItemSerializer
+    UserSerializer, CartSerializer, CartItemSerializer, OrderSerializer, OrderItemSerializer,
+    CreateOrderSerializer, ProductSearchSerializer
 )
+from store import services
+from store.search import search_products
+
+SEARCH_LIMIT = 20
+SEARCH_MAX_LIMIT = 50
 
 
 class UserViewSet(viewsets.ModelViewSet):
@@ -30,7 +37,7 @@ class UserViewSet(viewsets.ModelViewSet):
 
 
 class CategoryViewSet(viewsets.ModelViewSet):
-    queryset = Category.objects.all()
+    queryset = Category.objects.all().order_by('path')
     serializer_class = CategorySerializer
     filter_backends = [DjangoFilterBackend, filters.SearchFilter]
     filterset_fields = ['parent', 'is_active']
@@ -39,20 +46,43 @@ class CategoryViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         # Faqat asosiy (parent=None) kategoriyalarni qaytaradi
         if self.action == 'list' and not self.request.query_params.get('parent'):
-            return Category.objects.filter(parent=None)
+            return super().get_queryset().filter(parent=None)
         return super().get_queryset()
 
 
 class ProductViewSet(viewsets.ModelViewSet):
-    queryset = Product.objects.all()
+    # Kategoriyalarning children daraxti CategorySerializer da bitta so'rov bilan olinadi
+    queryset = Product.objects.all().order_by('id').prefetch_related(
+        Prefetch('categories', queryset=Category.objects.order_by('path')),
+        Prefetch('colors', queryset=Color.objects.filter(is_active=True).order_by('id')),
+        'colors__images',
+    )
     serializer_class = ProductSerializer
     filter_backends = [DjangoFilterBackend, filters.SearchFilter]
     filterset_fields = ['categories', 'is_active']
     search_fields = ['name_uz', 'name_ru', 'description_uz', 'description_ru']
 
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """
+        Faol mahsulotlar bo'yicha reytingli qidiruv (?q=..., ?limit=...).
+        Lotin va kirill yozuvida, xato bilan yozilgan so'zlar ham topiladi.
+        """
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({'error': 'q parameter is required'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = min(int(request.query_params.get('limit', SEARCH_LIMIT)), SEARCH_MAX_LIMIT)
+        except ValueError:
+            return Response({'error': 'Invalid limit'}, status=status.HTTP_400_BAD_REQUEST)
+
+        results = search_products(query, limit=max(limit, 1))
+        serializer = ProductSearchSerializer(results, many=True, context=self.get_serializer_context())
+        return Response({'count': len(results), 'results': serializer.data})
+
 
 class ColorViewSet(viewsets.ModelViewSet):
-    queryset = Color.objects.all()
+    queryset = Color.objects.all().order_by('id').prefetch_related('images')
     serializer_class = ColorSerializer
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['product', 'is_active']
@@ -66,7 +96,9 @@ class ColorImageViewSet(viewsets.ModelViewSet):
 
 
 class CartViewSet(viewsets.ReadOnlyModelViewSet):
-    queryset = Cart.objects.filter(is_active=True)
+    queryset = Cart.objects.filter(is_active=True).prefetch_related(
+        Prefetch('items', queryset=CartItem.objects.with_totals())
+    )
     serializer_class = CartSerializer
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['user']
@@ -79,6 +111,27 @@ class OrderViewSet(viewsets.ModelViewSet):
     filterset_fields = ['user', 'status']
     search_fields = ['id']
 
+    @action(detail=False, methods=['post'])
+    def checkout(self, request):
+        """
+        Faol savatchadan buyurtma yaratish.
+        checkout_key (yoki Idempotency-Key header) bilan qayta so'rov o'sha buyurtmani qaytaradi.
+        """
+        serializer = CreateOrderSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        checkout_key = data.get('checkout_key') or request.headers.get('Idempotency-Key')
+
+        try:
+            order, created = services.checkout(data['user'], data['address'], checkout_key)
+        except Cart.DoesNotExist:
+            return Response({'error': 'Cart is empty'}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(
+            OrderSerializer(order).data,
+            status=status.HTTP_201_CREATED if created else status.HTTP_200_OK
+        )
+
     @action(detail=True, methods=['post'])
     def change_status(self, request, pk=None):
         """Buyurtma statusini o'zgartirish"""
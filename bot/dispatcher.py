@@ -0,0 +1,55 @@
+from aiogram import Bot, Dispatcher
+from django.conf import settings
+
+from bot.handlers import (
+    get_start_router,
+    get_categories_router,
+    get_cart_router,
+    get_orders_router,
+    get_contact_router,
+    get_settings_router,
+    get_search_router,
+    get_callbacks_router
+)
+from bot.middlewares.authentication import AuthenticationMiddleware
+from bot.middlewares.metrics import HandlerNameMiddleware, MetricsMiddleware
+from bot.storage import create_storage
+from bot.utils.coalescer import quantity_coalescer
+from bot.utils.exporter import metrics_publisher
+from bot.utils.metrics import api_call_counter
+from bot.utils.outbound import send_limiter
+
+
+def create_bot(token=None):
+    """Bot whose outgoing requests go through the outbound rate limiter"""
+    bot = Bot(token=token or settings.TELEGRAM_TOKEN, parse_mode="HTML")
+    # Counter is outermost, so API time of an update includes rate limiter waits
+    bot.session.middleware(api_call_counter)
+    bot.session.middleware(send_limiter)
+    return bot
+
+
+def create_dispatcher():
+    """Dispatcher with all bot middlewares and routers registered"""
+    dp = Dispatcher(storage=create_storage())
+    dp.startup.register(metrics_publisher.start)
+    dp.shutdown.register(quantity_coalescer.close)
+    dp.shutdown.register(metrics_publisher.stop)
+
+    # Register middlewares
+    dp.update.outer_middleware(MetricsMiddleware())
+    dp.update.outer_middleware(AuthenticationMiddleware())
+    for observer in (dp.message, dp.callback_query, dp.inline_query):
+        observer.middleware(HandlerNameMiddleware())
+
+    # Register routers
+    dp.include_router(get_start_router())
+    dp.include_router(get_categories_router())
+    dp.include_router(get_cart_router())
+    dp.include_router(get_orders_router())
+    dp.include_router(get_contact_router())
+    dp.include_router(get_settings_router())
+    dp.include_router(get_search_router())
+    dp.include_router(get_callbacks_router())
+
+    return dp
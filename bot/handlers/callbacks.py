@@ -0,0 +1,30 @@
+from aiogram import Router
+
+from bot.utils.callbacks import CallbackTable
+from .start import get_start_callbacks
+from .categories import get_categories_callbacks
+from .products import get_products_callbacks
+from .cart import get_cart_callbacks
+from .settings import get_settings_callbacks
+
+
+def get_callbacks_router():
+    """
+    Yagona callback_query handler: callback_data bir marta decode qilinadi
+    va Action bo'yicha jadvaldan handler chaqiriladi
+    """
+    table = CallbackTable()
+    for callbacks in (
+        get_start_callbacks(),
+        get_categories_callbacks(),
+        get_products_callbacks(),
+        get_cart_callbacks(),
+        get_settings_callbacks(),
+    ):
+        for action, handler in callbacks.items():
+            table.register(action, handler)
+
+    router = Router()
+    router.callback_query.register(table.dispatch)
+
+    return router
@@ -1,16 +1,34 @@
+from uuid import uuid4
+
 from aiogram import Router, F, types
-from aiogram.types import Message, CallbackQuery, KeyboardButton, FSInputFile
+from aiogram.types import Message, CallbackQuery, KeyboardButton
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from django.utils.translation import gettext as _
-from asgiref.sync import sync_to_async
-from django.conf import settings
-import os
-from PIL import Image
 
 from store.models import Cart, CartItem
 from bot.keyboards.cart import get_cart_kb, get_cart_item_kb
 from bot.keyboards.common import get_main_menu_kb
+from bot.utils.callbacks import Action
+from bot.utils import queries
+from bot.utils.coalescer import quantity_coalescer
+from bot.utils.log import get_logger
+from bot.utils.media import answer_photo, telegram_image_path
+
+
+log = get_logger(__name__)
+
+# Foydalanuvchiga oxirgi ko'rsatilgan miqdor, (telegram_id, item_id) bo'yicha:
+# ➖ bosilganda "kamida 1" javobi bazaga murojaatsiz beriladi
+MAX_KNOWN_QUANTITIES = 10000
+known_quantities = {}
+
+
+def remember_quantity(key, quantity):
+    known_quantities.pop(key, None)
+    if len(known_quantities) >= MAX_KNOWN_QUANTITIES:
+        known_quantities.pop(next(iter(known_quantities)))
+    known_quantities[key] = quantity
 
 
 class OrderStates(StatesGroup):
@@ -23,133 +41,50 @@ def get_cart_router():
 
     # Register handlers with F filter
     router.message.register(show_cart, F.text.in_(["🛒 Savatcha", "🛒 Корзина"]))
-    router.callback_query.register(show_cart_callback, F.data == "show_cart")
-    router.callback_query.register(process_cart_item, F.data.startswith("cartitem_"))
-    router.callback_query.register(remove_from_cart, F.data.startswith("remove_"))
-    router.callback_query.register(change_quantity, F.data.startswith("quantity_"))
-    router.callback_query.register(clear_cart, F.data.startswith("clearcart"))
-    router.callback_query.register(start_checkout, F.data.startswith("checkout"))
 
     return router
 
 
-def get_image_file_path(image_field):
-    """Get file path for image field"""
-    if not image_field:
-        return None
-
-    try:
-        # Get full file path
-        file_path = os.path.join(settings.MEDIA_ROOT, str(image_field))
-        if os.path.exists(file_path):
-            return file_path
-        return None
-    except Exception as e:
-        print(f"DEBUG: Error getting image file path: {e}")
-        return None
-
-
-def validate_image_for_telegram(file_path):
-    """Validate image for Telegram compatibility"""
-    if not file_path or not os.path.exists(file_path):
-        return False
-
-    try:
-        # Check file size (max 10MB for photos)
-        file_size = os.path.getsize(file_path)
-        if file_size > 10 * 1024 * 1024:  # 10MB
-            print(f"DEBUG: File too large: {file_size} bytes")
-            return False
-
-        # Check if it's a valid image
-        with Image.open(file_path) as img:
-            # Check format
-            if img.format not in ['JPEG', 'PNG', 'GIF', 'WEBP']:
-                print(f"DEBUG: Unsupported format: {img.format}")
-                return False
-
-            # Check dimensions (max 10000x10000)
-            if img.width > 10000 or img.height > 10000:
-                print(f"DEBUG: Image too large: {img.width}x{img.height}")
-                return False
-
-        return True
-    except Exception as e:
-        print(f"DEBUG: Error validating image: {e}")
-        return False
-
-
-@sync_to_async
-def get_cart_items_data(cart, language):
-    """Get cart items data in a format suitable for keyboards"""
-    items_data = []
-    for item in cart.items.select_related('color__product').all():
-        items_data.append({
-            'item_id': item.id,
-            'product_name': item.color.product.get_name(language),
-            'color_name': item.color.get_name(language),
-            'price': item.color.price,
-            'quantity': item.quantity,
-        })
-    return items_data
+def get_cart_callbacks():
+    return {
+        Action.SHOW_CART: show_cart_callback,
+        Action.CART_ITEM: process_cart_item,
+        Action.REMOVE_ITEM: remove_from_cart,
+        Action.QUANTITY: change_quantity,
+        Action.CLEAR_CART: clear_cart,
+        Action.CHECKOUT: start_checkout,
+    }
 
 
 async def show_cart(message: Message, **kwargs):
     """Show cart items"""
-    print(f"DEBUG: show_cart called for message: {message.text}")
-
     # User ni kwargs dan olish
     user = kwargs.get('user')
     if not user:
-        print("DEBUG: User not found in show_cart")
         await message.answer(
             _("Iltimos, botni qaytadan ishga tushirish uchun /start buyrug'ini yuboring")
         )
         return
 
-    print(f"DEBUG: User found in show_cart: {user.telegram_id}")
-
     try:
-        # Get cart using sync_to_async
-        cart = await sync_to_async(Cart.objects.get)(user=user, is_active=True)
-        print(f"DEBUG: Cart found: {cart.id}")
+        # Get cart items data and total price
+        cart_items_data, total_price = await queries.get_cart_view(user, user.language)
 
-        # Check if cart has items
-        has_items = await sync_to_async(lambda: cart.items.exists())()
-        print(f"DEBUG: Cart has items: {has_items}")
-
-        if has_items:
-            # Get cart items count
-            items_count = await sync_to_async(lambda: cart.items.count())()
-            print(f"DEBUG: Cart items count: {items_count}")
-
-            # Get cart items data and total price using sync_to_async
-            cart_items_data = await get_cart_items_data(cart, user.language)
-            total_price = await sync_to_async(cart.get_total_price)()
-
-            print(f"DEBUG: Cart items data: {cart_items_data}")
-            print(f"DEBUG: Total price: {total_price}")
+        if cart_items_data:
+            log.debug("cart.shown", items=len(cart_items_data), total=total_price)
 
             await message.answer(
                 _("Sizning savatchangiz:"),
                 reply_markup=get_cart_kb(cart_items_data, user.language, total_price)
             )
         else:
-            print("DEBUG: Cart is empty")
+            log.debug("cart.shown", items=0)
             await message.answer(
                 _("Sizning savatchagiz bo'sh."),
                 reply_markup=get_main_menu_kb(user.language)
             )
-    except Cart.DoesNotExist:
-        print("DEBUG: Cart does not exist")
-        await message.answer(
-            _("Sizning savatchagiz bo'sh."),
-            reply_markup=get_main_menu_kb(user.language)
-        )
     except Exception as e:
-        print(f"DEBUG: Error in show_cart: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log.exception("cart.show_failed")
         await message.answer(f"Xatolik: {str(e)}")
 
 
@@ -161,28 +96,15 @@ async def show_cart_callback(callback: CallbackQuery, **kwargs):
         await callback.answer(_("Iltimos, botni qaytadan ishga tushiring"))
         return
 
-    try:
-        # Get cart using sync_to_async
-        cart = await sync_to_async(Cart.objects.get)(user=user, is_active=True)
-
-        # Check if cart has items
-        has_items = await sync_to_async(lambda: cart.items.exists())()
-
-        if has_items:
-            # Get cart items data and total price using sync_to_async
-            cart_items_data = await get_cart_items_data(cart, user.language)
-            total_price = await sync_to_async(cart.get_total_price)()
+    # Get cart items data and total price
+    cart_items_data, total_price = await queries.get_cart_view(user, user.language)
 
-            await callback.message.edit_text(
-                _("Sizning savatchangiz:"),
-                reply_markup=get_cart_kb(cart_items_data, user.language, total_price)
-            )
-        else:
-            await callback.message.edit_text(
-                _("Sizning savatchagiz bo'sh."),
-                reply_markup=get_main_menu_kb(user.language)
-            )
-    except Cart.DoesNotExist:
+    if cart_items_data:
+        await callback.message.edit_text(
+            _("Sizning savatchangiz:"),
+            reply_markup=get_cart_kb(cart_items_data, user.language, total_price)
+        )
+    else:
         await callback.message.edit_text(
             _("Sizning savatchagiz bo'sh."),
             reply_markup=get_main_menu_kb(user.language)
@@ -191,7 +113,7 @@ async def show_cart_callback(callback: CallbackQuery, **kwargs):
     await callback.answer()
 
 
-async def process_cart_item(callback: CallbackQuery, **kwargs):
+async def process_cart_item(callback: CallbackQuery, item_id, **kwargs):
     """Process cart item selection"""
     # User ni kwargs dan olish
     user = kwargs.get('user')
@@ -199,32 +121,19 @@ async def process_cart_item(callback: CallbackQuery, **kwargs):
         await callback.answer(_("Iltimos, botni qaytadan ishga tushiring"))
         return
 
-    item_id = int(callback.data.split('_')[1])
-
     try:
-        # Get cart item with related data using sync_to_async
-        @sync_to_async
-        def get_cart_item_data():
-            cart_item = CartItem.objects.select_related('color__product').get(id=item_id)
-            has_images = cart_item.color.images.exists()
-            first_image_path = None
-
-            if has_images:
-                first_image = cart_item.color.images.first()
-                if first_image:
-                    first_image_path = get_image_file_path(first_image.image)
-
-            return {
-                'id': cart_item.id,
-                'product_name': cart_item.color.product.get_name(user.language),
-                'color_name': cart_item.color.get_name(user.language),
-                'price': cart_item.color.price,
-                'quantity': cart_item.quantity,
-                'has_images': has_images,
-                'first_image_path': first_image_path
-            }
-
-        item_data = await get_cart_item_data()
+        # Get cart item with related data
+        cart_item, first_image = await queries.get_cart_item(item_id)
+
+        item_data = {
+            'id': cart_item.id,
+            'product_name': cart_item.color.product.get_name(user.language),
+            'color_name': cart_item.color.get_name(user.language),
+            'price': cart_item.color.price,
+            'quantity': cart_item.quantity,
+            'first_image_path': await telegram_image_path(first_image.image) if first_image else None
+        }
+        remember_quantity((user.telegram_id, cart_item.id), cart_item.quantity)
 
         # Prepare info message
         total = item_data['price'] * item_data['quantity']
@@ -238,18 +147,16 @@ async def process_cart_item(callback: CallbackQuery, **kwargs):
 
         keyboard = get_cart_item_kb(item_data['id'], user.language)
 
-        if (item_data['has_images'] and
-                item_data['first_image_path'] and
-                validate_image_for_telegram(item_data['first_image_path'])):
+        if item_data['first_image_path']:
             try:
                 await callback.message.delete()
-                await callback.message.answer_photo(
-                    photo=FSInputFile(item_data['first_image_path']),
+                await answer_photo(
+                    callback.message, item_data['first_image_path'],
                     caption=message_text,
                     reply_markup=keyboard
                 )
             except Exception as e:
-                print(f"DEBUG: Error sending cart item photo: {e}")
+                log.warning("cart.item_photo_failed", item_id=item_id, error=e)
                 await callback.message.edit_text(
                     message_text,
                     reply_markup=keyboard
@@ -266,7 +173,7 @@ async def process_cart_item(callback: CallbackQuery, **kwargs):
     await callback.answer()
 
 
-async def remove_from_cart(callback: CallbackQuery, **kwargs):
+async def remove_from_cart(callback: CallbackQuery, item_id, **kwargs):
     """Remove item from cart"""
     # User ni kwargs dan olish
     user = kwargs.get('user')
@@ -274,16 +181,9 @@ async def remove_from_cart(callback: CallbackQuery, **kwargs):
         await callback.answer(_("Iltimos, botni qaytadan ishga tushiring"))
         return
 
-    item_id = int(callback.data.split('_')[1])
-
     try:
-        # Get and delete cart item using sync_to_async
-        @sync_to_async
-        def delete_cart_item():
-            cart_item = CartItem.objects.get(id=item_id)
-            cart_item.delete()
-
-        await delete_cart_item()
+        # Get and delete cart item
+        await queries.delete_cart_item(item_id)
 
         await callback.answer(_("Mahsulot savatchadan o'chirildi."))
 
@@ -294,78 +194,80 @@ async def remove_from_cart(callback: CallbackQuery, **kwargs):
         await callback.answer(_("Mahsulot topilmadi."))
 
 
-async def change_quantity(callback: CallbackQuery, **kwargs):
-    """Change item quantity"""
+async def change_quantity(callback: CallbackQuery, item_id, increase, **kwargs):
+    """Change item quantity (increase: 1 plus, 0 minus)"""
     # User ni kwargs dan olish
     user = kwargs.get('user')
     if not user:
         await callback.answer(_("Iltimos, botni qaytadan ishga tushiring"))
         return
 
-    data_parts = callback.data.split('_')
-    item_id = int(data_parts[1])
-    action = data_parts[2]  # "plus" or "minus"
+    delta = 1 if increase else -1
+    key = (user.telegram_id, item_id)
+
+    # Har bir bosishga darhol javob beriladi, bazaga yozish va xabarni
+    # tahrirlash esa debounce oynasi tugagach bir marta bajariladi
+    if delta > 0:
+        await callback.answer(_("Miqdor oshirildi."))
+    else:
+        known = known_quantities.get(key)
+        if known is None:
+            # Miqdor noma'lum (masalan, qayta ishga tushgandan keyin): natija flush da ko'rinadi
+            await callback.answer()
+        elif known + quantity_coalescer.pending_delta(key) + delta < 1:
+            await callback.answer(_("Miqdor kamida 1 bo'lishi kerak."))
+            return
+        else:
+            await callback.answer(_("Miqdor kamaytirildi."))
 
-    try:
-        # Update quantity using sync_to_async wrapper functions
-        @sync_to_async
-        def update_quantity():
-            cart_item = CartItem.objects.select_related('color__product').get(id=item_id)
-
-            if action == "plus":
-                cart_item.quantity += 1
-                cart_item.save()
-                return cart_item, True, "increased"
-            elif action == "minus":
-                if cart_item.quantity > 1:
-                    cart_item.quantity -= 1
-                    cart_item.save()
-                    return cart_item, True, "decreased"
-                else:
-                    return cart_item, False, "minimum"
-
-            return cart_item, False, "unknown"
-
-        cart_item, success, action_result = await update_quantity()
-
-        if success:
-            if action_result == "increased":
-                await callback.answer(_("Miqdor oshirildi."))
-            elif action_result == "decreased":
-                await callback.answer(_("Miqdor kamaytirildi."))
-
-            # Update current message
-            product_name = cart_item.color.product.get_name(user.language)
-            color_name = cart_item.color.get_name(user.language)
-            price = cart_item.color.price
-            quantity = cart_item.quantity
-            total = price * quantity
-
-            message_text = (
-                f"<b>{product_name}</b>\n"
-                f"<i>{color_name}</i>\n"
-                f"{_('Narxi')}: {price:,.0f} {_('so\'m')}\n"
-                f"{_('Soni')}: {quantity}\n"
-                f"{_('Jami')}: {total:,.0f} {_('so\'m')}"
-            )
+    async def apply(total_delta, taps):
+        await update_cart_item_quantity(callback, user, item_id, total_delta)
 
-            try:
-                await callback.message.edit_caption(
-                    caption=message_text,
-                    reply_markup=get_cart_item_kb(cart_item.id, user.language)
-                )
-            except Exception:
-                # If editing caption fails, try editing text
-                await callback.message.edit_text(
-                    message_text,
-                    reply_markup=get_cart_item_kb(cart_item.id, user.language)
-                )
-        else:
-            if action_result == "minimum":
-                await callback.answer(_("Miqdor kamida 1 bo'lishi kerak."))
+    quantity_coalescer.submit(key, delta, apply)
 
+
+async def update_cart_item_quantity(callback: CallbackQuery, user, item_id, delta):
+    """Apply summed quantity change and edit cart item message once"""
+    try:
+        # Update quantity
+        cart_item, action_result = await queries.change_cart_item_quantity(item_id, delta)
     except CartItem.DoesNotExist:
-        await callback.answer(_("Mahsulot topilmadi."))
+        known_quantities.pop((user.telegram_id, item_id), None)
+        await callback.message.answer(_("Mahsulot topilmadi."))
+        return
+
+    if action_result == "minimum":
+        # Miqdor allaqachon 1 ga teng, xabar o'zgarmaydi
+        remember_quantity((user.telegram_id, item_id), 1)
+        return
+    remember_quantity((user.telegram_id, item_id), cart_item.quantity)
+
+    # Update current message
+    product_name = cart_item.color.product.get_name(user.language)
+    color_name = cart_item.color.get_name(user.language)
+    price = cart_item.color.price
+    quantity = cart_item.quantity
+    total = price * quantity
+
+    message_text = (
+        f"<b>{product_name}</b>\n"
+        f"<i>{color_name}</i>\n"
+        f"{_('Narxi')}: {price:,.0f} {_('so\'m')}\n"
+        f"{_('Soni')}: {quantity}\n"
+        f"{_('Jami')}: {total:,.0f} {_('so\'m')}"
+    )
+
+    try:
+        await callback.message.edit_caption(
+            caption=message_text,
+            reply_markup=get_cart_item_kb(cart_item.id, user.language)
+        )
+    except Exception:
+        # If editing caption fails, try editing text
+        await callback.message.edit_text(
+            message_text,
+            reply_markup=get_cart_item_kb(cart_item.id, user.language)
+        )
 
 
 async def clear_cart(callback: CallbackQuery, **kwargs):
@@ -377,13 +279,8 @@ async def clear_cart(callback: CallbackQuery, **kwargs):
         return
 
     try:
-        # Get cart and delete all items using sync_to_async
-        @sync_to_async
-        def clear_cart_items():
-            cart = Cart.objects.get(user=user, is_active=True)
-            cart.items.all().delete()
-
-        await clear_cart_items()
+        # Get cart and delete all items
+        await queries.clear_cart(user)
 
         await callback.answer(_("Savatcha tozalandi."))
         await callback.message.edit_text(
@@ -403,22 +300,18 @@ async def start_checkout(callback: CallbackQuery, state: FSMContext, **kwargs):
         await callback.answer(_("Iltimos, botni qaytadan ishga tushiring"))
         return
 
-    try:
-        # Get cart and check if it has items using sync_to_async
-        cart = await sync_to_async(Cart.objects.get)(user=user, is_active=True)
-        has_items = await sync_to_async(lambda: cart.items.exists())()
-
-        if has_items:
-            # Set state to waiting for address
-            await state.set_state(OrderStates.waiting_for_address)
-
-            await callback.message.delete()
-            await callback.message.answer(
-                _("Buyurtma berish uchun yetkazib berish manzilini kiriting:"),
-                reply_markup=types.ReplyKeyboardRemove()
-            )
-        else:
-            await callback.answer(_("Savatchagiz bo'sh."))
+    # Check if active cart has items
+    has_items = await queries.cart_has_items(user)
 
-    except Cart.DoesNotExist:
+    if has_items:
+        # Set state to waiting for address; checkout_key makes confirmation idempotent
+        await state.set_state(OrderStates.waiting_for_address)
+        await state.update_data(checkout_key=uuid4().hex)
+
+        await callback.message.delete()
+        await callback.message.answer(
+            _("Buyurtma berish uchun yetkazib berish manzilini kiriting:"),
+            reply_markup=types.ReplyKeyboardRemove()
+        )
+    else:
         await callback.answer(_("Savatchagiz bo'sh."))
\ No newline at end of file
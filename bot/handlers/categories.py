@@ -2,11 +2,15 @@ from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 from django.utils.translation import gettext as _
-from asgiref.sync import sync_to_async
 
 from store.models import Category
-from bot.keyboards.categories import get_categories_kb
+from bot.keyboards.categories import get_categories_kb, get_category_page_kb
 from bot.keyboards.common import get_main_menu_kb
+from bot.keyboards.products import get_product_page_kb
+from bot.utils.callbacks import Action
+from bot.utils.catalog import catalog
+from bot.utils.keyboard_cache import keyboard_cache
+from bot.utils.pagination import page_cursor
 
 
 def get_categories_router():
@@ -14,13 +18,21 @@ def get_categories_router():
 
     # Main menu buttons
     router.message.register(show_categories, F.text.in_(["🛍 Mahsulotlar katalogi", "🛍 Каталог товаров"]))
-    router.callback_query.register(show_categories_callback, F.data == "show_categories")
-    router.callback_query.register(show_category_products, F.data.startswith("category_"))
-    router.callback_query.register(back_to_categories, F.data == "back_to_categories")
 
     return router
 
 
+def get_categories_callbacks():
+    return {
+        Action.SHOW_CATEGORIES: show_categories_callback,
+        Action.CATEGORY: show_category_products,
+        Action.BACK_TO_CATEGORIES: back_to_categories,
+        Action.BACK_TO_PARENT: back_to_parent,
+        Action.CATEGORY_PAGE: show_category_page,
+        Action.PRODUCT_PAGE: show_product_page,
+    }
+
+
 async def show_categories(message: Message, **kwargs):
     """Show main categories"""
     # User ni kwargs dan olish
@@ -31,14 +43,14 @@ async def show_categories(message: Message, **kwargs):
 
     try:
         # Get main categories (parent=None)
-        categories = await sync_to_async(lambda: list(Category.objects.filter(parent=None, is_active=True)))()
+        snapshot = await catalog.get()
+        categories = snapshot.root_categories()
 
         if categories:
             text = _("Kategoriyani tanlang:") if user.language == 'uz' else "Выберите категорию:"
-            from bot.keyboards.categories import get_categories_kb
             await message.answer(
                 text,
-                reply_markup=get_categories_kb(categories, user.language)
+                reply_markup=get_category_page_kb(snapshot, None, user.language)
             )
         else:
             await message.answer(
@@ -60,14 +72,14 @@ async def show_categories_callback(callback: CallbackQuery, **kwargs):
         return
 
     try:
-        categories = await sync_to_async(lambda: list(Category.objects.filter(parent=None, is_active=True)))()
+        snapshot = await catalog.get()
+        categories = snapshot.root_categories()
 
         if categories:
             text = _("Kategoriyani tanlang:") if user.language == 'uz' else "Выберите категорию:"
-            from bot.keyboards.categories import get_categories_kb
             await callback.message.edit_text(
                 text,
-                reply_markup=get_categories_kb(categories, user.language)
+                reply_markup=get_category_page_kb(snapshot, None, user.language)
             )
         else:
             await callback.message.edit_text(
@@ -78,7 +90,7 @@ async def show_categories_callback(callback: CallbackQuery, **kwargs):
         await callback.answer(_("Xatolik yuz berdi"))
 
 
-async def show_category_products(callback: CallbackQuery, **kwargs):
+async def show_category_products(callback: CallbackQuery, category_id, **kwargs):
     """Show products in selected category"""
     user = kwargs.get('user')
     if not user:
@@ -86,43 +98,37 @@ async def show_category_products(callback: CallbackQuery, **kwargs):
         return
 
     try:
-        category_id = int(callback.data.split('_')[1])
-
-        # Get category
-        category = await sync_to_async(Category.objects.get)(id=category_id, is_active=True)
-
-        # Check if category has children
-        children = await sync_to_async(lambda: list(category.children.filter(is_active=True)))()
+        # Get category with its children (or products if it has no children)
+        snapshot = await catalog.get()
+        breadcrumb, children, products = snapshot.category_listing(category_id)
+        category = breadcrumb[-1]
 
         if children:
             # Show subcategories
-            text = f"{category.get_name(user.language)}"
-            from bot.keyboards.categories import get_categories_kb
+            text = " → ".join(item.get_name(user.language) for item in breadcrumb)
             await callback.message.edit_text(
                 text,
-                reply_markup=get_categories_kb(children, user.language, parent_id=category_id)
+                reply_markup=get_category_page_kb(snapshot, category_id, user.language)
             )
         else:
             # Show products in this category
-            products = await sync_to_async(lambda: list(category.products.filter(is_active=True)))()
-
             if products:
                 text = f"{category.get_name(user.language)} → {_('Mahsulotlar:')}"
-                from bot.keyboards.products import get_product_actions_kb
                 await callback.message.edit_text(
                     text,
-                    reply_markup=get_product_actions_kb(products, user.language, category_id)
+                    reply_markup=get_product_page_kb(snapshot, category_id, user.language)
                 )
             else:
                 await callback.message.edit_text(
                     f"{category.get_name(user.language)} → {_('Bu kategoriyada mahsulotlar mavjud emas.')}",
-                    reply_markup=get_categories_kb([category], user.language, show_back=True)
+                    reply_markup=keyboard_cache.get(
+                        ('empty_category', category_id, user.language, snapshot.version),
+                        get_categories_kb, [category], user.language, show_back=True
+                    )
                 )
 
     except Category.DoesNotExist:
         await callback.answer(_("Kategoriya topilmadi"))
-    except ValueError:
-        await callback.answer(_("Noto'g'ri kategoriya ID"))
     except Exception as e:
         await callback.answer(_("Xatolik yuz berdi"))
 
@@ -134,4 +140,54 @@ async def back_to_categories(callback: CallbackQuery, **kwargs):
         await callback.answer(_("Iltimos, botni qaytadan ishga tushiring"))
         return
 
-    await show_categories_callback(callback, **kwargs)
\ No newline at end of file
+    await show_categories_callback(callback, **kwargs)
+
+
+async def back_to_parent(callback: CallbackQuery, category_id, **kwargs):
+    """Go back from subcategories of category to the list it was chosen from"""
+    user = kwargs.get('user')
+    if not user:
+        await callback.answer(_("Iltimos, botni qaytadan ishga tushiring"))
+        return
+
+    snapshot = await catalog.get()
+    category = snapshot.categories.get(category_id)
+    if category is not None and category.parent_id in snapshot.categories:
+        await show_category_products(callback, category.parent_id, **kwargs)
+    else:
+        await show_categories_callback(callback, **kwargs)
+
+
+async def show_category_page(callback: CallbackQuery, category_id, direction, cursor_id, **kwargs):
+    """Previous/next page of subcategories (root categories if category_id is 0)"""
+    await show_list_page(callback, 'categories', category_id or None, direction, cursor_id, **kwargs)
+
+
+async def show_product_page(callback: CallbackQuery, category_id, direction, cursor_id, **kwargs):
+    """Previous/next page of category products"""
+    await show_list_page(callback, 'products', category_id, direction, cursor_id, **kwargs)
+
+
+async def show_list_page(callback: CallbackQuery, kind, entity_id, direction, cursor_id, **kwargs):
+    """Show previous/next page of a category or product list (only keyboard changes)"""
+    user = kwargs.get('user')
+    if not user:
+        await callback.answer(_("Iltimos, botni qaytadan ishga tushiring"))
+        return
+
+    try:
+        cursor = page_cursor(direction, cursor_id)
+        snapshot = await catalog.get()
+
+        if kind == 'products':
+            keyboard = get_product_page_kb(snapshot, entity_id, user.language, cursor)
+        else:
+            keyboard = get_category_page_kb(snapshot, entity_id, user.language, cursor)
+
+        await callback.message.edit_reply_markup(reply_markup=keyboard)
+        await callback.answer()
+
+    except Category.DoesNotExist:
+        await callback.answer(_("Kategoriya topilmadi"))
+    except ValueError:
+        await callback.answer(_("Xatolik yuz berdi"))
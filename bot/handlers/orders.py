@@ -3,12 +3,11 @@ from aiogram.types import Message, CallbackQuery, KeyboardButton
 from aiogram.fsm.context import FSMContext
 from aiogram.utils.keyboard import ReplyKeyboardBuilder
 from django.utils.translation import gettext as _
-from decimal import Decimal
-from asgiref.sync import sync_to_async
 
-from store.models import Cart, Order, OrderItem
+from store.models import Cart
 from bot.handlers.cart import OrderStates
 from bot.keyboards.common import get_main_menu_kb
+from bot.utils import queries
 
 
 def get_orders_router():
@@ -21,28 +20,6 @@ def get_orders_router():
     return router
 
 
-@sync_to_async
-def get_cart_summary_data(cart, language):
-    """Get cart summary data for order confirmation"""
-    items_data = []
-    for item in cart.items.select_related('color__product').all():
-        product_name = item.color.product.get_name(language)
-        color_name = item.color.get_name(language)
-        price = item.color.price
-        quantity = item.quantity
-        item_total = price * quantity
-
-        items_data.append({
-            'product_name': product_name,
-            'color_name': color_name,
-            'price': price,
-            'quantity': quantity,
-            'item_total': item_total
-        })
-
-    return items_data
-
-
 async def process_address(message: Message, state: FSMContext, **kwargs):
     """Process delivery address input"""
     # User ni kwargs dan olish
@@ -58,14 +35,8 @@ async def process_address(message: Message, state: FSMContext, **kwargs):
     await state.update_data(address=message.text)
 
     try:
-        # Get cart using sync_to_async
-        cart = await sync_to_async(Cart.objects.get)(user=user, is_active=True)
-
-        # Get total price using sync_to_async
-        total_price = await sync_to_async(cart.get_total_price)()
-
-        # Get cart items data using sync_to_async
-        cart_items_data = await get_cart_summary_data(cart, user.language)
+        # Get cart items data and total price
+        cart_items_data, total_price = await queries.get_order_summary(user, user.language)
 
         # Prepare order summary
         items_text = ""
@@ -168,38 +139,8 @@ async def process_order_confirm(message: Message, state: FSMContext, **kwargs):
         state_data = await state.get_data()
         address = state_data.get('address', '')
 
-        # Create order and process cart using sync_to_async
-        @sync_to_async
-        def create_order_and_process_cart():
-            # Get cart
-            cart = Cart.objects.get(user=user, is_active=True)
-            total_price = cart.get_total_price()
-
-            # Create order
-            order = Order.objects.create(
-                user=user,
-                address=address,
-                total_price=Decimal(str(total_price))
-            )
-
-            # Create order items
-            for item in cart.items.select_related('color__product').all():
-                OrderItem.objects.create(
-                    order=order,
-                    product_name=item.color.product.name_uz,  # Store current names
-                    color_name=item.color.name_uz,
-                    price=item.color.price,
-                    quantity=item.quantity
-                )
-
-            # Mark cart as inactive
-            cart.is_active = False
-            cart.save()
-
-            return order
-
-        # Create order
-        order = await create_order_and_process_cart()
+        # Create order and process cart (repeated confirm returns the same order)
+        order, _created = await queries.create_order(user, address, state_data.get('checkout_key'))
 
         # Send confirmation
         await message.answer(
@@ -1,102 +1,50 @@
-from aiogram import Router, F
-from aiogram.types import Message, CallbackQuery, FSInputFile
-from aiogram.fsm.context import FSMContext
+from aiogram.types import Message, CallbackQuery
 from django.utils.translation import gettext as _
-from asgiref.sync import sync_to_async
-from django.conf import settings
-import os
-import requests
-from PIL import Image
-import io
-
-from store.models import Category, Product, Color, Cart, CartItem
-from bot.keyboards.products import get_product_colors_kb, get_product_actions_kb, get_add_to_cart_kb
+import asyncio
+
+from store.models import Category, Product, Color
+from bot.keyboards.products import get_product_colors_kb, get_product_page_kb, get_add_to_cart_kb
 from bot.keyboards.categories import get_categories_kb
 from bot.keyboards.common import get_back_btn
+from bot.utils import queries
+from bot.utils.callbacks import Action
+from bot.utils.catalog import catalog
+from bot.utils.keyboard_cache import keyboard_cache
+from bot.utils.log import get_logger
+from bot.utils.media import answer_photo, answer_media_group, telegram_image_path
 
 
-def get_products_router():
-    router = Router()
-
-    # Register handlers with F filter
-    router.callback_query.register(process_product, F.data.startswith("product_"))
-    router.callback_query.register(process_color, F.data.startswith("color_"))
-    router.callback_query.register(process_add_to_cart, F.data.startswith("add_to_cart_"))
-    router.callback_query.register(back_to_category, F.data.startswith("back_to_category_"))
-    router.callback_query.register(back_to_product, F.data.startswith("back_to_product_"))
-
-    return router
-
-
-def get_image_file_path(image_field):
-    """Get file path for image field"""
-    if not image_field:
-        return None
-
-    try:
-        # Get full file path
-        file_path = os.path.join(settings.MEDIA_ROOT, str(image_field))
-        if os.path.exists(file_path):
-            return file_path
-        return None
-    except Exception as e:
-        print(f"DEBUG: Error getting image file path: {e}")
-        return None
-
-
-def validate_image_for_telegram(file_path):
-    """Validate image for Telegram compatibility"""
-    if not file_path or not os.path.exists(file_path):
-        return False
-
-    try:
-        # Check file size (max 10MB for photos)
-        file_size = os.path.getsize(file_path)
-        if file_size > 10 * 1024 * 1024:  # 10MB
-            print(f"DEBUG: File too large: {file_size} bytes")
-            return False
-
-        # Check if it's a valid image
-        with Image.open(file_path) as img:
-            # Check format
-            if img.format not in ['JPEG', 'PNG', 'GIF', 'WEBP']:
-                print(f"DEBUG: Unsupported format: {img.format}")
-                return False
+log = get_logger(__name__)
 
-            # Check dimensions (max 10000x10000)
-            if img.width > 10000 or img.height > 10000:
-                print(f"DEBUG: Image too large: {img.width}x{img.height}")
-                return False
 
-        return True
-    except Exception as e:
-        print(f"DEBUG: Error validating image: {e}")
-        return False
+def get_products_callbacks():
+    return {
+        Action.PRODUCT: process_product,
+        Action.COLOR: process_color,
+        Action.ADD_TO_CART: process_add_to_cart,
+        Action.BACK_TO_CATEGORY: back_to_category,
+        Action.BACK_TO_PRODUCT: back_to_product,
+    }
 
 
-async def show_category_products(message: Message, user, category):
-    """Show products in a category"""
-    # Get products using sync_to_async
-    products = await sync_to_async(lambda: list(Product.objects.filter(categories=category, is_active=True)))()
+async def show_category_products(message: Message, user, snapshot, category, products, parent):
+    """Show products in a category (products of its whole subtree)"""
 
     if products:
         await message.answer(
             _("{category} kategoriyasidagi mahsulotlar:").format(
                 category=category.get_name(user.language)
             ),
-            reply_markup=get_product_actions_kb(products, user.language, category.id)
+            reply_markup=get_product_page_kb(snapshot, category.id, user.language)
         )
     else:
-        # Get parent categories using sync_to_async
-        parent_categories = await sync_to_async(
-            lambda: list(Category.objects.filter(children=category, is_active=True)))()
-
-        if parent_categories:
-            parent = parent_categories[0]
+        if parent:
             await message.answer(
                 _("Bu kategoriyada hech qanday mahsulot yo'q."),
-                reply_markup=get_categories_kb([parent], user.language,
-                                               parent_id=parent.parent_id if parent.parent else None)
+                reply_markup=keyboard_cache.get(
+                    ('parent_category', parent.id, user.language, snapshot.version),
+                    get_categories_kb, [parent], user.language, parent_id=parent.parent_id
+                )
             )
         else:
             await message.answer(
@@ -108,22 +56,22 @@ async def show_category_products(message: Message, user, category):
 async def send_product_message(message_or_callback, text_content, keyboard, image_path=None, is_callback=False):
     """Universal function to send product message with or without image"""
     try:
-        if image_path and validate_image_for_telegram(image_path):
+        if image_path:
             # Try to send with image
             if is_callback:
                 await message_or_callback.message.delete()
-                await message_or_callback.message.answer_photo(
-                    photo=FSInputFile(image_path),
+                await answer_photo(
+                    message_or_callback.message, image_path,
                     caption=text_content,
                     reply_markup=keyboard
                 )
             else:
-                await message_or_callback.answer_photo(
-                    photo=FSInputFile(image_path),
+                await answer_photo(
+                    message_or_callback, image_path,
                     caption=text_content,
                     reply_markup=keyboard
                 )
-            print("DEBUG: Successfully sent message with photo")
+            log.debug("product.sent", photo=True)
             return True
         else:
             # Send text message
@@ -139,10 +87,10 @@ async def send_product_message(message_or_callback, text_content, keyboard, imag
                     text_content,
                     reply_markup=keyboard
                 )
-            print("DEBUG: Successfully sent text message")
+            log.debug("product.sent", photo=False)
             return True
     except Exception as e:
-        print(f"DEBUG: Error in send_product_message: {e}")
+        log.warning("product.send_failed", error=e)
         # Final fallback - just send text
         try:
             if is_callback:
@@ -158,36 +106,24 @@ async def send_product_message(message_or_callback, text_content, keyboard, imag
                 )
             return True
         except Exception as e2:
-            print(f"DEBUG: Final fallback failed: {e2}")
+            log.error("product.fallback_failed", error=e2)
             return False
 
 
-async def process_product(callback: CallbackQuery, **kwargs):
+async def process_product(callback: CallbackQuery, product_id, category_id, **kwargs):
     """Process product selection"""
-    print(f"DEBUG: process_product called with data: {callback.data}")
-
     # User ni kwargs dan olish
     user = kwargs.get('user')
     if not user:
-        print("DEBUG: User not found in kwargs")
         await callback.answer(_("Iltimos, botni qaytadan ishga tushiring"))
         return
 
-    print(f"DEBUG: User found: {user.telegram_id}")
-
     try:
-        product_id = int(callback.data.split('_')[1])
-        category_id = int(callback.data.split('_')[2]) if len(callback.data.split('_')) > 2 else None
-
-        print(f"DEBUG: Parsed IDs - product: {product_id}, category: {category_id}")
+        # Get product with its colors
+        snapshot = await catalog.get()
+        product, colors = snapshot.product_view(product_id)
 
-        # Get product using sync_to_async
-        product = await sync_to_async(Product.objects.get)(id=product_id)
-
-        # Get product colors using sync_to_async
-        colors = await sync_to_async(lambda: list(product.colors.filter(is_active=True)))()
-
-        print(f"DEBUG: Found {len(colors)} colors for product")
+        log.debug("product.view", product_id=product_id, category_id=category_id, colors=len(colors))
 
         # Get product details
         name = product.get_name(user.language)
@@ -195,13 +131,13 @@ async def process_product(callback: CallbackQuery, **kwargs):
 
         # Prepare product info
         text_content = f"<b>{name}</b>\n\n{description}"
-        keyboard = get_product_colors_kb(colors, user.language, product.id, category_id)
+        keyboard = keyboard_cache.get(
+            ('colors', (product.id, category_id), user.language, snapshot.version),
+            get_product_colors_kb, colors, user.language, product.id, category_id
+        )
 
-        # Get image path if available
-        image_path = None
-        if product.main_image:
-            image_path = get_image_file_path(product.main_image)
-            print(f"DEBUG: Product image file path: {image_path}")
+        # Get image path if available (and valid for Telegram)
+        image_path = await telegram_image_path(product.main_image)
 
         # Send message
         success = await send_product_message(
@@ -212,45 +148,27 @@ async def process_product(callback: CallbackQuery, **kwargs):
             await callback.answer(_("Xatolik yuz berdi."))
 
     except Product.DoesNotExist:
-        print("DEBUG: Product not found")
+        log.debug("product.not_found", product_id=product_id)
         await callback.answer(_("Mahsulot topilmadi."))
-    except Exception as e:
-        print(f"DEBUG: Error in process_product: {e}")
+    except Exception:
+        log.exception("product.failed", product_id=product_id)
         await callback.answer(_("Xatolik yuz berdi."))
 
     await callback.answer()
 
 
-async def process_color(callback: CallbackQuery, **kwargs):
+async def process_color(callback: CallbackQuery, color_id, product_id, category_id, **kwargs):
     """Process color selection"""
-    print(f"DEBUG: process_color called with data: {callback.data}")
-
     # User ni kwargs dan olish
     user = kwargs.get('user')
     if not user:
-        print("DEBUG: User not found in kwargs")
         await callback.answer(_("Iltimos, botni qaytadan ishga tushiring"))
         return
 
-    print(f"DEBUG: User found: {user.telegram_id}")
-
     try:
-        parts = callback.data.split('_')
-        if len(parts) < 3:
-            print(f"DEBUG: Invalid callback data format: {callback.data}")
-            await callback.message.answer(f"Noto'g'ri callback data: {callback.data}")
-            return
-
-        color_id = int(parts[1])
-        product_id = int(parts[2])
-        category_id = int(parts[3]) if len(parts) > 3 else None
-
-        print(f"DEBUG: Parsed IDs - color: {color_id}, product: {product_id}, category: {category_id}")
-
-        # Get color and product using sync_to_async with select_related
-        color = await sync_to_async(
-            lambda: Color.objects.select_related('product').get(id=color_id)
-        )()
+        # Get color (with product) and its image paths
+        snapshot = await catalog.get()
+        color, color_images = snapshot.color_view(color_id)
 
         # Get color details
         color_name = color.get_name(user.language)
@@ -262,179 +180,114 @@ async def process_color(callback: CallbackQuery, **kwargs):
                   f"<i>{color_name}</i>\n" \
                   f"{_('Narxi')}: {price:,.0f} {_('so\'m')}"
 
-        keyboard = get_add_to_cart_kb(color.id, product_id, category_id, user.language)
+        keyboard = keyboard_cache.get(
+            ('add_to_cart', (color.id, product_id, category_id), user.language, snapshot.version),
+            get_add_to_cart_kb, color.id, product_id, category_id, user.language
+        )
 
         # Always delete previous message
         await callback.message.delete()
 
-        # Check for color images
-        has_images = await sync_to_async(lambda: color.images.exists())()
-        print(f"DEBUG: Color has images: {has_images}")
+        # Validate color images (metadata is precomputed, files are not opened here)
+        image_paths = [
+            path for path in await asyncio.gather(
+                *(telegram_image_path(image) for image in color_images)
+            ) if path
+        ]
+        log.debug("color.view", color_id=color_id, product_id=product_id, images=len(image_paths))
 
         image_sent = False
-
-        if has_images:
-            # Get images using sync_to_async
-            color_images = await sync_to_async(lambda: list(color.images.all()))()
-
-            # Try to send first image
-            for color_image in color_images:
-                file_path = get_image_file_path(color_image.image)
-                print(f"DEBUG: Color image file path: {file_path}")
-
-                if file_path and validate_image_for_telegram(file_path):
-                    try:
-                        await callback.message.answer_photo(
-                            photo=FSInputFile(file_path),
-                            caption=caption,
-                            reply_markup=keyboard
-                        )
-                        print("DEBUG: Successfully sent color photo")
-                        image_sent = True
-
-                        # Send additional images without caption
-                        for additional_image in color_images[1:]:
-                            additional_path = get_image_file_path(additional_image.image)
-                            if additional_path and validate_image_for_telegram(additional_path):
-                                try:
-                                    await callback.message.answer_photo(
-                                        photo=FSInputFile(additional_path)
-                                    )
-                                except Exception as e:
-                                    print(f"DEBUG: Error sending additional image: {e}")
-                        break
-                    except Exception as e:
-                        print(f"DEBUG: Error sending color photo: {e}")
-                        continue
-
-        # If no color images sent, try product main image
-        if not image_sent and color.product.main_image:
-            file_path = get_image_file_path(color.product.main_image)
-            if file_path and validate_image_for_telegram(file_path):
+        album = []  # gallery messages already delivered
+
+        if len(image_paths) == 1:
+            # Single image with caption and keyboard
+            try:
+                await answer_photo(
+                    callback.message, image_paths[0],
+                    caption=caption,
+                    reply_markup=keyboard
+                )
+                image_sent = True
+            except Exception as e:
+                log.warning("color.photo_failed", color_id=color_id, error=e)
+        elif image_paths:
+            # Gallery as media group(s), then caption with keyboard
+            try:
+                await answer_media_group(callback.message, image_paths, messages=album)
+                await callback.message.answer(
+                    caption,
+                    reply_markup=keyboard
+                )
+                image_sent = True
+            except Exception as e:
+                log.warning("color.media_group_failed", color_id=color_id, error=e)
+
+        # If no color images sent, try product main image (not after a partly sent gallery)
+        if not image_sent and not album:
+            file_path = await telegram_image_path(color.product.main_image)
+            if file_path:
                 try:
-                    await callback.message.answer_photo(
-                        photo=FSInputFile(file_path),
+                    await answer_photo(
+                        callback.message, file_path,
                         caption=caption,
                         reply_markup=keyboard
                     )
-                    print("DEBUG: Successfully sent product main image")
                     image_sent = True
                 except Exception as e:
-                    print(f"DEBUG: Error sending product main image: {e}")
+                    log.warning("color.main_image_failed", color_id=color_id, error=e)
 
         # If no image sent, send text message
         if not image_sent:
-            print("DEBUG: Sending text message instead of photo")
+            log.debug("color.text_only", color_id=color_id)
             await callback.message.answer(
                 caption,
                 reply_markup=keyboard
             )
 
     except (Color.DoesNotExist, Product.DoesNotExist) as e:
-        print(f"DEBUG: Object not found: {e}")
+        log.debug("color.not_found", color_id=color_id, error=e)
         await callback.answer(_("Mahsulot yoki rang topilmadi."))
     except Exception as e:
-        print(f"DEBUG: Error in process_color: {e}")
+        log.exception("color.failed", color_id=color_id)
         await callback.message.answer(f"Xato: {str(e)}")
 
     await callback.answer()
 
 
-async def process_add_to_cart(callback: CallbackQuery, **kwargs):
+async def process_add_to_cart(callback: CallbackQuery, color_id, **kwargs):
     """Add product to cart"""
-    print(f"DEBUG: add_to_cart called with data: {callback.data}")
-
     # User ni kwargs dan olish
     user = kwargs.get('user')
     if not user:
-        print("DEBUG: User not found in kwargs")
         await callback.answer(_("Iltimos, botni qaytadan ishga tushiring"))
         return
 
-    print(f"DEBUG: User found: {user.telegram_id}")
-
     try:
-        # Callback data parse qilish
-        parts = callback.data.split('_')
-        print(f"DEBUG: Callback data parts: {parts}")
-
-        if len(parts) < 4:
-            print(f"DEBUG: Invalid callback data format: {callback.data}")
-            await callback.answer("Noto'g'ri ma'lumot formati")
-            return
-
-        color_id = int(parts[3])  # add_to_cart_COLOR_ID
         quantity = 1
 
-        print(f"DEBUG: Adding color_id: {color_id} to cart")
-
-        # Test: Cart yaratish yoki olish va product ma'lumotlarini olish
-        @sync_to_async
-        def add_to_cart():
-            print(f"DEBUG: Creating/getting cart for user: {user.telegram_id}")
-
-            # Get color with related product data
-            color = Color.objects.select_related('product').get(id=color_id)
-            print(f"DEBUG: Color found: {color.name_uz} - {color.price}")
-
-            # Get or create active cart for user
-            cart, created = Cart.objects.get_or_create(
-                user=user,
-                is_active=True
-            )
-            print(f"DEBUG: Cart {'created' if created else 'found'}: {cart.id}")
-
-            # Check if item already in cart
-            cart_item, item_created = CartItem.objects.get_or_create(
-                cart=cart,
-                color=color,
-                defaults={'quantity': quantity}
-            )
-            print(f"DEBUG: Cart item {'created' if item_created else 'found'}: {cart_item.id}")
-
-            # If item already exists, increase quantity
-            if not item_created:
-                cart_item.quantity += quantity
-                cart_item.save()
-                print(f"DEBUG: Updated quantity to: {cart_item.quantity}")
-
-            # Return cart item with product and color info
-            return {
-                'cart_item': cart_item,
-                'product_name': color.product.get_name(user.language),
-                'color_name': color.get_name(user.language),
-                'price': color.price,
-                'quantity': cart_item.quantity
-            }
-
-        result = await add_to_cart()
-        cart_item = result['cart_item']
-        print(f"DEBUG: Successfully added to cart - item_id: {cart_item.id}")
+        color, cart_item = await queries.add_to_cart(user, color_id, quantity)
+        log.debug("cart.added", color_id=color_id, item_id=cart_item.id, quantity=cart_item.quantity)
 
         # Success message
         await callback.answer(_("Mahsulot savatchaga qo'shildi!"), show_alert=True)
 
         # Optional: Show updated cart info
         await callback.message.answer(
-            f"✅ {result['product_name']} ({result['color_name']}) savatchaga qo'shildi!\n"
-            f"Miqdor: {result['quantity']}\n"
-            f"Narxi: {result['price']:,.0f} so'm"
+            f"✅ {color.product.get_name(user.language)} ({color.get_name(user.language)}) savatchaga qo'shildi!\n"
+            f"Miqdor: {cart_item.quantity}\n"
+            f"Narxi: {color.price:,.0f} so'm"
         )
 
     except Color.DoesNotExist:
-        print(f"DEBUG: Color not found with id: {color_id}")
+        log.debug("color.not_found", color_id=color_id)
         await callback.answer(_("Mahsulot topilmadi."))
     except Exception as e:
-        print(f"DEBUG: Error in process_add_to_cart: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log.exception("cart.add_failed", color_id=color_id)
         await callback.answer(f"Xatolik: {str(e)}")
 
 
-async def back_to_category(callback: CallbackQuery, **kwargs):
+async def back_to_category(callback: CallbackQuery, category_id, **kwargs):
     """Return to category products"""
-    print(f"DEBUG: back_to_category called with data: {callback.data}")
-
     # User ni kwargs dan olish
     user = kwargs.get('user')
     if not user:
@@ -442,25 +295,24 @@ async def back_to_category(callback: CallbackQuery, **kwargs):
         return
 
     try:
-        category_id = int(callback.data.split('_')[3])
-
-        # Get category using sync_to_async
-        category = await sync_to_async(Category.objects.get)(id=category_id)
+        # Get category, its subtree products and parent
+        snapshot = await catalog.get()
+        category, products, parent = snapshot.category_products(category_id)
         await callback.message.delete()  # Delete current message
 
         # Import qilishda xatolik bo'lmasligi uchun to'g'ridan-to'g'ri chaqirish
-        await show_category_products(callback.message, user, category)
+        await show_category_products(callback.message, user, snapshot, category, products, parent)
 
     except Category.DoesNotExist:
         await callback.answer(_("Kategoriya topilmadi."))
-    except Exception as e:
-        print(f"DEBUG: Error in back_to_category: {e}")
+    except Exception:
+        log.exception("category.back_failed", category_id=category_id)
         await callback.answer(_("Xatolik yuz berdi."))
 
     await callback.answer()
 
 
-async def back_to_product(callback: CallbackQuery, **kwargs):
+async def back_to_product(callback: CallbackQuery, product_id, category_id, **kwargs):
     """Return to product details"""
     # User ni kwargs dan olish
     user = kwargs.get('user')
@@ -468,37 +320,33 @@ async def back_to_product(callback: CallbackQuery, **kwargs):
         await callback.answer(_("Iltimos, botni qaytadan ishga tushiring"))
         return
 
-    product_id = int(callback.data.split('_')[3])
-    category_id = int(callback.data.split('_')[4]) if len(callback.data.split('_')) > 4 else None
-
     try:
-        # Get product using sync_to_async
-        product = await sync_to_async(Product.objects.get)(id=product_id)
+        # Get product with its colors
+        snapshot = await catalog.get()
+        product, colors = snapshot.product_view(product_id)
 
         # Process product without changing callback data
-        await process_product_direct(callback, user, product, category_id)
+        await process_product_direct(callback, user, product, colors, category_id, snapshot.version)
 
     except Product.DoesNotExist:
         await callback.answer(_("Mahsulot topilmadi."))
 
 
-async def process_product_direct(callback: CallbackQuery, user, product, category_id):
+async def process_product_direct(callback: CallbackQuery, user, product, colors, category_id, version):
     """Process product directly without callback data manipulation"""
     try:
-        # Get product colors using sync_to_async
-        colors = await sync_to_async(lambda: list(product.colors.filter(is_active=True)))()
-
         # Get product details
         name = product.get_name(user.language)
         description = product.get_description(user.language) or _("Tavsif mavjud emas.")
 
         text_content = f"<b>{name}</b>\n\n{description}"
-        keyboard = get_product_colors_kb(colors, user.language, product.id, category_id)
+        keyboard = keyboard_cache.get(
+            ('colors', (product.id, category_id), user.language, version),
+            get_product_colors_kb, colors, user.language, product.id, category_id
+        )
 
-        # Get image path if available
-        image_path = None
-        if product.main_image:
-            image_path = get_image_file_path(product.main_image)
+        # Get image path if available (and valid for Telegram)
+        image_path = await telegram_image_path(product.main_image)
 
         # Send message
         success = await send_product_message(
@@ -508,8 +356,8 @@ async def process_product_direct(callback: CallbackQuery, user, product, categor
         if not success:
             await callback.answer(_("Xatolik yuz berdi."))
 
-    except Exception as e:
-        print(f"DEBUG: Error in process_product_direct: {e}")
+    except Exception:
+        log.exception("product.failed", product_id=product.id)
         await callback.answer(_("Xatolik yuz berdi."))
 
     await callback.answer()
\ No newline at end of file
@@ -0,0 +1,101 @@
+from html import escape
+
+from aiogram import Router, F
+from aiogram.filters import Command, CommandObject
+from aiogram.types import Message, InlineQuery
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
+from django.conf import settings
+from django.utils.translation import gettext as _
+
+from bot.keyboards.products import get_search_results_kb
+from bot.utils import queries
+from bot.utils.catalog import catalog
+from bot.utils.inline import inline_search
+
+
+class SearchStates(StatesGroup):
+    waiting_for_query = State()
+
+
+def get_search_router():
+    router = Router()
+
+    # Register handlers
+    router.message.register(start_search, F.text.in_(["🔍 Qidiruv", "🔍 Поиск"]))
+    router.message.register(search_command, Command("search"))
+    router.message.register(process_search_query, SearchStates.waiting_for_query, F.text)
+    router.inline_query.register(process_inline_query)
+
+    return router
+
+
+async def start_search(message: Message, state: FSMContext, **kwargs):
+    """Ask for search query"""
+    user = kwargs.get('user')
+    if not user:
+        await message.answer(
+            _("Iltimos, botni qaytadan ishga tushirish uchun /start buyrug'ini yuboring")
+        )
+        return
+
+    await state.set_state(SearchStates.waiting_for_query)
+    if user.language == 'uz':
+        await message.answer("🔍 Mahsulot nomini yozing (lotin yoki kirill harflarida):")
+    else:
+        await message.answer("🔍 Введите название товара (латиницей или кириллицей):")
+
+
+async def search_command(message: Message, command: CommandObject, state: FSMContext, **kwargs):
+    """/search <query>: search right away, or ask for query if it is empty"""
+    if not command.args:
+        await start_search(message, state, **kwargs)
+        return
+    await send_search_results(message, command.args, kwargs.get('user'))
+
+
+async def process_search_query(message: Message, state: FSMContext, **kwargs):
+    """Search products by the entered text"""
+    user = kwargs.get('user')
+    if not user:
+        await message.answer(_("Iltimos, botni qaytadan ishga tushiring"))
+        return
+
+    await state.clear()
+    await send_search_results(message, message.text, user)
+
+
+async def send_search_results(message: Message, query, user):
+    if not user:
+        await message.answer(_("Iltimos, botni qaytadan ishga tushiring"))
+        return
+
+    products = await queries.search_products(query, settings.BOT_SEARCH_LIMIT)
+    if not products:
+        if user.language == 'uz':
+            await message.answer("😔 Hech narsa topilmadi. Boshqacha yozib ko'ring.")
+        else:
+            await message.answer("😔 Ничего не найдено. Попробуйте написать иначе.")
+        return
+
+    if user.language == 'uz':
+        text = f"🔍 <b>{escape(query)}</b> bo'yicha natijalar:"
+    else:
+        text = f"🔍 Результаты по запросу <b>{escape(query)}</b>:"
+    await message.answer(text, reply_markup=get_search_results_kb(products, user.language))
+
+
+async def process_inline_query(inline_query: InlineQuery, **kwargs):
+    """@bot <query>: ranked products with photos and color prices"""
+    user = kwargs.get('user')
+    language = user.language if user else 'uz'
+    offset = int(inline_query.offset) if inline_query.offset.isdigit() else 0
+
+    snapshot = await catalog.get()
+    results, next_offset = await inline_search.page(snapshot, inline_query.query, language, offset)
+    await inline_query.answer(
+        results,
+        cache_time=settings.BOT_INLINE_CACHE_TTL,
+        is_personal=True,  # natijalar foydalanuvchi tiliga bog'liq
+        next_offset=next_offset,
+    )
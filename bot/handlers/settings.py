@@ -4,10 +4,12 @@ from aiogram.types import Message, CallbackQuery, ReplyKeyboardMarkup, KeyboardB
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from django.utils.translation import gettext as _
-from asgiref.sync import sync_to_async
 
 from store.models import User
 from bot.keyboards.common import get_main_menu_kb, get_language_kb
+from bot.utils.callbacks import Action, LANGUAGES, pack
+from bot.utils.user_cache import user_cache
+from bot.utils import queries
 
 
 class SettingsStates(StatesGroup):
@@ -20,29 +22,34 @@ def get_settings_router():
 
     # Register handlers
     router.message.register(show_settings, F.text.in_(["⚙️ Sozlamalar", "⚙️ Настройки"]))
-    router.callback_query.register(change_language, F.data.startswith("change_lang"))
-    router.callback_query.register(change_phone, F.data == "change_phone")
-    router.callback_query.register(change_name, F.data == "change_name")
-    router.callback_query.register(process_language_change, F.data.startswith("new_lang_"))
     router.message.register(process_phone_change, SettingsStates.waiting_for_phone)
     router.message.register(process_name_change, SettingsStates.waiting_for_name)
 
     return router
 
 
+def get_settings_callbacks():
+    return {
+        Action.CHANGE_LANGUAGE: change_language,
+        Action.CHANGE_PHONE: change_phone,
+        Action.CHANGE_NAME: change_name,
+        Action.NEW_LANGUAGE: process_language_change,
+    }
+
+
 def get_settings_kb(user_language):
     """Create settings keyboard"""
     if user_language == 'uz':
         keyboard = [
-            [InlineKeyboardButton(text="🌐 Tilni o'zgartirish", callback_data="change_lang")],
-            [InlineKeyboardButton(text="📱 Telefon raqamini o'zgartirish", callback_data="change_phone")],
-            [InlineKeyboardButton(text="👤 Ismni o'zgartirish", callback_data="change_name")]
+            [InlineKeyboardButton(text="🌐 Tilni o'zgartirish", callback_data=pack(Action.CHANGE_LANGUAGE))],
+            [InlineKeyboardButton(text="📱 Telefon raqamini o'zgartirish", callback_data=pack(Action.CHANGE_PHONE))],
+            [InlineKeyboardButton(text="👤 Ismni o'zgartirish", callback_data=pack(Action.CHANGE_NAME))]
         ]
     else:
         keyboard = [
-            [InlineKeyboardButton(text="🌐 Изменить язык", callback_data="change_lang")],
-            [InlineKeyboardButton(text="📱 Изменить номер телефона", callback_data="change_phone")],
-            [InlineKeyboardButton(text="👤 Изменить имя", callback_data="change_name")]
+            [InlineKeyboardButton(text="🌐 Изменить язык", callback_data=pack(Action.CHANGE_LANGUAGE))],
+            [InlineKeyboardButton(text="📱 Изменить номер телефона", callback_data=pack(Action.CHANGE_PHONE))],
+            [InlineKeyboardButton(text="👤 Изменить имя", callback_data=pack(Action.CHANGE_NAME))]
         ]
 
     return InlineKeyboardMarkup(inline_keyboard=keyboard)
@@ -97,8 +104,8 @@ async def change_language(callback: CallbackQuery, **kwargs):
     # Create new language keyboard with different callback data
     keyboard = [
         [
-            InlineKeyboardButton(text="🇺🇿 O'zbek", callback_data="new_lang_uz"),
-            InlineKeyboardButton(text="🇷🇺 Русский", callback_data="new_lang_ru")
+            InlineKeyboardButton(text="🇺🇿 O'zbek", callback_data=pack(Action.NEW_LANGUAGE, LANGUAGES.index('uz'))),
+            InlineKeyboardButton(text="🇷🇺 Русский", callback_data=pack(Action.NEW_LANGUAGE, LANGUAGES.index('ru')))
         ]
     ]
 
@@ -110,23 +117,18 @@ async def change_language(callback: CallbackQuery, **kwargs):
     await callback.answer()
 
 
-async def process_language_change(callback: CallbackQuery, **kwargs):
+async def process_language_change(callback: CallbackQuery, language_index, **kwargs):
     """Process language change"""
     user = kwargs.get('user')
     if not user:
         await callback.answer(_("Iltimos, botni qaytadan ishga tushiring"))
         return
 
-    new_language = callback.data.split('_')[2]  # 'uz' or 'ru'
+    new_language = LANGUAGES[language_index]  # 'uz' or 'ru'
 
-    # Update user language using sync_to_async
-    @sync_to_async
-    def update_language():
-        user.language = new_language
-        user.save()
-        return user
-
-    updated_user = await update_language()
+    # Update user language
+    await queries.update_user(user, language=new_language)
+    user_cache.invalidate(user.telegram_id)
 
     if new_language == 'uz':
         success_text = "✅ Til muvaffaqiyatli o'zgartirildi!"
@@ -190,14 +192,9 @@ async def process_phone_change(message: Message, state: FSMContext, **kwargs):
         phone_number = message.text
 
     if phone_number:
-        # Update user phone using sync_to_async
-        @sync_to_async
-        def update_phone():
-            user.phone_number = phone_number
-            user.save()
-            return user
-
-        await update_phone()
+        # Update user phone
+        await queries.update_user(user, phone_number=phone_number)
+        user_cache.invalidate(user.telegram_id)
 
         if user.language == 'uz':
             success_text = f"✅ Telefon raqam muvaffaqiyatli o'zgartirildi!\n📱 Yangi raqam: {phone_number}"
@@ -253,14 +250,9 @@ async def process_name_change(message: Message, state: FSMContext, **kwargs):
     new_name = message.text.strip()
 
     if new_name and len(new_name) > 0:
-        # Update user name using sync_to_async
-        @sync_to_async
-        def update_name():
-            user.first_name = new_name
-            user.save()
-            return user
-
-        await update_name()
+        # Update user name
+        await queries.update_user(user, first_name=new_name)
+        user_cache.invalidate(user.telegram_id)
 
         if user.language == 'uz':
             success_text = f"✅ Ism muvaffaqiyatli o'zgartirildi!\n👤 Yangi ism: {new_name}"
@@ -1,13 +1,14 @@
-from aiogram import Router, F
+from aiogram import Router
 from aiogram.types import Message, CallbackQuery, ReplyKeyboardMarkup, KeyboardButton
 from aiogram.filters import CommandStart, Command  # Command qo'shildi
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from django.utils.translation import gettext as _
-from asgiref.sync import sync_to_async
 
-from store.models import User
 from bot.keyboards.common import get_main_menu_kb, get_language_kb
+from bot.utils.callbacks import Action, LANGUAGES
+from bot.utils.user_cache import user_cache
+from bot.utils import queries
 
 
 class RegistrationStates(StatesGroup):
@@ -21,24 +22,23 @@ def get_start_router():
     # Register handlers
     router.message.register(start_command, CommandStart())
     router.message.register(help_command, Command("help"))  # Help command qo'shildi
-    router.callback_query.register(process_language, F.data.startswith("lang_"))
     router.message.register(process_contact, RegistrationStates.waiting_for_contact)
     router.message.register(process_name, RegistrationStates.waiting_for_name)
 
     return router
 
 
+def get_start_callbacks():
+    return {Action.LANGUAGE: process_language}
+
+
 async def help_command(message: Message, **kwargs):
     """Handle /help command - show bot information and available commands"""
     telegram_user = message.from_user
 
-    try:
-        # Get user to determine language
-        user = await sync_to_async(User.objects.get)(telegram_id=telegram_user.id)
-        language = user.language
-    except User.DoesNotExist:
-        # Default to Uzbek for unregistered users
-        language = 'uz'
+    # Get user to determine language (default to Uzbek for unregistered users)
+    user = await user_cache.get(telegram_user.id)
+    language = user.language if user else 'uz'
 
     # Prepare help text based on language
     if language == 'uz':
@@ -111,18 +111,17 @@ async def start_command(message: Message, state: FSMContext, **kwargs):
     """Handle /start command"""
     telegram_user = message.from_user
 
-    try:
-        # Check if user exists using sync_to_async
-        user = await sync_to_async(User.objects.get)(telegram_id=telegram_user.id)
+    # Check if user exists (cached lookup)
+    user = await user_cache.get(telegram_user.id)
 
+    if user:
         # User exists, show main menu
         welcome_text = _("Xush kelibsiz!") if user.language == 'uz' else "Добро пожаловать!"
         await message.answer(
             welcome_text,
             reply_markup=get_main_menu_kb(user.language)
         )
-
-    except User.DoesNotExist:
+    else:
         # New user, ask for language
         await state.clear()  # Clear any existing state
         await message.answer(
@@ -131,9 +130,9 @@ async def start_command(message: Message, state: FSMContext, **kwargs):
         )
 
 
-async def process_language(callback: CallbackQuery, state: FSMContext, **kwargs):
+async def process_language(callback: CallbackQuery, language_index, state: FSMContext, **kwargs):
     """Process language selection"""
-    language = callback.data.split('_')[1]  # 'uz' or 'ru'
+    language = LANGUAGES[language_index]  # 'uz' or 'ru'
     telegram_user = callback.from_user
 
     # Store language in state for later use
@@ -222,30 +221,9 @@ async def process_name(message: Message, state: FSMContext, **kwargs):
     if name and len(name) > 0:
         telegram_user = message.from_user
 
-        # Create user using sync_to_async
-        @sync_to_async
-        def create_user():
-            user, created = User.objects.get_or_create(
-                telegram_id=telegram_user.id,
-                defaults={
-                    'username': telegram_user.username or f"user_{telegram_user.id}",
-                    'first_name': name,
-                    'last_name': telegram_user.last_name or '',
-                    'language': language,
-                    'phone_number': phone_number
-                }
-            )
-
-            if not created:
-                # Update existing user
-                user.first_name = name
-                user.language = language
-                user.phone_number = phone_number
-                user.save()
-
-            return user
-
-        user = await create_user()
+        # Create user
+        user = await queries.register_user(telegram_user, name, language, phone_number)
+        user_cache.invalidate(telegram_user.id)
 
         # Registration complete
         if language == 'uz':
@@ -1,5 +1,7 @@
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
+from bot.utils.callbacks import Action, pack
+
 
 def get_cart_kb(cart_items_data, language, total_price):
     """Create cart keyboard"""
@@ -12,7 +14,7 @@ def get_cart_kb(cart_items_data, language, total_price):
         keyboard.append([
             InlineKeyboardButton(
                 text=button_text,
-                callback_data=f"cartitem_{item_data['item_id']}"
+                callback_data=pack(Action.CART_ITEM, item_data['item_id'])
             )
         ])
 
@@ -27,10 +29,10 @@ def get_cart_kb(cart_items_data, language, total_price):
         clear_text = "🗑 Очистить"
 
     keyboard.extend([
-        [InlineKeyboardButton(text=total_text, callback_data="total")],
+        [InlineKeyboardButton(text=total_text, callback_data=pack(Action.CART_TOTAL))],
         [
-            InlineKeyboardButton(text=checkout_text, callback_data="checkout"),
-            InlineKeyboardButton(text=clear_text, callback_data="clearcart")
+            InlineKeyboardButton(text=checkout_text, callback_data=pack(Action.CHECKOUT)),
+            InlineKeyboardButton(text=clear_text, callback_data=pack(Action.CLEAR_CART))
         ]
     ])
 
@@ -52,11 +54,11 @@ def get_cart_item_kb(item_id, language):
 
     keyboard = [
         [
-            InlineKeyboardButton(text=minus_text, callback_data=f"quantity_{item_id}_minus"),
-            InlineKeyboardButton(text=plus_text, callback_data=f"quantity_{item_id}_plus")
+            InlineKeyboardButton(text=minus_text, callback_data=pack(Action.QUANTITY, item_id, 0)),
+            InlineKeyboardButton(text=plus_text, callback_data=pack(Action.QUANTITY, item_id, 1))
         ],
-        [InlineKeyboardButton(text=remove_text, callback_data=f"remove_{item_id}")],
-        [InlineKeyboardButton(text=back_text, callback_data="show_cart")]
+        [InlineKeyboardButton(text=remove_text, callback_data=pack(Action.REMOVE_ITEM, item_id))],
+        [InlineKeyboardButton(text=back_text, callback_data=pack(Action.SHOW_CART))]
     ]
 
     return InlineKeyboardMarkup(inline_keyboard=keyboard)
\ No newline at end of file
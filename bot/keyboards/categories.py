@@ -1,8 +1,13 @@
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
+from bot.keyboards.common import get_page_buttons
+from bot.utils.callbacks import Action, pack
+from bot.utils.keyboard_cache import keyboard_cache
+from bot.utils.pagination import keyset_page
 
-def get_categories_kb(categories, language, parent_id=None, show_back=False):
-    """Create categories keyboard"""
+
+def get_categories_kb(categories, language, parent_id=None, show_back=False, page=None):
+    """Create categories keyboard (with previous/next buttons if page is given)"""
     keyboard = []
 
     # Categories list
@@ -10,10 +15,13 @@ def get_categories_kb(categories, language, parent_id=None, show_back=False):
         keyboard.append([
             InlineKeyboardButton(
                 text=category.get_name(language),
-                callback_data=f"category_{category.id}"
+                callback_data=pack(Action.CATEGORY, category.id)
             )
         ])
 
+    if page is not None and (page.has_previous or page.has_next):
+        keyboard.append(get_page_buttons(page))
+
     # Back button
     if parent_id or show_back:
         back_text = "🔙 Orqaga" if language == 'uz' else "🔙 Назад"
@@ -21,15 +29,30 @@ def get_categories_kb(categories, language, parent_id=None, show_back=False):
             keyboard.append([
                 InlineKeyboardButton(
                     text=back_text,
-                    callback_data=f"back_to_parent_{parent_id}"
+                    callback_data=pack(Action.BACK_TO_PARENT, parent_id)
                 )
             ])
         else:
             keyboard.append([
                 InlineKeyboardButton(
                     text=back_text,
-                    callback_data="back_to_categories"
+                    callback_data=pack(Action.BACK_TO_CATEGORIES)
                 )
             ])
 
-    return InlineKeyboardMarkup(inline_keyboard=keyboard)
\ No newline at end of file
+    return InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+
+def get_category_page_kb(snapshot, category_id, language, cursor=None):
+    """
+    Cached keyboard with one page of subcategories of category_id
+    (root categories if category_id is None)
+    """
+    def build():
+        if category_id is None:
+            page = keyset_page(snapshot.root_categories(), 'categories', None, cursor)
+            return get_categories_kb(page.items, language, page=page)
+        page = keyset_page(snapshot.category(category_id).children, 'categories', category_id, cursor)
+        return get_categories_kb(page.items, language, parent_id=category_id, page=page)
+
+    return keyboard_cache.get(('categories', (category_id, cursor), language, snapshot.version), build)
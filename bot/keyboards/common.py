@@ -1,12 +1,23 @@
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
 
+from bot.utils.callbacks import Action, LANGUAGES, pack
+from bot.utils.keyboard_cache import keyboard_cache
+
 
 def get_main_menu_kb(language):
+    """Main menu keyboard (does not depend on catalog, cached per language)"""
+    return keyboard_cache.get(('main_menu', None, language, None), build_main_menu_kb, language)
+
+
+def build_main_menu_kb(language):
     """Create main menu keyboard"""
     if language == 'uz':
         keyboard = [
             [KeyboardButton(text="🛍 Mahsulotlar katalogi")],
-            [KeyboardButton(text="🛒 Savatcha")],
+            [
+                KeyboardButton(text="🔍 Qidiruv"),
+                KeyboardButton(text="🛒 Savatcha")
+            ],
             [
                 KeyboardButton(text="📞 Bog'lanish"),
                 KeyboardButton(text="⚙️ Sozlamalar")
@@ -15,7 +26,10 @@ def get_main_menu_kb(language):
     else:
         keyboard = [
             [KeyboardButton(text="🛍 Каталог товаров")],
-            [KeyboardButton(text="🛒 Корзина")],
+            [
+                KeyboardButton(text="🔍 Поиск"),
+                KeyboardButton(text="🛒 Корзина")
+            ],
             [
                 KeyboardButton(text="📞 Связаться"),
                 KeyboardButton(text="⚙️ Настройки")
@@ -29,8 +43,8 @@ def get_language_kb():
     """Create language selection keyboard"""
     keyboard = [
         [
-            InlineKeyboardButton(text="🇺🇿 O'zbek", callback_data="lang_uz"),
-            InlineKeyboardButton(text="🇷🇺 Русский", callback_data="lang_ru")
+            InlineKeyboardButton(text="🇺🇿 O'zbek", callback_data=pack(Action.LANGUAGE, LANGUAGES.index('uz'))),
+            InlineKeyboardButton(text="🇷🇺 Русский", callback_data=pack(Action.LANGUAGE, LANGUAGES.index('ru')))
         ]
     ]
     return InlineKeyboardMarkup(inline_keyboard=keyboard)
@@ -44,5 +58,15 @@ def get_back_btn(language):
         text = "🔙 Назад"
 
     return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text=text, callback_data="back")]
-    ])
\ No newline at end of file
+        [InlineKeyboardButton(text=text, callback_data=pack(Action.BACK))]
+    ])
+
+
+def get_page_buttons(page):
+    """Previous/next buttons row of paginated list (empty if it fits one page)"""
+    row = []
+    if page.has_previous:
+        row.append(InlineKeyboardButton(text="⬅️", callback_data=page.previous_callback))
+    if page.has_next:
+        row.append(InlineKeyboardButton(text="➡️", callback_data=page.next_callback))
+    return row
@@ -1,8 +1,13 @@
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
+from bot.keyboards.common import get_page_buttons
+from bot.utils.callbacks import Action, pack
+from bot.utils.keyboard_cache import keyboard_cache
+from bot.utils.pagination import keyset_page
 
-def get_product_actions_kb(products, language, category_id):
-    """Create products list keyboard"""
+
+def get_product_actions_kb(products, language, category_id, page=None):
+    """Create products list keyboard (with previous/next buttons if page is given)"""
     keyboard = []
 
     # Products list dan iterate qilish (bu allaqachon list bo'lishi kerak)
@@ -10,10 +15,13 @@ def get_product_actions_kb(products, language, category_id):
         keyboard.append([
             InlineKeyboardButton(
                 text=product.get_name(language),
-                callback_data=f"product_{product.id}_{category_id}"
+                callback_data=pack(Action.PRODUCT, product.id, category_id)
             )
         ])
 
+    if page is not None and (page.has_previous or page.has_next):
+        keyboard.append(get_page_buttons(page))
+
     # Back to categories button
     if language == 'uz':
         back_text = "🔙 Kategoriyalarga qaytish"
@@ -23,7 +31,7 @@ def get_product_actions_kb(products, language, category_id):
     keyboard.append([
         InlineKeyboardButton(
             text=back_text,
-            callback_data="back_to_categories"
+            callback_data=pack(Action.BACK_TO_CATEGORIES)
         )
     ])
 
@@ -39,7 +47,7 @@ def get_product_colors_kb(colors_list, language, product_id, category_id=None):
         keyboard.append([
             InlineKeyboardButton(
                 text=f"{color.get_name(language)} - {color.price:,.0f} so'm",
-                callback_data=f"color_{color.id}_{product_id}_{category_id or 0}"
+                callback_data=pack(Action.COLOR, color.id, product_id, category_id)
             )
         ])
 
@@ -53,7 +61,7 @@ def get_product_colors_kb(colors_list, language, product_id, category_id=None):
         keyboard.append([
             InlineKeyboardButton(
                 text=back_text,
-                callback_data=f"back_to_category_{category_id}"
+                callback_data=pack(Action.BACK_TO_CATEGORY, category_id)
             )
         ])
 
@@ -72,12 +80,31 @@ def get_add_to_cart_kb(color_id, product_id, category_id, language):
     keyboard = [
         [InlineKeyboardButton(
             text=add_text,
-            callback_data=f"add_to_cart_{color_id}"
+            callback_data=pack(Action.ADD_TO_CART, color_id)
         )],
         [InlineKeyboardButton(
             text=back_text,
-            callback_data=f"back_to_product_{product_id}_{category_id or 0}"
+            callback_data=pack(Action.BACK_TO_PRODUCT, product_id, category_id)
         )]
     ]
 
-    return InlineKeyboardMarkup(inline_keyboard=keyboard)
\ No newline at end of file
+    return InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+
+def get_product_page_kb(snapshot, category_id, language, cursor=None):
+    """Cached keyboard with one page of products of the category subtree"""
+    def build():
+        products = snapshot.subtree_products(snapshot.category(category_id))
+        page = keyset_page(products, 'products', category_id, cursor)
+        return get_product_actions_kb(page.items, language, category_id, page=page)
+
+    return keyboard_cache.get(('products', (category_id, cursor), language, snapshot.version), build)
+
+
+def get_search_results_kb(products, language):
+    """Create search results keyboard (product opens without category)"""
+    keyboard = [
+        [InlineKeyboardButton(text=product.get_name(language), callback_data=pack(Action.PRODUCT, product.id, None))]
+        for product in products
+    ]
+    return InlineKeyboardMarkup(inline_keyboard=keyboard)
@@ -0,0 +1,96 @@
+import asyncio
+import random
+import statistics
+import time
+
+from aiogram.fsm.storage.base import StorageKey
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from bot.storage import create_storage
+from bot.storage.redis import RedisStorage
+from bot.storage.resp import RespStandIn
+from bot.utils.db import db_executor
+
+BACKENDS = ('memory', 'database', 'redis')
+
+
+class Command(BaseCommand):
+    help = 'Benchmark FSM storage get/set throughput'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backend', choices=[*BACKENDS, 'all'], default='all')
+        parser.add_argument('--users', type=int, default=1000, help='Number of distinct storage keys')
+        parser.add_argument('--ops', type=int, default=20000, help='Operations per phase')
+        parser.add_argument('--concurrency', type=int, default=100)
+        parser.add_argument(
+            '--stand-in', action='store_true',
+            help='Run the redis backend against an in-process RESP server instead of BOT_FSM_REDIS_URL',
+        )
+
+    def handle(self, *args, **options):
+        backends = BACKENDS if options['backend'] == 'all' else (options['backend'],)
+        try:
+            for backend in backends:
+                asyncio.run(self.benchmark(backend, options))
+        finally:
+            db_executor.shutdown()
+
+    async def benchmark(self, backend, options):
+        stand_in = None
+        if backend == 'redis' and options['stand_in']:
+            stand_in = await RespStandIn().start()
+            storage = RedisStorage(url=stand_in.url, ttl=settings.BOT_FSM_TTL)
+        else:
+            storage = create_storage(backend)
+        keys = [
+            StorageKey(bot_id=0, chat_id=user_id, user_id=user_id)
+            for user_id in range(1, options['users'] + 1)
+        ]
+
+        async def write(key):
+            await storage.set_state(key, 'OrderStates:waiting_for_address')
+            await storage.set_data(key, {'language': 'uz', 'address': 'Toshkent, Chilonzor 1'})
+
+        async def read(key):
+            await storage.get_state(key)
+            await storage.get_data(key)
+
+        try:
+            self.stdout.write(f'{backend}:')
+            await self.run_phase('set', write, keys, options)
+            await self.run_phase('get', read, keys, options)
+
+            started = time.perf_counter()
+            await storage.close()
+            self.stdout.write(f'  close/flush: {(time.perf_counter() - started) * 1000:.1f} ms')
+            if hasattr(storage, 'stats'):
+                self.stdout.write(f'  stats: {storage.stats()}')
+        finally:
+            if stand_in is not None:
+                await stand_in.close()
+
+    async def run_phase(self, name, operation, keys, options):
+        ops, concurrency = options['ops'], options['concurrency']
+        latencies = []
+
+        async def worker(count):
+            for _ in range(count):
+                key = random.choice(keys)
+                started = time.perf_counter()
+                await operation(key)
+                latencies.append(time.perf_counter() - started)
+
+        per_worker, extra = divmod(ops, concurrency)
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            worker(per_worker + (1 if i < extra else 0)) for i in range(concurrency)
+        ))
+        elapsed = time.perf_counter() - started
+
+        latencies.sort()
+        p99 = latencies[int(len(latencies) * 0.99) - 1] if latencies else 0
+        self.stdout.write(
+            f'  {name}: {ops / elapsed:,.0f} ops/s, '
+            f'p50 {statistics.median(latencies) * 1000:.2f} ms, p99 {p99 * 1000:.2f} ms'
+        )
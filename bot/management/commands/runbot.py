@@ -1,57 +1,118 @@
 import asyncio
 import logging
 
-from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
 from django.conf import settings
 from django.core.management.base import BaseCommand
-from bot.handlers import (
-    get_start_router,
-    get_categories_router,
-    get_products_router,
-    get_cart_router,
-    get_orders_router,
-    get_contact_router,
-    get_settings_router
-)
-from bot.middlewares.authentication import AuthenticationMiddleware
+from bot.dispatcher import create_bot, create_dispatcher
+from bot.utils.catalog import catalog
+from bot.utils.db import db_executor
+from bot.utils.inline import inline_search
+from bot.utils.keyboard_cache import keyboard_cache
+from bot.utils.metrics import handler_metrics, install_dump_signal
+from bot.utils.outbound import send_limiter
+from bot.utils.log import configure_logging
+from bot.utils.sharding import ShardedBot
+from bot.utils.user_cache import user_cache
+from bot.utils.webhook import run_webhook
 
 
 class Command(BaseCommand):
     help = 'Run Telegram bot'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--webhook', action='store_true',
+            help='Receive updates through an aiohttp webhook server instead of long polling',
+        )
+        parser.add_argument(
+            '--webhook-url', default=settings.BOT_WEBHOOK_URL,
+            help='Public base URL registered with setWebhook (skipped if empty)',
+        )
+        parser.add_argument('--webhook-path', default=settings.BOT_WEBHOOK_PATH)
+        parser.add_argument(
+            '--webhook-secret', default=settings.BOT_WEBHOOK_SECRET,
+            help='X-Telegram-Bot-Api-Secret-Token value checked on every request',
+        )
+        parser.add_argument('--host', default=settings.BOT_WEBHOOK_HOST)
+        parser.add_argument('--port', type=int, default=settings.BOT_WEBHOOK_PORT)
+        parser.add_argument(
+            '--drain-timeout', type=int, default=settings.BOT_WEBHOOK_DRAIN_TIMEOUT,
+            help='Seconds to wait for in-flight updates on shutdown',
+        )
+        parser.add_argument(
+            '--metrics-path', default=settings.BOT_METRICS_PATH,
+            help='Serve per-handler metrics as JSON on this webhook server path (single process only)',
+        )
+        parser.add_argument(
+            '--workers', type=int, default=settings.BOT_WORKERS,
+            help='Number of worker processes; updates are sharded by user id',
+        )
+
     def handle(self, *args, **options):
+        # Records are written by a listener thread, not on the event loop
+        listener = configure_logging()
         try:
             self.stdout.write('Starting bot...')
-            asyncio.run(self.start_bot())
+            asyncio.run(self.start_bot(options))
         except (KeyboardInterrupt, SystemExit):
             self.stdout.write('Bot stopped!')
+        finally:
+            listener.stop()
 
-    async def start_bot(self):
-        # Configure logging
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(levelname)s - %(name)s - %(message)s',
-        )
-
+    async def start_bot(self, options):
         # Initialize bot and dispatcher
-        bot = Bot(token=settings.TELEGRAM_TOKEN, parse_mode="HTML")
-        storage = MemoryStorage()
-        dp = Dispatcher(storage=storage)
-
-        # Register middlewares
-        dp.update.outer_middleware(AuthenticationMiddleware())
-
-        # Register routers
-        dp.include_router(get_start_router())
-        dp.include_router(get_categories_router())
-        dp.include_router(get_products_router())
-        dp.include_router(get_cart_router())
-        dp.include_router(get_orders_router())
-        dp.include_router(get_contact_router())
-        dp.include_router(get_settings_router())
+        bot = create_bot()
+        dp = create_dispatcher()
+        allowed_updates = dp.resolve_used_update_types()
+        install_dump_signal()
 
-
-        # Start polling
         self.stdout.write('Bot started!')
-        await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
\ No newline at end of file
+        try:
+            if options['workers'] > 1:
+                await self.run_sharded(bot, options, allowed_updates)
+            elif options['webhook']:
+                await run_webhook(
+                    dp, bot,
+                    host=options['host'],
+                    port=options['port'],
+                    path=options['webhook_path'],
+                    secret_token=options['webhook_secret'],
+                    webhook_url=options['webhook_url'],
+                    drain_timeout=options['drain_timeout'],
+                    allowed_updates=allowed_updates,
+                    metrics_path=options['metrics_path'],
+                )
+            else:
+                await dp.start_polling(bot, allowed_updates=allowed_updates)
+        finally:
+            logging.info("User cache stats: %s", user_cache.stats())
+            logging.info("DB executor stats: %s", db_executor.stats())
+            logging.info("Outbound limiter stats: %s", send_limiter.stats())
+            logging.info("Catalog stats: %s", catalog.stats())
+            logging.info("Keyboard cache stats: %s", keyboard_cache.stats())
+            logging.info("Inline search stats: %s", inline_search.stats())
+            logging.info("Handler metrics: %s", handler_metrics.stats())
+            db_executor.shutdown()
+
+    async def run_sharded(self, bot, options, allowed_updates):
+        # Bu jarayon faqat update larni qabul qilib workerlarga taqsimlaydi
+        sharded = ShardedBot(bot, options['workers'], drain_timeout=options['drain_timeout'])
+        self.stdout.write(f"Running {options['workers']} workers")
+        if options['webhook'] and options['metrics_path']:
+            # Handler metrikalari worker jarayonlarida; ular Django /metrics ga eksport qilinadi
+            logging.warning(
+                "--metrics-path %s is not served with --workers > 1; "
+                "per-handler metrics of all workers are on the web /metrics endpoint",
+                options['metrics_path'],
+            )
+        if options['webhook']:
+            await sharded.run_webhook(
+                host=options['host'],
+                port=options['port'],
+                path=options['webhook_path'],
+                secret_token=options['webhook_secret'],
+                webhook_url=options['webhook_url'],
+                allowed_updates=allowed_updates,
+            )
+        else:
+            await sharded.run_polling(allowed_updates=allowed_updates)
@@ -1,10 +1,8 @@
 from typing import Any, Callable, Dict, Awaitable
 from aiogram import BaseMiddleware
 from aiogram.types import Message, CallbackQuery, Update
-from asgiref.sync import sync_to_async
 
-from django.conf import settings
-from store.models import User
+from bot.utils.user_cache import user_cache
 
 
 class AuthenticationMiddleware(BaseMiddleware):
@@ -46,17 +44,14 @@ class AuthenticationMiddleware(BaseMiddleware):
         if not user_id:
             return await handler(event, data)
 
-        try:
-            # Get user from database using sync_to_async
-            user = await sync_to_async(User.objects.get)(telegram_id=user_id)
+        # Get user from cache (database is queried only on cache miss)
+        user = await user_cache.get(user_id)
 
+        if user is not None:
             # Add user to data dict to make it accessible in handlers
             data["user"] = user
-
-        except User.DoesNotExist:
-            # If user doesn't exist, we don't add anything to data dict
-            # Registration will be handled by start handler
-            pass
+        # If user doesn't exist, we don't add anything to data dict
+        # Registration will be handled by start handler
 
         # Call next handler
         return await handler(event, data)
\ No newline at end of file
@@ -0,0 +1,51 @@
+from typing import Any, Callable, Dict, Awaitable
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+from bot.utils.metrics import UpdateMetrics, current_update, handler_metrics, set_handler
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """
+    Outer update middleware: wall time, DB wait, SQL queries and Bot API
+    calls of every update, aggregated per handler
+    """
+
+    def __init__(self, metrics=handler_metrics):
+        self.metrics = metrics
+
+    async def __call__(
+            self,
+            handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+            event: Update,
+            data: Dict[str, Any]
+    ) -> Any:
+        record = UpdateMetrics()
+        token = current_update.set(record)
+        error = False
+        try:
+            return await handler(event, data)
+        except Exception:
+            error = True
+            raise
+        finally:
+            current_update.reset(token)
+            self.metrics.observe(record.finish(), error=error)
+
+
+class HandlerNameMiddleware(BaseMiddleware):
+    """
+    Inner middleware: handler tanlangandan keyin uning nomini update
+    yozuviga qo'yadi
+    """
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any]
+    ) -> Any:
+        handler_object = data.get('handler')
+        if handler_object is not None:
+            set_handler(handler_object.callback)
+        return await handler(event, data)
@@ -1,3 +1,18 @@
 from django.db import models
+from django.utils.translation import gettext_lazy as _
 
-# Create your models here.
+
+class FSMRecord(models.Model):
+    """aiogram FSM state and data of one storage key (bot.storage.database)"""
+    key = models.CharField(max_length=255, unique=True)  # bot:chat:user:thread:destiny
+    state = models.CharField(max_length=255, blank=True, null=True)
+    data = models.JSONField(default=dict, blank=True)
+    expires_at = models.DateTimeField(db_index=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = _("FSM holati")
+        verbose_name_plural = _("FSM holatlari")
+
+    def __str__(self):
+        return f"{self.key}: {self.state}"
@@ -0,0 +1,26 @@
+# aiogram FSM storage backends
+from aiogram.fsm.storage.memory import MemoryStorage
+from django.conf import settings
+
+
+def create_storage(backend=None):
+    """FSM storage selected by BOT_FSM_STORAGE: 'database', 'redis' or 'memory'"""
+    backend = backend or settings.BOT_FSM_STORAGE
+
+    if backend == 'database':
+        from .database import DatabaseStorage
+        return DatabaseStorage(
+            ttl=settings.BOT_FSM_TTL,
+            flush_interval=settings.BOT_FSM_FLUSH_INTERVAL / 1000,
+            batch_size=settings.BOT_FSM_BATCH_SIZE,
+        )
+    if backend == 'redis':
+        from .redis import RedisStorage
+        return RedisStorage(url=settings.BOT_FSM_REDIS_URL, ttl=settings.BOT_FSM_TTL)
+    if backend == 'memory':
+        return MemoryStorage()
+
+    raise ValueError(f"Unknown FSM storage backend: {backend}")
+
+
+__all__ = ['create_storage']
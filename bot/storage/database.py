@@ -0,0 +1,213 @@
+import asyncio
+import logging
+import time
+from datetime import timedelta
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage
+from django.db import transaction
+from django.utils import timezone
+
+from bot.models import FSMRecord
+from bot.utils.db import run_db
+
+logger = logging.getLogger(__name__)
+
+# Buferdagi yozuvda o'zgarmagan maydon belgisi
+UNSET = object()
+
+
+def storage_key(key):
+    """StorageKey -> FSMRecord.key / Redis key part"""
+    return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or ''}:{key.destiny}"
+
+
+def state_name(state):
+    return state.state if isinstance(state, State) else state
+
+
+def _changed_fields(state, data):
+    """Which columns a buffered write changes: used as bulk upsert group"""
+    if state is UNSET:
+        return ('data',)
+    if data is UNSET:
+        return ('state',)
+    return ('state', 'data')
+
+
+class DatabaseStorage(BaseStorage):
+    """
+    FSM storage on the FSMRecord table with write-behind batching.
+
+    set_state/set_data darhol bazaga yozilmaydi: o'zgarishlar buferda
+    yig'iladi (bitta kalitga bir nechta yozuv bittaga qo'shiladi) va
+    flush_interval da yoki batch_size ga yetganda bitta tranzaksiyada
+    bulk upsert qilinadi. O'qishda avval bufer tekshiriladi, shuning uchun
+    jarayon o'zi yozgan qiymatni darhol ko'radi. Muddati o'tgan yozuvlar
+    o'qilmaydi va vaqti-vaqti bilan o'chiriladi.
+    """
+
+    def __init__(self, ttl=86400, flush_interval=0.05, batch_size=500, cleanup_interval=600):
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.cleanup_interval = cleanup_interval
+
+        # key -> [state or UNSET, data or UNSET]
+        self._dirty = {}
+        self._flushing = {}
+        self._wakeup = None
+        self._flusher = None
+        self._closed = False
+        self._last_cleanup = time.monotonic()
+
+        self.flushes = 0
+        self.flushed_records = 0
+        self.buffered_writes = 0
+
+    # Buffer
+
+    def _buffer(self, key, state=UNSET, data=UNSET):
+        if self._closed:
+            raise RuntimeError("Storage is closed")
+
+        entry = self._dirty.setdefault(storage_key(key), [UNSET, UNSET])
+        if state is not UNSET:
+            entry[0] = state
+        if data is not UNSET:
+            entry[1] = data
+        self.buffered_writes += 1
+
+        if self._flusher is None:
+            self._wakeup = asyncio.Event()
+            self._flusher = asyncio.create_task(self._run_flusher())
+        if len(self._dirty) >= self.batch_size:
+            self._wakeup.set()
+
+    def _buffered(self, key, index):
+        """Buffered value of field (0 - state, 1 - data) or UNSET"""
+        name = storage_key(key)
+        for buffer in (self._dirty, self._flushing):
+            entry = buffer.get(name)
+            if entry is not None and entry[index] is not UNSET:
+                return entry[index]
+        return UNSET
+
+    async def _run_flusher(self):
+        while not self._closed:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("FSM storage flush failed")
+
+    async def flush(self):
+        """Write buffered changes to the database"""
+        if self._flushing or not self._dirty:
+            return
+        self._flushing, self._dirty = self._dirty, {}
+        try:
+            await run_db(self._write, self._flushing)
+        except Exception:
+            # Keep failed batch for the next flush, newer writes win
+            for name, entry in self._flushing.items():
+                current = self._dirty.setdefault(name, [UNSET, UNSET])
+                for index in (0, 1):
+                    if current[index] is UNSET:
+                        current[index] = entry[index]
+            raise
+        else:
+            self.flushes += 1
+            self.flushed_records += len(self._flushing)
+        finally:
+            self._flushing = {}
+
+    def _write(self, batch):
+        now = timezone.now()
+        expires_at = now + timedelta(seconds=self.ttl)
+
+        groups = {}
+        for name, (state, data) in batch.items():
+            groups.setdefault(_changed_fields(state, data), []).append(FSMRecord(
+                key=name,
+                state=None if state is UNSET else state,
+                data={} if data is UNSET else data,
+                expires_at=expires_at,
+                updated_at=now,
+            ))
+
+        with transaction.atomic():
+            # Muddati o'tgan yozuvning eski state/data si qisman yozuv bilan qayta tirilmasin
+            partial = [record.key for fields, records in groups.items() if len(fields) == 1
+                       for record in records]
+            if partial:
+                FSMRecord.objects.filter(key__in=partial, expires_at__lte=now).delete()
+
+            # Faqat o'zgargan ustunlar yangilanadi, shuning uchun oldindan o'qish shart emas
+            for fields, records in groups.items():
+                FSMRecord.objects.bulk_create(
+                    records,
+                    update_conflicts=True,
+                    unique_fields=['key'],
+                    update_fields=[*fields, 'expires_at', 'updated_at'],
+                )
+
+        if time.monotonic() - self._last_cleanup >= self.cleanup_interval:
+            self._last_cleanup = time.monotonic()
+            deleted, _ = FSMRecord.objects.filter(expires_at__lte=now).delete()
+            if deleted:
+                logger.info("Deleted %s expired FSM records", deleted)
+
+    # BaseStorage
+
+    def _read(self, name):
+        return (
+            FSMRecord.objects
+            .filter(key=name, expires_at__gt=timezone.now())
+            .values_list('state', 'data')
+            .first()
+        )
+
+    async def set_state(self, key, state=None):
+        self._buffer(key, state=state_name(state))
+
+    async def get_state(self, key):
+        state = self._buffered(key, 0)
+        if state is not UNSET:
+            return state
+        record = await run_db(self._read, storage_key(key))
+        return record[0] if record else None
+
+    async def set_data(self, key, data):
+        self._buffer(key, data=data.copy())
+
+    async def get_data(self, key):
+        data = self._buffered(key, 1)
+        if data is not UNSET:
+            return data.copy()
+        record = await run_db(self._read, storage_key(key))
+        return dict(record[1]) if record else {}
+
+    async def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        if self._flusher is not None:
+            self._wakeup.set()
+            await self._flusher
+        await self.flush()
+        logger.info("FSM storage stats: %s", self.stats())
+
+    def stats(self):
+        return {
+            'buffered_writes': self.buffered_writes,
+            'flushes': self.flushes,
+            'flushed_records': self.flushed_records,
+            'pending': len(self._dirty),
+            'coalescing_ratio': round(self.flushed_records / self.buffered_writes, 3)
+            if self.buffered_writes else 0.0,
+        }
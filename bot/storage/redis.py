@@ -0,0 +1,47 @@
+import json
+
+from aiogram.fsm.storage.base import BaseStorage
+
+from bot.storage.database import state_name, storage_key
+from bot.storage.resp import RespClient
+
+
+class RedisStorage(BaseStorage):
+    """
+    FSM storage on any Redis-protocol server (Redis, KeyDB, RespStandIn).
+
+    State va data alohida kalitlarda TTL bilan saqlanadi; bir vaqtda
+    kelgan so'rovlar bitta ulanishda pipeline bo'ladi.
+    """
+
+    def __init__(self, url='redis://localhost:6379/0', ttl=86400, prefix='fsm'):
+        self.client = RespClient(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def _key(self, key, part):
+        return f"{self.prefix}:{storage_key(key)}:{part}"
+
+    async def set_state(self, key, state=None):
+        state = state_name(state)
+        if state is None:
+            await self.client.execute('DEL', self._key(key, 'state'))
+        else:
+            await self.client.execute('SET', self._key(key, 'state'), state, 'EX', self.ttl)
+
+    async def get_state(self, key):
+        value = await self.client.execute('GET', self._key(key, 'state'))
+        return value.decode() if value is not None else None
+
+    async def set_data(self, key, data):
+        if not data:
+            await self.client.execute('DEL', self._key(key, 'data'))
+        else:
+            await self.client.execute('SET', self._key(key, 'data'), json.dumps(data), 'EX', self.ttl)
+
+    async def get_data(self, key):
+        value = await self.client.execute('GET', self._key(key, 'data'))
+        return json.loads(value) if value is not None else {}
+
+    async def close(self):
+        await self.client.close()
@@ -0,0 +1,218 @@
+"""
+Minimal Redis protocol (RESP2) client and a local stand-in server
+
+Mijoz bitta ulanish orqali ishlaydi: buyruqlar kelish tartibida yoziladi
+va javoblar shu tartibda qaytadi, shuning uchun bir vaqtda kelgan
+so'rovlar avtomatik ravishda pipeline bo'ladi. Stand-in server faqat
+lokal ishlab chiqish, testlar va benchmark uchun.
+"""
+import asyncio
+import time
+from collections import deque
+from urllib.parse import urlparse
+
+
+class RespError(Exception):
+    """Error reply from the server"""
+
+
+def encode_command(*args):
+    parts = [b'*%d\r\n' % len(args)]
+    for arg in args:
+        if isinstance(arg, str):
+            arg = arg.encode()
+        elif not isinstance(arg, bytes):
+            arg = str(arg).encode()
+        parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+    return b''.join(parts)
+
+
+async def read_reply(reader):
+    line = await reader.readuntil(b'\r\n')
+    kind, payload = line[:1], line[1:-2]
+    if kind == b'+':
+        return payload.decode()
+    if kind == b'-':
+        return RespError(payload.decode())
+    if kind == b':':
+        return int(payload)
+    if kind == b'$':
+        length = int(payload)
+        if length == -1:
+            return None
+        data = await reader.readexactly(length + 2)
+        return data[:-2]
+    if kind == b'*':
+        length = int(payload)
+        if length == -1:
+            return None
+        return [await read_reply(reader) for _ in range(length)]
+    raise RespError(f"Unknown reply type: {line!r}")
+
+
+class RespClient:
+    """Pipelining RESP client over a single connection"""
+
+    def __init__(self, url='redis://localhost:6379/0'):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or 'localhost'
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip('/') or 0)
+
+        self._reader = None
+        self._writer = None
+        self._pending = deque()
+        self._reader_task = None
+        self._connect_lock = asyncio.Lock()
+
+    async def _connect(self):
+        async with self._connect_lock:
+            if self._writer is not None:
+                return
+            reader, writer = await asyncio.open_connection(self.host, self.port)
+            self._reader, self._writer = reader, writer
+            self._reader_task = asyncio.create_task(self._read_replies())
+            if self.password:
+                await self._send('AUTH', self.password)
+            if self.db:
+                await self._send('SELECT', self.db)
+
+    async def _read_replies(self):
+        try:
+            while True:
+                reply = await read_reply(self._reader)
+                future = self._pending.popleft()
+                if not future.done():
+                    future.set_result(reply)
+        except Exception as e:
+            error = e if isinstance(e, (ConnectionError, asyncio.IncompleteReadError)) \
+                else ConnectionError(str(e))
+            self._fail_pending(error)
+
+    def _fail_pending(self, error):
+        while self._pending:
+            future = self._pending.popleft()
+            if not future.done():
+                future.set_exception(error)
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+
+    async def _send(self, *args):
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append(future)
+        self._writer.write(encode_command(*args))
+        await self._writer.drain()
+        reply = await future
+        if isinstance(reply, RespError):
+            raise reply
+        return reply
+
+    async def execute(self, *args):
+        """Send command and return its reply"""
+        if self._writer is None:
+            await self._connect()
+        return await self._send(*args)
+
+    async def close(self):
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            self._reader_task = None
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except ConnectionError:
+                pass
+            self._reader = self._writer = None
+
+
+class RespStandIn:
+    """
+    In-process RESP server with GET/SET/DEL/EXPIRE/PING/FLUSHDB.
+
+    Haqiqiy Redis o'rniga lokal tekshirish uchun: ma'lumotlar xotirada,
+    TTL o'qishda tekshiriladi.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self.host = host
+        self.port = port
+        self._data = {}  # key -> (value, expires_at or None)
+        self._server = None
+        self._clients = set()
+
+    @property
+    def url(self):
+        return f'redis://{self.host}:{self.port}/0'
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            for writer in list(self._clients):
+                writer.close()
+            await self._server.wait_closed()
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def _get(self, key):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._data[key]
+            return None
+        return value
+
+    def _command(self, name, args):
+        if name == b'PING':
+            return b'+PONG\r\n'
+        if name in (b'SELECT', b'AUTH', b'FLUSHDB'):
+            if name == b'FLUSHDB':
+                self._data.clear()
+            return b'+OK\r\n'
+        if name == b'GET':
+            value = self._get(args[0])
+            return b'$-1\r\n' if value is None else b'$%d\r\n%s\r\n' % (len(value), value)
+        if name == b'SET':
+            expires_at = None
+            if len(args) >= 4 and args[2].upper() == b'EX':
+                expires_at = time.monotonic() + int(args[3])
+            self._data[args[0]] = (args[1], expires_at)
+            return b'+OK\r\n'
+        if name == b'DEL':
+            return b':%d\r\n' % sum(self._data.pop(key, None) is not None for key in args)
+        if name == b'EXPIRE':
+            value = self._get(args[0])
+            if value is None:
+                return b':0\r\n'
+            self._data[args[0]] = (value, time.monotonic() + int(args[1]))
+            return b':1\r\n'
+        return b'-ERR unknown command\r\n'
+
+    async def _handle(self, reader, writer):
+        self._clients.add(writer)
+        try:
+            while True:
+                request = await read_reply(reader)
+                if not isinstance(request, list) or not request:
+                    writer.write(b'-ERR protocol error\r\n')
+                    continue
+                writer.write(self._command(request[0].upper(), request[1:]))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._clients.discard(writer)
+            writer.close()
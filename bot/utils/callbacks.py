@@ -0,0 +1,133 @@
+"""
+Compact callback_data codec
+
+Har bir tugma ma'lumoti: 1 bayt Action + argumentlar (manfiy bo'lmagan
+butun sonlar) varint ko'rinishida, base64url (padding siz) bilan
+kodlangan. Masalan COLOR(12345, 678, 9) -> 6 bayt -> 8 belgi
+("color_12345_678_9" o'rniga 17). None argumentlar 0 sifatida yoziladi.
+
+callback_data update boshida bir marta decode qilinadi va handler
+Action bo'yicha jadvaldan (dict) topiladi, prefiks filtrlari zanjiri
+bo'ylab ketma-ket tekshirilmaydi.
+"""
+import base64
+from enum import IntEnum
+
+from django.utils.translation import gettext as _
+
+from bot.utils.metrics import set_handler
+
+# Telegram callback_data chegarasi (bayt)
+MAX_CALLBACK_DATA = 64
+
+
+class Action(IntEnum):
+    # Catalog
+    SHOW_CATEGORIES = 1
+    BACK_TO_CATEGORIES = 2
+    CATEGORY = 3  # category_id
+    BACK_TO_PARENT = 4  # category_id
+    CATEGORY_PAGE = 5  # category_id | 0, direction, cursor_id
+    PRODUCT_PAGE = 6  # category_id, direction, cursor_id
+    PRODUCT = 7  # product_id, category_id | 0
+    COLOR = 8  # color_id, product_id, category_id | 0
+    ADD_TO_CART = 9  # color_id
+    BACK_TO_CATEGORY = 10  # category_id
+    BACK_TO_PRODUCT = 11  # product_id, category_id | 0
+    # Cart
+    SHOW_CART = 12
+    CART_ITEM = 13  # item_id
+    REMOVE_ITEM = 14  # item_id
+    QUANTITY = 15  # item_id, 1 (plus) | 0 (minus)
+    CLEAR_CART = 16
+    CHECKOUT = 17
+    CART_TOTAL = 18
+    # Registration and settings
+    LANGUAGE = 19  # language index
+    CHANGE_LANGUAGE = 20
+    NEW_LANGUAGE = 21  # language index
+    CHANGE_PHONE = 22
+    CHANGE_NAME = 23
+    BACK = 24
+
+
+LANGUAGES = ('uz', 'ru')
+
+
+def _write_varint(value, out):
+    if value < 0:
+        raise ValueError(f"Callback argument must not be negative: {value}")
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def pack(action, *args):
+    """callback_data for action with integer arguments (None is written as 0)"""
+    out = bytearray((action,))
+    for arg in args:
+        _write_varint(arg or 0, out)
+    data = base64.urlsafe_b64encode(bytes(out)).rstrip(b'=').decode('ascii')
+    if len(data) > MAX_CALLBACK_DATA:
+        raise ValueError(f"callback_data is longer than {MAX_CALLBACK_DATA} bytes")
+    return data
+
+
+def unpack(data):
+    """(Action, args tuple) of callback_data; ValueError if it is not ours"""
+    try:
+        raw = base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+    except (ValueError, TypeError):
+        raise ValueError(f"Invalid callback data: {data!r}") from None
+    if not raw:
+        raise ValueError("Empty callback data")
+
+    action = Action(raw[0])  # noma'lum id ham ValueError beradi
+    args, value, shift = [], 0, 0
+    for byte in raw[1:]:
+        value |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            args.append(value)
+            value, shift = 0, 0
+    # Eski formatdagi ("product_1_2") yoki buzilgan satrlar shu yerda rad etiladi
+    if shift or pack(action, *args) != data:
+        raise ValueError(f"Invalid callback data: {data!r}")
+    return action, tuple(args)
+
+
+class CallbackTable:
+    """
+    Action -> handler jadvali. Handler callback_query dan keyin decode
+    qilingan argumentlarni pozitsion, middleware ma'lumotlarini (user,
+    state, ...) esa kwargs sifatida oladi: handler(callback, *args, **kwargs)
+    """
+
+    def __init__(self, handlers=None):
+        self.handlers = dict(handlers or {})
+        self.dispatched = 0
+        self.invalid = 0
+
+    def register(self, action, handler):
+        self.handlers[action] = handler
+
+    async def dispatch(self, callback, **kwargs):
+        try:
+            action, args = unpack(callback.data or '')
+        except ValueError:
+            # Yangilanishdan oldin yuborilgan xabarlardagi tugmalar
+            self.invalid += 1
+            await callback.answer(_("Bu tugma eskirgan. Iltimos, menyudan qaytadan tanlang."))
+            return
+
+        handler = self.handlers.get(action)
+        if handler is None:
+            # Masalan "Jami" tugmasi: faqat yuklanish belgisi o'chiriladi
+            await callback.answer()
+            return
+
+        self.dispatched += 1
+        set_handler(handler)
+        return await handler(callback, *args, **kwargs)
@@ -0,0 +1,314 @@
+"""
+In-memory catalog snapshot for bot browsing
+
+Faol kategoriyalar, mahsulotlar, ranglar va rasm yo'llari bir necha
+so'rov bilan yuklanib, __slots__ li kichik obyektlarda saqlanadi.
+Kategoriya/mahsulot/rang ekranlari bazaga murojaat qilmaydi; faqat
+CatalogVersion har BOT_CATALOG_CHECK_INTERVAL soniyada tekshiriladi va
+versiya o'zgargan bo'lsa snapshot qayta quriladi.
+"""
+import asyncio
+import logging
+import sys
+import time
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from store.models import CatalogVersion, Category, Product, Color, ColorImage
+from bot.utils.db import run_db
+
+logger = logging.getLogger(__name__)
+
+
+class _Named:
+    __slots__ = ()
+
+    def get_name(self, language):
+        """Get name based on language"""
+        return self.name_uz if language == 'uz' else self.name_ru
+
+
+class CategoryNode(_Named):
+    __slots__ = ('id', 'name_uz', 'name_ru', 'parent_id', 'children', 'products')
+
+    def __init__(self, id, name_uz, name_ru, parent_id):
+        self.id = id
+        self.name_uz = name_uz
+        self.name_ru = name_ru
+        self.parent_id = parent_id
+        self.children = []  # CategoryNode, id order
+        self.products = []  # ProductNode, id order
+
+
+class ProductNode(_Named):
+    __slots__ = ('id', 'name_uz', 'name_ru', 'description_uz', 'description_ru', 'main_image', 'colors')
+
+    def __init__(self, id, name_uz, name_ru, description_uz, description_ru, main_image):
+        self.id = id
+        self.name_uz = name_uz
+        self.name_ru = name_ru
+        self.description_uz = description_uz
+        self.description_ru = description_ru
+        self.main_image = main_image  # path relative to MEDIA_ROOT or ''
+        self.colors = []  # ColorNode, id order
+
+    def get_description(self, language):
+        """Get description based on language"""
+        return self.description_uz if language == 'uz' else self.description_ru
+
+
+class ColorNode(_Named):
+    __slots__ = ('id', 'product', 'name_uz', 'name_ru', 'price', 'images')
+
+    def __init__(self, id, product, name_uz, name_ru, price):
+        self.id = id
+        self.product = product
+        self.name_uz = name_uz
+        self.name_ru = name_ru
+        self.price = price
+        self.images = []  # image paths in display order
+
+
+def _size_of(value, seen):
+    """Approximate memory of value and everything it references"""
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(_size_of(key, seen) + _size_of(item, seen) for key, item in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(_size_of(item, seen) for item in value)
+    elif hasattr(value, '__slots__'):
+        size += sum(_size_of(getattr(value, name), seen) for name in value.__slots__)
+    return size
+
+
+class CatalogSnapshot:
+    """
+    Immutable view of the active catalog.
+    Lookups raise the model's DoesNotExist like the ORM did.
+    """
+
+    def __init__(self, version, categories, products, colors, build_time):
+        self.version = version
+        self.categories = categories
+        self.products = products
+        self.colors = colors
+        self.roots = [category for category in categories.values() if category.parent_id is None]
+        self.build_time = build_time
+        self.memory_bytes = _size_of((categories, products, colors, self.roots), set())
+        self._subtree_products = {}  # category id -> list, filled on first use
+
+    @classmethod
+    def load(cls):
+        """
+        Build snapshot from database (blocking, runs in the db executor).
+
+        So'rovlar bitta tranzaksiyada (PostgreSQL da REPEATABLE READ) bajariladi,
+        shuning uchun hammasi bir xil holatni ko'radi; boshqa bazalarda
+        so'rovlar orasida qo'shilgan va ota qatori topilmagan qatorlar
+        keyingi qayta qurishgacha tashlab ketiladi.
+        """
+        started = time.perf_counter()
+        with transaction.atomic():
+            if connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+            return cls._load_rows(started)
+
+    @classmethod
+    def _load_rows(cls, started):
+        version = CatalogVersion.current()
+
+        categories = {
+            row[0]: CategoryNode(*row)
+            for row in Category.objects.filter(is_active=True).order_by('id')
+            .values_list('id', 'name_uz', 'name_ru', 'parent_id')
+        }
+        for category in categories.values():
+            parent = categories.get(category.parent_id)
+            if parent is not None:
+                parent.children.append(category)
+
+        products = {
+            row[0]: ProductNode(*row)
+            for row in Product.objects.filter(is_active=True).order_by('id')
+            .values_list('id', 'name_uz', 'name_ru', 'description_uz', 'description_ru', 'main_image')
+        }
+        links = (
+            Product.categories.through.objects
+            .filter(product__is_active=True, category__is_active=True)
+            .order_by('product_id')
+            .values_list('category_id', 'product_id')
+        )
+        for category_id, product_id in links:
+            category, product = categories.get(category_id), products.get(product_id)
+            if category is not None and product is not None:
+                category.products.append(product)
+
+        colors = {}
+        for color_id, product_id, name_uz, name_ru, price in (
+            Color.objects.filter(is_active=True, product__is_active=True).order_by('id')
+            .values_list('id', 'product_id', 'name_uz', 'name_ru', 'price')
+        ):
+            product = products.get(product_id)
+            if product is None:
+                continue
+            color = colors[color_id] = ColorNode(color_id, product, name_uz, name_ru, price)
+            product.colors.append(color)
+
+        for color_id, image in (
+            ColorImage.objects.filter(color__is_active=True, color__product__is_active=True)
+            .order_by('order', 'id')
+            .values_list('color_id', 'image')
+        ):
+            color = colors.get(color_id)
+            if color is not None:
+                color.images.append(image)
+
+        return cls(version, categories, products, colors, time.perf_counter() - started)
+
+    # Lookups
+
+    def category(self, category_id):
+        try:
+            return self.categories[category_id]
+        except KeyError:
+            raise Category.DoesNotExist("Category matching query does not exist.") from None
+
+    def product(self, product_id):
+        try:
+            return self.products[product_id]
+        except KeyError:
+            raise Product.DoesNotExist("Product matching query does not exist.") from None
+
+    def color(self, color_id):
+        try:
+            return self.colors[color_id]
+        except KeyError:
+            raise Color.DoesNotExist("Color matching query does not exist.") from None
+
+    def root_categories(self):
+        """Active top-level categories"""
+        return self.roots
+
+    def breadcrumb(self, category_id):
+        """Category and its active ancestors, root first"""
+        breadcrumb = [self.category(category_id)]
+        while breadcrumb[0].parent_id in self.categories:
+            breadcrumb.insert(0, self.categories[breadcrumb[0].parent_id])
+        return breadcrumb
+
+    def subtree_products(self, category):
+        """Active products of category and its descendants, id order"""
+        cached = self._subtree_products.get(category.id)
+        if cached is None:
+            products, stack = {}, [category]
+            while stack:
+                node = stack.pop()
+                products.update((product.id, product) for product in node.products)
+                stack.extend(node.children)
+            cached = self._subtree_products[category.id] = [products[key] for key in sorted(products)]
+        return cached
+
+    def category_listing(self, category_id):
+        """
+        Category breadcrumb (root first, category last) with its active
+        children, or with its active products if it has no children
+        """
+        breadcrumb = self.breadcrumb(category_id)
+        category = breadcrumb[-1]
+        return breadcrumb, category.children, [] if category.children else category.products
+
+    def category_products(self, category_id):
+        """Category, active products of its whole subtree and its parent (or None)"""
+        category = self.category(category_id)
+        return category, self.subtree_products(category), self.categories.get(category.parent_id)
+
+    def product_view(self, product_id):
+        """Product with its active colors"""
+        product = self.product(product_id)
+        return product, product.colors
+
+    def color_view(self, color_id):
+        """Color (with product) and its image paths"""
+        color = self.color(color_id)
+        return color, color.images
+
+    def stats(self):
+        return {
+            'version': self.version,
+            'categories': len(self.categories),
+            'products': len(self.products),
+            'colors': len(self.colors),
+            'build_ms': round(self.build_time * 1000, 2),
+            'memory_kb': round(self.memory_bytes / 1024, 1),
+        }
+
+
+class CatalogService:
+    """
+    Current catalog snapshot, rebuilt when CatalogVersion changes.
+
+    Versiya har check_interval soniyada bir marta (bitta kichik so'rov)
+    tekshiriladi; bir vaqtda kelgan so'rovlar bitta qayta qurishni kutadi.
+    """
+
+    def __init__(self, check_interval=5.0):
+        self.check_interval = check_interval
+        self._snapshot = None
+        self._checked_at = 0.0
+        self._refresh = None
+
+        self.checks = 0
+        self.rebuilds = 0
+
+    async def get(self):
+        """Snapshot to serve the current request from"""
+        snapshot = self._snapshot
+        if snapshot is not None and time.monotonic() - self._checked_at < self.check_interval:
+            return snapshot
+
+        if self._refresh is None:
+            self._refresh = asyncio.ensure_future(self._load())
+        try:
+            return await asyncio.shield(self._refresh)
+        finally:
+            if self._refresh is not None and self._refresh.done():
+                self._refresh = None
+
+    async def _load(self):
+        snapshot = self._snapshot
+        try:
+            if snapshot is not None:
+                self.checks += 1
+                version = await run_db(CatalogVersion.current)
+                if version == snapshot.version:
+                    self._checked_at = time.monotonic()
+                    return snapshot
+
+            snapshot = await run_db(CatalogSnapshot.load)
+        except Exception:
+            if snapshot is None:
+                raise
+            # Baza vaqtincha ishlamasa eski snapshot bilan davom etiladi
+            logger.exception("Catalog refresh failed, serving version %s", snapshot.version)
+            self._checked_at = time.monotonic()
+            return snapshot
+
+        self._snapshot = snapshot
+        self._checked_at = time.monotonic()
+        self.rebuilds += 1
+        logger.info("Catalog snapshot built: %s", snapshot.stats())
+        return snapshot
+
+    def stats(self):
+        stats = {'checks': self.checks, 'rebuilds': self.rebuilds}
+        if self._snapshot is not None:
+            stats.update(self._snapshot.stats())
+        return stats
+
+
+catalog = CatalogService(check_interval=settings.BOT_CATALOG_CHECK_INTERVAL)
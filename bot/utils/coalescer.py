@@ -0,0 +1,97 @@
+import asyncio
+import logging
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class _Pending:
+    __slots__ = ('delta', 'taps', 'flush', 'task')
+
+    def __init__(self, delta, flush):
+        self.delta = delta
+        self.taps = 1
+        self.flush = flush
+        self.task = None
+
+
+class DeltaCoalescer:
+    """
+    Sum rapid +/- deltas per key and apply them once per window.
+
+    Birinchi bosishdan keyin `window` soniya ichida kelgan barcha bosishlar
+    bitta deltaga qo'shiladi; oyna tugagach oxirgi berilgan flush(delta, taps)
+    bir marta chaqiriladi. Natijaviy delta 0 bo'lsa, flush chaqirilmaydi.
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self._pending = {}
+
+        self.taps = 0
+        self.flushes = 0
+        self.skipped = 0
+
+    def submit(self, key, delta, flush):
+        pending = self._pending.get(key)
+        if pending is not None:
+            pending.delta += delta
+            pending.taps += 1
+            pending.flush = flush
+            return
+
+        pending = self._pending[key] = _Pending(delta, flush)
+        pending.task = asyncio.create_task(self._flush_later(key))
+
+    def pending_delta(self, key):
+        """Delta collected for key and not applied yet"""
+        pending = self._pending.get(key)
+        return pending.delta if pending is not None else 0
+
+    async def _flush_later(self, key):
+        try:
+            await asyncio.sleep(self.window)
+        finally:
+            # Cancelled (on close) or not, the collected delta is applied
+            await self._flush(key)
+
+    async def _flush(self, key):
+        pending = self._pending.pop(key, None)
+        if pending is None:
+            return
+
+        self.taps += pending.taps
+        if pending.delta == 0:
+            self.skipped += 1
+            return
+
+        self.flushes += 1
+        try:
+            await pending.flush(pending.delta, pending.taps)
+        except Exception:
+            logger.exception("Failed to apply coalesced delta for %s", key)
+
+    async def close(self):
+        """Apply all pending deltas now"""
+        tasks = [pending.task for pending in self._pending.values()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # Hali boshlanmagan task bekor qilinsa finally ishlamaydi
+        for key in list(self._pending):
+            await self._flush(key)
+        logger.info("Quantity coalescer stats: %s", self.stats())
+
+    def stats(self):
+        return {
+            'taps': self.taps,
+            'flushes': self.flushes,
+            'skipped': self.skipped,
+            'pending': len(self._pending),
+            'coalescing_ratio': round(self.taps / (self.flushes + self.skipped), 2)
+            if self.flushes + self.skipped else 0.0,
+        }
+
+
+quantity_coalescer = DeltaCoalescer(settings.BOT_QUANTITY_DEBOUNCE_MS / 1000)
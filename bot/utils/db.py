@@ -0,0 +1,135 @@
+import asyncio
+import contextvars
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection
+
+from bot.utils.metrics import current_update, recording_queries
+
+
+class DatabaseExecutor:
+    """
+    Bot handlerlari uchun ORM chaqiruvlarini bajaruvchi cheklangan thread pool
+
+    sync_to_async(thread_sensitive=True) barcha so'rovlarni bitta threadga
+    navbatlaydi. Bu yerda esa har bir worker thread o'zining Django ulanishiga
+    ega (ulanishlar thread-local), shuning uchun bir vaqtda max_workers tagacha
+    so'rov parallel bajariladi.
+    """
+
+    def __init__(self, max_workers=8):
+        self.max_workers = max_workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+        # Statistika
+        self.calls = 0
+        self.queued = 0  # yuborilgan, lekin hali boshlanmagan
+        self.active = 0  # hozir bajarilayotgan
+        self.peak_active = 0
+        self.saturated_calls = 0  # yuborilganda barcha workerlar band bo'lgan
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.total_run = 0.0
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers,
+                thread_name_prefix='bot-db',
+            )
+        return self._executor
+
+    async def run(self, func, *args, **kwargs):
+        """Run blocking ORM code in the pool and await its result"""
+        with self._lock:
+            self.calls += 1
+            if self.active + self.queued >= self.max_workers:
+                self.saturated_calls += 1
+            self.queued += 1
+
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        submitted_at = time.perf_counter()
+        call = functools.partial(self._run, submitted_at, func, args, kwargs)
+        try:
+            return await loop.run_in_executor(self._get_executor(), context.run, call)
+        finally:
+            record = current_update.get()
+            if record is not None:
+                record.db_calls += 1
+                record.db_wait += time.perf_counter() - submitted_at
+
+    def _run(self, submitted_at, func, args, kwargs):
+        started = time.perf_counter()
+        wait = started - submitted_at
+
+        with self._lock:
+            self.queued -= 1
+            self.active += 1
+            self.peak_active = max(self.peak_active, self.active)
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+        try:
+            # Update ichida bo'lsa, SQL so'rovlari update yozuviga qo'shiladi
+            with recording_queries():
+                return func(*args, **kwargs)
+        finally:
+            self._drop_broken_connection()
+            with self._lock:
+                self.active -= 1
+                self.total_run += time.perf_counter() - started
+
+    @staticmethod
+    def _drop_broken_connection():
+        # Thread ulanishini saqlab qoladi, faqat xatolikdan keyin yaroqsiz bo'lsa yopiladi
+        if connection.connection is not None and connection.errors_occurred:
+            if connection.is_usable():
+                connection.errors_occurred = False
+            else:
+                connection.close()
+
+    def stats(self):
+        """Queue wait time and pool saturation"""
+        with self._lock:
+            finished = self.calls - self.queued - self.active
+            return {
+                'pool_size': self.max_workers,
+                'calls': self.calls,
+                'queued': self.queued,
+                'active': self.active,
+                'peak_active': self.peak_active,
+                'saturation': self.active / self.max_workers,
+                'saturated_ratio': self.saturated_calls / self.calls if self.calls else 0.0,
+                'avg_wait_ms': self.total_wait / max(self.calls - self.queued, 1) * 1000,
+                'max_wait_ms': self.max_wait * 1000,
+                'avg_run_ms': self.total_run / max(finished, 1) * 1000,
+            }
+
+    def shutdown(self, wait=True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
+
+
+db_executor = DatabaseExecutor(max_workers=settings.BOT_DB_POOL_SIZE)
+
+
+async def run_db(func, *args, **kwargs):
+    """Await blocking ORM call in the shared bot DB pool"""
+    return await db_executor.run(func, *args, **kwargs)
+
+
+def db_async(func):
+    """Decorator: sync ORM function -> coroutine running in the bot DB pool"""
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await db_executor.run(func, *args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,76 @@
+"""
+Bot stats -> Prometheus registry (core.metrics)
+
+Bot servislarining o'z hisoblagichlari (handler metrikalari, keshlar,
+outbound limiter, DB pool) har METRICS_FLUSH_INTERVAL soniyada registryga
+ko'chiriladi va jarayon fayliga yoziladi; Django /metrics ularni web
+workerlar bilan birga qaytaradi.
+"""
+import asyncio
+
+from django.conf import settings
+
+from core.metrics import registry
+from bot.utils.db import db_executor
+from bot.utils.inline import inline_search
+from bot.utils.keyboard_cache import keyboard_cache
+from bot.utils.metrics import BUCKETS_MS, handler_metrics
+from bot.utils.outbound import send_limiter
+from bot.utils.user_cache import user_cache
+
+BUCKETS = tuple(bound / 1000 for bound in BUCKETS_MS)
+
+
+def export_bot_metrics(registry=registry):
+    for handler, stats in handler_metrics.handlers.items():
+        registry.set_counter('bot_updates_total', stats.count, handler=handler)
+        registry.set_counter('bot_update_errors_total', stats.errors, handler=handler)
+        registry.set_histogram('bot_update_duration_seconds', BUCKETS, stats.buckets, stats.wall, handler=handler)
+        registry.set_counter('bot_db_queries_total', stats.queries, handler=handler)
+        registry.set_counter('bot_api_calls_total', stats.api_calls, handler=handler)
+
+    for name, cache in (('user', user_cache), ('keyboard', keyboard_cache), ('inline', inline_search)):
+        registry.set_counter('bot_cache_hits_total', cache.hits, cache=name)
+        registry.set_counter('bot_cache_misses_total', cache.misses, cache=name)
+
+    outbound = send_limiter.stats()
+    for lane, count in outbound['sent'].items():
+        registry.set_counter('bot_outbound_sent_total', count, lane=lane)
+    registry.set_counter('bot_outbound_retries_total', outbound['retries'])
+    registry.set_counter('bot_outbound_failed_total', outbound['failed'])
+    for queue, depth in outbound['queue_depth'].items():
+        registry.set_gauge('bot_outbound_queue_depth', depth, queue=queue)
+
+    pool = db_executor.stats()
+    registry.set_gauge('bot_db_pool_active', pool['active'])
+    registry.set_gauge('bot_db_pool_queued', pool['queued'])
+
+
+class MetricsPublisher:
+    """Background task exporting bot metrics; started and stopped with the dispatcher"""
+
+    def __init__(self, interval=5.0):
+        self.interval = interval
+        self._task = None
+
+    async def _run(self):
+        while True:
+            export_bot_metrics()
+            registry.flush(force=True)
+            await asyncio.sleep(self.interval)
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        # Oxirgi holat (shutdown dagi flush lar bilan) yoziladi
+        export_bot_metrics()
+        registry.flush(force=True)
+
+
+metrics_publisher = MetricsPublisher(interval=settings.METRICS_FLUSH_INTERVAL)
@@ -0,0 +1,158 @@
+"""
+Inline mode (@bot so'rov) product search
+
+Bitta executor chaqiruvida reytingli qidiruv (store.search) va rasmlarning
+Telegram file_id lari olinadi; nom, ranglar va narxlar katalog snapshot
+idan olinadi. Tayyor natijalar (so'rov, til, katalog versiyasi) bo'yicha
+qisqa TTL bilan keshlanadi, sahifalar esa shu ro'yxatdan next_offset
+bilan kesib beriladi, shuning uchun keyingi sahifalar bazaga tushmaydi.
+"""
+import time
+from collections import OrderedDict
+from html import escape
+
+from aiogram.types import InlineQueryResultArticle, InlineQueryResultCachedPhoto, InputTextMessageContent
+from django.conf import settings
+
+from store.search import search_products
+from store.translit import fold
+from bot.utils.db import run_db
+from bot.utils.media import cached_file_ids
+
+
+def _load_hits(search_key, limit, recent):
+    """
+    Ranked product ids (recent ones for empty query) and file_ids of their
+    main images, in one executor call (blocking)
+    """
+    if search_key:
+        hits = [(hit.id, hit.main_image.name) for hit in search_products(search_key, limit=limit)]
+    else:
+        hits = recent
+    images = [image for _, image in hits if image]
+    return [product_id for product_id, _ in hits], cached_file_ids(images) if images else {}
+
+
+def _prices(product, language):
+    return [f"{color.get_name(language)} — {color.price:,.0f} so'm" for color in product.colors]
+
+
+def build_result(product, language, file_id=None):
+    """Inline result of product: cached photo if it was uploaded before, otherwise article"""
+    name = product.get_name(language)
+    prices = _prices(product, language)
+    if not prices:
+        prices = ["Mavjud emas" if language == 'uz' else "Нет в наличии"]
+    text = f"<b>{escape(name)}</b>\n\n" + "\n".join(prices)
+
+    if file_id:
+        return InlineQueryResultCachedPhoto(
+            id=str(product.id),
+            photo_file_id=file_id,
+            title=name,
+            description=", ".join(prices),
+            caption=text,
+            parse_mode="HTML",
+        )
+    return InlineQueryResultArticle(
+        id=str(product.id),
+        title=name,
+        description=", ".join(prices),
+        input_message_content=InputTextMessageContent(message_text=text, parse_mode="HTML"),
+    )
+
+
+class InlineSearch:
+    """
+    TTL bilan cheklangan LRU kesh: (qidiruv kaliti, til, katalog versiyasi)
+    -> barcha natijalar ro'yxati
+    """
+
+    def __init__(self, max_size=1000, ttl=30, page_size=20, max_results=100):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.page_size = page_size
+        self.max_results = max_results
+        self._entries = OrderedDict()  # key -> (expires_at, results)
+        self.hits = 0
+        self.misses = 0
+        self.queries = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, results = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return results
+
+    def put(self, key, results):
+        self._entries[key] = (time.monotonic() + self.ttl, results)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    async def page(self, snapshot, query, language, offset=0):
+        """(results of one page, next_offset) for inline query text"""
+        started = time.perf_counter()
+        key = (fold(query), language, snapshot.version)
+        results = self.lookup(key)
+        if results is None:
+            self.misses += 1
+            results = await self._load(snapshot, key[0], language)
+            self.put(key, results)
+        else:
+            self.hits += 1
+
+        page = results[offset:offset + self.page_size]
+        next_offset = str(offset + self.page_size) if offset + self.page_size < len(results) else ''
+
+        elapsed = time.perf_counter() - started
+        self.queries += 1
+        self.total_time += elapsed
+        self.max_time = max(self.max_time, elapsed)
+        return page, next_offset
+
+    async def _load(self, snapshot, search_key, language):
+        recent = []
+        if not search_key:
+            # Bo'sh so'rov: eng yangi mahsulotlar
+            recent = [
+                (product_id, snapshot.products[product_id].main_image)
+                for product_id in sorted(snapshot.products, reverse=True)[:self.max_results]
+            ]
+        product_ids, file_ids = await run_db(_load_hits, search_key, self.max_results, recent)
+
+        results = []
+        for product_id in product_ids:
+            product = snapshot.products.get(product_id)
+            if product is not None:  # snapshot hali yangilanmagan bo'lishi mumkin
+                results.append(build_result(product, language, file_ids.get(product.main_image)))
+        return results
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / total if total else 0.0,
+            'avg_ms': round(self.total_time / self.queries * 1000, 2) if self.queries else 0.0,
+            'max_ms': round(self.max_time * 1000, 2),
+        }
+
+
+inline_search = InlineSearch(
+    max_size=settings.BOT_INLINE_CACHE_SIZE,
+    ttl=settings.BOT_INLINE_CACHE_TTL,
+    page_size=settings.BOT_INLINE_PAGE_SIZE,
+    max_results=settings.BOT_INLINE_MAX_RESULTS,
+)
@@ -0,0 +1,53 @@
+from collections import OrderedDict
+
+from django.conf import settings
+
+
+class KeyboardCache:
+    """
+    LRU kesh: (kind, entity_id, language, catalog_version) -> keyboard markup
+
+    Katalog klaviaturalari (kategoriyalar, mahsulotlar, ranglar) faqat
+    katalog versiyasi yoki til o'zgarganda qayta quriladi. Versiya kalitda
+    bo'lgani uchun eski yozuvlar alohida o'chirilmaydi, LRU bo'yicha
+    chiqib ketadi. Foydalanuvchiga xos klaviaturalar (savatcha) keshlanmaydi.
+    """
+
+    def __init__(self, max_size=2048):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, build, *args, **kwargs):
+        """Cached keyboard for key, built with build(*args, **kwargs) on miss"""
+        keyboard = self._entries.get(key)
+        if keyboard is not None:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return keyboard
+
+        self.misses += 1
+        keyboard = self._entries[key] = build(*args, **kwargs)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        return keyboard
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        """Hit/miss counters for monitoring"""
+        total = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': self.hits / total if total else 0.0,
+        }
+
+
+keyboard_cache = KeyboardCache(max_size=settings.BOT_KEYBOARD_CACHE_SIZE)
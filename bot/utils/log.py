@@ -0,0 +1,139 @@
+"""
+Bot logging
+
+  * log = get_logger(__name__); log.debug("cart.shown", items=len(items))
+    Yozuv hodisa nomi va maydonlardan iborat. Daraja o'chirilgan bo'lsa
+    (productionda DEBUG/INFO) chaqiruv isEnabledFor dan keyin qaytadi va
+    hech narsa formatlanmaydi; yoqilgan bo'lsa ham matn listener threadida
+    yasaladi.
+  * configure_logging() root loggerga QueueHandler o'rnatadi: event loop
+    faqat yozuvni navbatga qo'yadi, stderr ga QueueListener threadi yozadi.
+  * DEBUG/INFO yozuvlari handler bo'yicha sampling qilinadi
+    (BOT_LOG_SAMPLING): bitta update ning yozuvlari birga saqlanadi yoki
+    birga tashlab yuboriladi. WARNING va undan yuqorisi doim yoziladi.
+"""
+import logging
+import queue
+import random
+from logging.handlers import QueueHandler, QueueListener
+
+from django.conf import settings
+
+from bot.utils.metrics import current_update
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(processName)s - %(name)s - %(message)s'
+
+
+def parse_sampling(value):
+    """'products.process_product=0.01,cart.show_cart=0.1' -> {handler: rate}"""
+    rates = {}
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        name, _, rate = item.partition('=')
+        rates[name.strip()] = float(rate)
+    return rates
+
+
+class Sampler:
+    """Share of updates whose DEBUG/INFO records are kept, per handler name"""
+
+    def __init__(self, rate=1.0, rates=None):
+        self.rate = rate
+        self.rates = dict(rates or {})
+
+    def rate_for(self, handler):
+        return self.rates.get(handler, self.rate)
+
+    def sampled(self):
+        record = current_update.get()
+        if record is None:  # startup, shutdown, fon vazifalari
+            return True
+        if record.log_sampled is None:
+            # Qaror update boshidagi birinchi yozuvda qabul qilinadi
+            rate = self.rate_for(record.handler)
+            record.log_sampled = rate >= 1 or random.random() < rate
+        return record.log_sampled
+
+
+sampler = Sampler(rate=settings.BOT_LOG_SAMPLE_RATE, rates=parse_sampling(settings.BOT_LOG_SAMPLING))
+
+
+class BotLogger:
+    """Structured logger: level check and sampling before any record is built"""
+
+    __slots__ = ('logger', 'sampler')
+
+    def __init__(self, logger, sampler=sampler):
+        self.logger = logger
+        self.sampler = sampler
+
+    def log(self, level, event, exc_info=None, **fields):
+        if not self.logger.isEnabledFor(level):
+            return
+        if level < logging.WARNING and not self.sampler.sampled():
+            return
+        # Maydonlar havola sifatida uzatiladi, repr listener threadida olinadi
+        self.logger.log(level, event, exc_info=exc_info, extra={'fields': fields}, stacklevel=3)
+
+    def debug(self, event, **fields):
+        self.log(logging.DEBUG, event, **fields)
+
+    def info(self, event, **fields):
+        self.log(logging.INFO, event, **fields)
+
+    def warning(self, event, **fields):
+        self.log(logging.WARNING, event, **fields)
+
+    def error(self, event, **fields):
+        self.log(logging.ERROR, event, **fields)
+
+    def exception(self, event, **fields):
+        self.log(logging.ERROR, event, exc_info=True, **fields)
+
+
+def get_logger(name):
+    return BotLogger(logging.getLogger(name))
+
+
+class StructuredFormatter(logging.Formatter):
+    """Appends record fields as key=value pairs: 'cart.shown items=3 total=120000'"""
+
+    def formatMessage(self, record):
+        message = super().formatMessage(record)
+        fields = getattr(record, 'fields', None)
+        if fields:
+            message += ' ' + ' '.join(f'{key}={value!r}' for key, value in fields.items())
+        return message
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    QueueHandler that leaves formatting to the listener thread.
+
+    Standart prepare() xabarni chaqiruvchi threadda formatlaydi; navbat
+    shu jarayon ichida bo'lgani uchun yozuv o'zgarishsiz uzatiladi.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+def configure_logging(level=None, fmt=LOG_FORMAT):
+    """
+    Route all records of this process through a queue to a stderr writer thread.
+    Returns the started listener; stop() it on exit to flush pending records.
+    """
+    level = level or settings.BOT_LOG_LEVEL
+    records = queue.SimpleQueue()
+
+    output = logging.StreamHandler()
+    output.setFormatter(StructuredFormatter(fmt))
+    listener = QueueListener(records, output, respect_handler_level=True)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(NonBlockingQueueHandler(records))
+    root.setLevel(level)
+
+    listener.start()
+    return listener
@@ -0,0 +1,184 @@
+import asyncio
+import logging
+import os
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile, InputMediaPhoto
+from django.conf import settings
+from django.db.models import OuterRef, Subquery
+
+from store.images import image_file_path, inspect_image
+from store.models import ImageMetadata, TelegramFile
+from bot.utils.db import run_db
+
+logger = logging.getLogger(__name__)
+
+# sendMediaGroup bitta albomda 2-10 ta rasm qabul qiladi
+MEDIA_GROUP_SIZE = 10
+
+# path -> (mtime, size, ImageMetadata)
+_metadata_cache = {}
+# (path, sha256) -> file_id
+_file_id_cache = {}
+
+
+def media_name(file_path):
+    """Path relative to MEDIA_ROOT (as stored in ImageField)"""
+    return os.path.relpath(file_path, settings.MEDIA_ROOT)
+
+
+def image_metadata(file_path):
+    """
+    ImageMetadata of file, cached by (path, mtime, size).
+
+    Odatda natija admin/API rasmni saqlaganda oldindan hisoblangan
+    bo'ladi, shuning uchun bu yerda faqat os.stat() chaqiriladi. Fayl
+    faqat bazada mos yozuv bo'lmasa ochiladi.
+    """
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+
+    cached = _metadata_cache.get(file_path)
+    if cached and cached[0] == stat.st_mtime and cached[1] == stat.st_size:
+        return cached[2]
+
+    name = media_name(file_path)
+    metadata = ImageMetadata.objects.filter(path=name, mtime=stat.st_mtime, size=stat.st_size).first()
+    if metadata is None:
+        metadata, _ = ImageMetadata.objects.update_or_create(
+            path=name, defaults=inspect_image(file_path, stat)
+        )
+
+    _metadata_cache[file_path] = (stat.st_mtime, stat.st_size, metadata)
+    return metadata
+
+
+async def telegram_image_path(image_field):
+    """Absolute path of image if it can be sent to Telegram, otherwise None"""
+    file_path = image_file_path(image_field)
+    if not file_path:
+        return None
+
+    metadata = await run_db(image_metadata, file_path)
+    if metadata is None or not metadata.is_valid:
+        return None
+    return file_path
+
+
+def _resolve(file_path):
+    """Return (name, content_hash, file_id or None)"""
+    metadata = image_metadata(file_path)
+    name, content_hash = metadata.path, metadata.content_hash
+    key = (name, content_hash)
+
+    if key not in _file_id_cache:
+        _file_id_cache[key] = (
+            TelegramFile.objects
+            .filter(path=name, content_hash=content_hash)
+            .values_list('file_id', flat=True)
+            .first()
+        )
+
+    return name, content_hash, _file_id_cache[key]
+
+
+def cached_file_ids(names):
+    """
+    {path: file_id} of images already uploaded with their current content,
+    in one query (inline results can only use photos Telegram already has)
+    """
+    current_hash = ImageMetadata.objects.filter(path=OuterRef('path')).values('content_hash')[:1]
+    return dict(
+        TelegramFile.objects
+        .filter(path__in=names, content_hash=Subquery(current_hash))
+        .values_list('path', 'file_id')
+    )
+
+
+def _remember(name, content_hash, photo):
+    TelegramFile.objects.update_or_create(
+        path=name,
+        content_hash=content_hash,
+        defaults={'file_id': photo.file_id, 'file_unique_id': photo.file_unique_id},
+    )
+    _file_id_cache[(name, content_hash)] = photo.file_id
+
+
+def _forget(name, content_hash):
+    TelegramFile.objects.filter(path=name, content_hash=content_hash).delete()
+    _file_id_cache.pop((name, content_hash), None)
+
+
+async def answer_photo(message, file_path, **kwargs):
+    """
+    message.answer_photo() that uploads each image only once.
+
+    Birinchi yuborishda Telegram qaytargan file_id saqlanadi va keyingi
+    safar fayl qayta yuklanmaydi. Telegram file_id ni rad etsa, fayl
+    yana yuklanadi.
+    """
+    name, content_hash, file_id = await run_db(_resolve, file_path)
+
+    if file_id:
+        try:
+            return await message.answer_photo(photo=file_id, **kwargs)
+        except TelegramBadRequest as e:
+            logger.warning("Cached file_id rejected for %s: %s", name, e)
+            await run_db(_forget, name, content_hash)
+
+    sent = await message.answer_photo(photo=FSInputFile(file_path), **kwargs)
+    await run_db(_remember, name, content_hash, sent.photo[-1])
+    return sent
+
+
+async def _send_media_group(message, batch):
+    """Send one album; batch is a list of (file_path, name, content_hash, file_id)"""
+    media = [
+        InputMediaPhoto(media=file_id or FSInputFile(file_path))
+        for file_path, name, content_hash, file_id in batch
+    ]
+
+    try:
+        sent = await message.answer_media_group(media=media)
+    except TelegramBadRequest as e:
+        cached = [(name, content_hash) for _, name, content_hash, file_id in batch if file_id]
+        if not cached:
+            raise
+        logger.warning("Cached file_id rejected in media group: %s", e)
+        for name, content_hash in cached:
+            await run_db(_forget, name, content_hash)
+        batch = [(file_path, name, content_hash, None) for file_path, name, content_hash, _ in batch]
+        return await _send_media_group(message, batch)
+
+    await asyncio.gather(*(
+        run_db(_remember, name, content_hash, sent_message.photo[-1])
+        for (_, name, content_hash, file_id), sent_message in zip(batch, sent)
+        if not file_id and sent_message.photo
+    ))
+
+    return sent
+
+
+async def answer_media_group(message, file_paths, messages=None):
+    """
+    Send images as albums of up to MEDIA_GROUP_SIZE photos.
+
+    file_id lar parallel aniqlanadi; file_id si hali noma'lum rasmlar
+    albom bilan bitta so'rovda birga yuklanadi. Yuborilgan xabarlar
+    messages ro'yxatiga qo'shiladi, shuning uchun keyingi albom xato
+    bersa ham chaqiruvchi nima yetib borganini biladi.
+    """
+    resolved = await asyncio.gather(*(run_db(_resolve, file_path) for file_path in file_paths))
+    items = [(file_path, *info) for file_path, info in zip(file_paths, resolved)]
+
+    messages = [] if messages is None else messages
+    for start in range(0, len(items), MEDIA_GROUP_SIZE):
+        batch = items[start:start + MEDIA_GROUP_SIZE]
+        if len(batch) == 1:
+            messages.append(await answer_photo(message, batch[0][0]))
+        else:
+            messages.extend(await _send_media_group(message, batch))
+
+    return messages
@@ -0,0 +1,232 @@
+"""
+Per-update handler metrics
+
+Har bir update uchun UpdateMetrics yozuvi contextvar da saqlanadi:
+DatabaseExecutor unga executor kutish vaqtini va (connection.execute_wrapper
+orqali) SQL so'rovlarini, bot sessiyasi middleware i esa Bot API
+chaqiruvlarini qo'shadi. Update tugagach yozuv handler nomi bo'yicha
+histogrammalarga yig'iladi (HandlerMetrics).
+"""
+import asyncio
+import heapq
+import logging
+import signal
+import time
+from bisect import bisect_left
+from contextlib import nullcontext
+from contextvars import ContextVar
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+# Histogram bucket upper bounds (ms); the last bucket is +Inf
+BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+UNHANDLED = 'unhandled'
+
+current_update = ContextVar('current_update', default=None)
+
+
+def handler_name(callback):
+    """Short handler name: 'products.process_product'"""
+    callback = getattr(callback, '__func__', callback)
+    module = getattr(callback, '__module__', None) or ''
+    name = getattr(callback, '__qualname__', None) or repr(callback)
+    return f"{module.rsplit('.', 1)[-1]}.{name}" if module else name
+
+
+def set_handler(callback):
+    """Name the handler of the current update (no-op outside updates)"""
+    record = current_update.get()
+    if record is not None:
+        record.handler = handler_name(callback)
+
+
+class UpdateMetrics:
+    """Measurements of one update"""
+
+    __slots__ = (
+        'handler', 'started', 'wall', 'db_calls', 'db_wait', 'queries', 'api_calls', 'api_time', 'log_sampled',
+    )
+
+    def __init__(self):
+        self.handler = UNHANDLED
+        self.started = time.perf_counter()
+        self.wall = 0.0
+        self.db_calls = 0
+        self.db_wait = 0.0  # executor natijasini kutish (navbat + bajarilish)
+        self.queries = []  # (seconds, sql); list.append DB threadlaridan ham xavfsiz
+        self.api_calls = 0
+        self.api_time = 0.0
+        self.log_sampled = None  # bot.utils.log sampling qarori
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((time.perf_counter() - started, sql))
+
+    def finish(self):
+        self.wall = time.perf_counter() - self.started
+        return self
+
+    @property
+    def query_time(self):
+        return sum(duration for duration, _ in self.queries)
+
+    def slowest_queries(self, count=3):
+        return heapq.nlargest(count, self.queries, key=lambda query: query[0])
+
+
+def recording_queries():
+    """
+    Context manager recording SQL of the current update on this thread's
+    connection; used inside DB executor threads (context is copied there)
+    """
+    record = current_update.get()
+    if record is None:
+        return nullcontext()
+    return connection.execute_wrapper(record.execute_wrapper)
+
+
+class HandlerStats:
+    __slots__ = ('count', 'errors', 'wall', 'max_wall', 'db_wait', 'queries', 'query_time', 'api_calls', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.wall = 0.0
+        self.max_wall = 0.0
+        self.db_wait = 0.0
+        self.queries = 0
+        self.query_time = 0.0
+        self.api_calls = 0
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+
+    def quantile(self, q):
+        """Upper bound (ms) of the bucket holding quantile q; None for +Inf"""
+        rank, seen = q * self.count, 0
+        for bound, count in zip(BUCKETS_MS + (None,), self.buckets):
+            seen += count
+            if seen >= rank:
+                return bound
+        return None
+
+    def summary(self):
+        count = max(self.count, 1)
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'avg_ms': round(self.wall / count * 1000, 2),
+            'p50_ms': self.quantile(0.5),
+            'p95_ms': self.quantile(0.95),
+            'max_ms': round(self.max_wall * 1000, 2),
+            'avg_db_wait_ms': round(self.db_wait / count * 1000, 2),
+            'avg_queries': round(self.queries / count, 2),
+            'avg_query_ms': round(self.query_time / count * 1000, 2),
+            'avg_api_calls': round(self.api_calls / count, 2),
+        }
+
+
+class HandlerMetrics:
+    """
+    Handler nomi bo'yicha update davomiyligi histogrammalari.
+    slow_ms dan uzoq davom etgan update eng sekin SQL so'rovlari bilan loglanadi.
+    """
+
+    def __init__(self, slow_ms=500, slow_queries=3):
+        self.slow_ms = slow_ms
+        self.slow_queries = slow_queries
+        self.handlers = {}
+        self.slow_updates = 0
+
+    def observe(self, record, error=False):
+        stats = self.handlers.get(record.handler)
+        if stats is None:
+            stats = self.handlers[record.handler] = HandlerStats()
+
+        wall_ms = record.wall * 1000
+        query_time = record.query_time
+        stats.count += 1
+        stats.errors += error
+        stats.wall += record.wall
+        stats.max_wall = max(stats.max_wall, record.wall)
+        stats.db_wait += record.db_wait
+        stats.queries += len(record.queries)
+        stats.query_time += query_time
+        stats.api_calls += record.api_calls
+        stats.buckets[bisect_left(BUCKETS_MS, wall_ms)] += 1
+
+        if self.slow_ms and wall_ms > self.slow_ms:
+            self.slow_updates += 1
+            logger.warning(
+                "Slow update %s: %.1f ms (db wait %.1f ms, %s queries %.1f ms, %s api calls %.1f ms); "
+                "slowest queries: %s",
+                record.handler, wall_ms, record.db_wait * 1000, len(record.queries), query_time * 1000,
+                record.api_calls, record.api_time * 1000,
+                [f"{duration * 1000:.1f} ms: {sql}" for duration, sql in record.slowest_queries(self.slow_queries)],
+            )
+
+    def stats(self):
+        """Totals over all handlers (for the shutdown log line)"""
+        updates = sum(stats.count for stats in self.handlers.values())
+        wall = sum(stats.wall for stats in self.handlers.values())
+        return {
+            'handlers': len(self.handlers),
+            'updates': updates,
+            'slow_updates': self.slow_updates,
+            'avg_ms': round(wall / updates * 1000, 2) if updates else 0.0,
+            'queries': sum(stats.queries for stats in self.handlers.values()),
+            'api_calls': sum(stats.api_calls for stats in self.handlers.values()),
+        }
+
+    def dump(self):
+        """Per-handler summaries and histograms, slowest (by total time) first"""
+        handlers = sorted(self.handlers.items(), key=lambda item: item[1].wall, reverse=True)
+        return {
+            'buckets_ms': list(BUCKETS_MS) + ['+Inf'],
+            'handlers': {
+                name: {**stats.summary(), 'histogram': list(stats.buckets)}
+                for name, stats in handlers
+            },
+        }
+
+    def log_dump(self):
+        logger.info("Handler metrics: %s", self.dump())
+
+    def reset(self):
+        self.handlers.clear()
+        self.slow_updates = 0
+
+
+def install_dump_signal(metrics=None):
+    """Log handler metrics when the process receives SIGUSR1 (kill -USR1 <pid>)"""
+    metrics = metrics or handler_metrics
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, metrics.log_dump)
+    except (AttributeError, NotImplementedError):  # Windows
+        pass
+
+
+class ApiCallCounter(BaseRequestMiddleware):
+    """Bot session middleware counting Bot API calls of the current update"""
+
+    async def __call__(self, make_request, bot, method):
+        record = current_update.get()
+        if record is None:
+            return await make_request(bot, method)
+
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        finally:
+            record.api_calls += 1
+            record.api_time += time.perf_counter() - started
+
+
+handler_metrics = HandlerMetrics(slow_ms=settings.BOT_SLOW_UPDATE_MS)
+api_call_counter = ApiCallCounter()
@@ -0,0 +1,260 @@
+"""
+Outbound Telegram rate limiter
+
+Bot sessiyasiga request middleware sifatida ulanadi, shuning uchun
+handlerlardagi barcha message.answer / answer_photo / answer_media_group
+va boshqa chat_id li yuborish so'rovlari shu yerdan o'tadi (albom bitta
+xabar hisoblanadi; o'chirish, tahrirlash va callback javoblari cheklanmaydi):
+
+- har bir chat uchun token bucket (shaxsiy chat ~1 xabar/s, guruh 20/min);
+- umumiy token bucket (~30 xabar/s), navbat ustuvorlik bo'yicha:
+  interaktiv javoblar broadcast lardan oldin yuboriladi;
+- 429 (retry_after) da o'sha chat retry_after ga to'xtatiladi va so'rov
+  qayta yuboriladi.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Priority lanes (lower value is sent first)
+INTERACTIVE = 0
+BROADCAST = 1
+LANES = {INTERACTIVE: 'interactive', BROADCAST: 'broadcast'}
+
+_lane = ContextVar('send_lane', default=INTERACTIVE)
+
+
+@contextmanager
+def send_lane(lane):
+    """Send all requests made inside the block with given priority"""
+    token = _lane.set(lane)
+    try:
+        yield
+    finally:
+        _lane.reset(token)
+
+
+class TokenBucket:
+    """Token bucket that can be paused (after 429)"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, tokens=1):
+        """Seconds until given number of tokens can be taken"""
+        now = time.monotonic()
+        self._refill(now)
+        needed = min(tokens, self.capacity)
+        wait = max(0.0, (needed - self.tokens) / self.rate)
+        return max(wait, self.paused_until - now)
+
+    def take(self, tokens=1):
+        self._refill(time.monotonic())
+        self.tokens -= tokens
+
+    def reserve(self, tokens=1):
+        """
+        Take tokens now and return seconds to wait before sending.
+        Balance may go below zero, so later callers wait for earlier ones.
+        """
+        wait = self.wait_time(tokens)
+        self.take(tokens)
+        return wait
+
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    @property
+    def idle(self):
+        now = time.monotonic()
+        self._refill(now)
+        return self.tokens >= self.capacity and self.paused_until <= now
+
+
+# Telegram flood limitlari faqat yuborishga tegishli
+UNLIMITED_METHODS = ('deleteMessage', 'editMessage', 'answerCallbackQuery')
+
+
+def request_chat_id(method):
+    """Chat whose send limits the request counts against; None if not limited"""
+    if getattr(method, '__api_method__', '').startswith(UNLIMITED_METHODS):
+        return None
+    return getattr(method, 'chat_id', None)
+
+
+class OutboundLimiter(BaseRequestMiddleware):
+    """
+    Session middleware that schedules requests under Telegram flood limits.
+
+    Faqat chat_id si bor yuborish so'rovlari cheklanadi (getUpdates,
+    answerCallbackQuery, deleteMessage, editMessage* darhol o'tadi).
+    Har bir so'rov, jumladan sendMediaGroup albomi, bitta token oladi.
+    """
+
+    def __init__(self, global_rate=30, chat_rate=1.0, chat_burst=3, group_rate=20 / 60,
+                 max_retries=3, max_chats=10000):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+        self.max_chats = max_chats
+
+        self._chats = {}
+        self._waiting = []  # heap of (lane, seq, tokens, future)
+        self._seq = itertools.count()
+        self._scheduler = None
+
+        self.chat_waiting = 0
+        self.attempts = 0
+        self.sent = {lane: 0 for lane in LANES}
+        self.retries = 0
+        self.failed = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    # Buckets
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= self.max_chats:
+                self._chats = {key: value for key, value in self._chats.items() if not value.idle}
+            is_group = isinstance(chat_id, str) or chat_id < 0
+            if is_group:
+                bucket = TokenBucket(self.group_rate, 1)
+            else:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    async def _acquire_chat(self, chat_id, tokens=1):
+        wait = self._chat_bucket(chat_id).reserve(tokens)
+        if wait > 0:
+            self.chat_waiting += 1
+            try:
+                await asyncio.sleep(wait)
+            finally:
+                self.chat_waiting -= 1
+
+    async def _acquire_global(self, lane, tokens=1):
+        # Fast path: nobody is waiting and tokens are available
+        if not self._waiting and self.global_bucket.wait_time(tokens) == 0:
+            self.global_bucket.take(tokens)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting, (lane, next(self._seq), tokens, future))
+        if self._scheduler is None or self._scheduler.done():
+            self._scheduler = asyncio.create_task(self._schedule())
+        await future
+
+    async def _schedule(self):
+        """Grant global tokens to waiting requests in priority order"""
+        while self._waiting:
+            lane, seq, tokens, future = self._waiting[0]
+            if future.cancelled():
+                heapq.heappop(self._waiting)
+                continue
+
+            wait = self.global_bucket.wait_time(tokens)
+            if wait > 0:
+                # Yangi, ustuvorroq so'rov kelgan bo'lsa keyingi aylanishda u olinadi
+                await asyncio.sleep(wait)
+                continue
+
+            heapq.heappop(self._waiting)
+            self.global_bucket.take(tokens)
+            future.set_result(None)
+
+    # Middleware
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = request_chat_id(method)
+        if chat_id is None:
+            return await make_request(bot, method)
+
+        lane = _lane.get()
+
+        for attempt in range(self.max_retries + 1):
+            queued = time.monotonic()
+            await self._acquire_chat(chat_id)
+            await self._acquire_global(lane)
+            started = time.monotonic()
+            self.attempts += 1
+            self._record_wait(started - queued)
+
+            try:
+                response = await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                self.retries += 1
+                if attempt == self.max_retries:
+                    self.failed += 1
+                    raise
+                logger.warning("Flood control in chat %s, retry in %ss", chat_id, e.retry_after)
+                self._chat_bucket(chat_id).pause(e.retry_after)
+            else:
+                self.sent[lane] += 1
+                return response
+            finally:
+                self._record_latency(time.monotonic() - started)
+
+    def _record_wait(self, seconds):
+        self.wait_total += seconds
+        self.wait_max = max(self.wait_max, seconds)
+
+    def _record_latency(self, seconds):
+        self.latency_total += seconds
+        self.latency_max = max(self.latency_max, seconds)
+
+    def queue_depth(self):
+        """Requests waiting for global tokens per lane, plus those waiting on chat buckets"""
+        depth = {name: 0 for name in LANES.values()}
+        for lane, _, _, future in self._waiting:
+            if not future.done():
+                depth[LANES[lane]] += 1
+        depth['chat'] = self.chat_waiting
+        return depth
+
+    def stats(self):
+        attempts = self.attempts
+        return {
+            'sent': {LANES[lane]: count for lane, count in self.sent.items()},
+            'retries': self.retries,
+            'failed': self.failed,
+            'queue_depth': self.queue_depth(),
+            'chats': len(self._chats),
+            'avg_wait_ms': round(self.wait_total / attempts * 1000, 2) if attempts else 0.0,
+            'max_wait_ms': round(self.wait_max * 1000, 2),
+            'avg_send_ms': round(self.latency_total / attempts * 1000, 2) if attempts else 0.0,
+            'max_send_ms': round(self.latency_max * 1000, 2),
+        }
+
+
+send_limiter = OutboundLimiter(
+    global_rate=settings.BOT_SEND_GLOBAL_RATE,
+    chat_rate=settings.BOT_SEND_CHAT_RATE,
+    chat_burst=settings.BOT_SEND_CHAT_BURST,
+    group_rate=settings.BOT_SEND_GROUP_RATE / 60,
+    max_retries=settings.BOT_SEND_MAX_RETRIES,
+)
@@ -0,0 +1,74 @@
+"""
+Keyset pagination of catalog lists for inline keyboards
+
+Ro'yxatlar (snapshot dagi kategoriyalar, mahsulotlar) id bo'yicha
+tartiblangan, shuning uchun sahifa offset bilan emas, kursor bilan
+olinadi: "a<id>" - shu id dan keyingilar, "b<id>" - shu id dan oldingilar.
+Tugmada kursor (entity_id, yo'nalish, id) argumentlari sifatida
+kodlanadi (bot.utils.callbacks):
+
+    pack(Action.PRODUCT_PAGE, 12, AFTER, 340)
+"""
+from bisect import bisect_left, bisect_right
+from operator import attrgetter
+
+from django.conf import settings
+
+from bot.utils.callbacks import Action, pack
+
+PAGE_ACTIONS = {'categories': Action.CATEGORY_PAGE, 'products': Action.PRODUCT_PAGE}
+DIRECTIONS = ('a', 'b')
+AFTER, BEFORE = 0, 1
+
+_item_id = attrgetter('id')
+
+
+class Page:
+    """One page of a list plus what is needed for its navigation buttons"""
+    __slots__ = ('items', 'kind', 'entity_id', 'has_previous', 'has_next')
+
+    def __init__(self, items, kind, entity_id, has_previous, has_next):
+        self.items = items
+        self.kind = kind
+        self.entity_id = entity_id
+        self.has_previous = has_previous
+        self.has_next = has_next
+
+    def _callback(self, direction, item):
+        return pack(PAGE_ACTIONS[self.kind], self.entity_id, direction, item.id)
+
+    @property
+    def previous_callback(self):
+        return self._callback(BEFORE, self.items[0])
+
+    @property
+    def next_callback(self):
+        return self._callback(AFTER, self.items[-1])
+
+
+def keyset_page(items, kind, entity_id, cursor=None, page_size=None):
+    """
+    Page of id-ordered items after/before cursor.
+    Only page_size + 1 items are sliced (the extra one tells if there is a next page).
+    """
+    page_size = page_size or settings.BOT_PAGE_SIZE
+    direction, cursor_id = (cursor[0], int(cursor[1:])) if cursor else ('a', None)
+
+    if direction == 'b':
+        end = bisect_left(items, cursor_id, key=_item_id)
+        start = max(0, end - page_size)
+        return Page(items[start:end], kind, entity_id, start > 0, end < len(items))
+
+    start = bisect_right(items, cursor_id, key=_item_id) if cursor_id is not None else 0
+    chunk = items[start:start + page_size + 1]
+    if not chunk and start:
+        # Kursordan keyin hech narsa qolmagan (masalan, mahsulot o'chirilgan)
+        return keyset_page(items, kind, entity_id, page_size=page_size)
+    return Page(chunk[:page_size], kind, entity_id, start > 0, len(chunk) > page_size)
+
+
+def page_cursor(direction, cursor_id):
+    """Cursor of decoded page button arguments: (0, 340) -> 'a340'"""
+    if direction >= len(DIRECTIONS):
+        raise ValueError(f"Invalid page direction: {direction}")
+    return f'{DIRECTIONS[direction]}{cursor_id}'
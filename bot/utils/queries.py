@@ -0,0 +1,169 @@
+"""
+Bot handlerlari uchun ma'lumotlar bazasi qatlami
+
+Har bir funksiya bitta ekran (savatcha, buyurtma ...) uchun kerakli
+barcha so'rovlarni bitta executor chaqiruvida bajaradi. Django'ning a*()
+metodlari (aget, aexists, ...) har bir so'rov uchun alohida
+sync_to_async(thread_sensitive=True) hop qiladi va hammasini yana bitta
+threadga navbatlaydi, shuning uchun bu yerda bot DB pool ishlatiladi.
+
+Katalog (kategoriya, mahsulot, rang) ekranlari bazaga emas,
+bot.utils.catalog dagi xotira snapshot iga murojaat qiladi.
+"""
+from store.models import User, Color, Cart, CartItem, CartSummary
+from store.search import search_products as _search_products
+from store.services import checkout
+from bot.utils.db import db_async
+
+
+# Cart
+
+def _active_cart_summary(user):
+    """CartSummary of user's active cart in one query (empty if there is no cart)"""
+    return CartSummary.from_items(list(
+        CartItem.objects.filter(cart__user=user, cart__is_active=True).with_totals()
+    ))
+
+
+def _cart_items_data(summary, language):
+    items_data = []
+    for item in summary.items:
+        items_data.append({
+            'item_id': item.id,
+            'product_name': item.color.product.get_name(language),
+            'color_name': item.color.get_name(language),
+            'price': item.color.price,
+            'quantity': item.quantity,
+            'item_total': item.line_total,
+        })
+    return items_data
+
+
+@db_async
+def get_cart_view(user, language):
+    """
+    Active cart items data and total price.
+    Returns ([], 0) if user has no active cart or it is empty.
+    """
+    summary = _active_cart_summary(user)
+    return _cart_items_data(summary, language), summary.total
+
+
+@db_async
+def cart_has_items(user):
+    """Whether user's active cart has at least one item"""
+    return CartItem.objects.filter(cart__user=user, cart__is_active=True).exists()
+
+
+@db_async
+def get_cart_item(item_id):
+    """Cart item with color, product and first color image"""
+    cart_item = CartItem.objects.select_related('color__product').get(id=item_id)
+    return cart_item, cart_item.color.images.first()
+
+
+@db_async
+def add_to_cart(user, color_id, quantity=1):
+    """Add color to user's active cart, returns (color, cart_item)"""
+    color = Color.objects.select_related('product').get(id=color_id)
+    cart, _ = Cart.objects.get_or_create(user=user, is_active=True)
+
+    # Insert or increase quantity in one statement (no read-modify-write race)
+    cart_item = CartItem.objects.add(cart, color, quantity)
+    return color, cart_item
+
+
+@db_async
+def change_cart_item_quantity(item_id, delta):
+    """
+    Add delta to cart item quantity, never going below 1.
+    Returns (cart_item, result) where result is "increased", "decreased"
+    or "minimum" (nothing changed). Raises CartItem.DoesNotExist.
+    """
+    # Quantity is changed in SQL, the minimum guard is part of the statement
+    updated = CartItem.objects.change_quantity(item_id, delta, clamp=True)
+    if updated is None:
+        if not CartItem.objects.filter(id=item_id).exists():
+            raise CartItem.DoesNotExist
+        return None, "minimum"
+
+    quantity, color_id = updated
+    color = Color.objects.select_related('product').get(id=color_id)
+    cart_item = CartItem(id=item_id, color=color, quantity=quantity)
+    return cart_item, "increased" if delta > 0 else "decreased"
+
+
+@db_async
+def delete_cart_item(item_id):
+    """Delete cart item (raises CartItem.DoesNotExist)"""
+    CartItem.objects.get(id=item_id).delete()
+
+
+@db_async
+def clear_cart(user):
+    """Delete all items of user's active cart (raises Cart.DoesNotExist)"""
+    cart = Cart.objects.get(user=user, is_active=True)
+    cart.items.all().delete()
+
+
+# Orders
+
+@db_async
+def get_order_summary(user, language):
+    """
+    Order confirmation data: (items_data, total_price).
+    Raises Cart.DoesNotExist if user has no active cart or it is empty.
+    """
+    summary = _active_cart_summary(user)
+    if not summary.items:
+        raise Cart.DoesNotExist
+    return _cart_items_data(summary, language), summary.total
+
+
+@db_async
+def create_order(user, address, checkout_key=None):
+    """Checkout user's active cart, returns (order, created)"""
+    return checkout(user, address, checkout_key)
+
+
+# Users
+
+@db_async
+def update_user(user, **fields):
+    """Update given user fields"""
+    for name, value in fields.items():
+        setattr(user, name, value)
+    user.save()
+    return user
+
+
+@db_async
+def register_user(telegram_user, name, language, phone_number):
+    """Create user from registration data (or update existing one)"""
+    user, created = User.objects.get_or_create(
+        telegram_id=telegram_user.id,
+        defaults={
+            'username': telegram_user.username or f"user_{telegram_user.id}",
+            'first_name': name,
+            'last_name': telegram_user.last_name or '',
+            'language': language,
+            'phone_number': phone_number
+        }
+    )
+
+    if not created:
+        # Update existing user
+        user.first_name = name
+        user.language = language
+        user.phone_number = phone_number
+        user.save()
+
+    return user
+
+
+# Search
+
+@db_async
+def search_products(query, limit):
+    """Ranked active products matching query (id, names, main_image only)"""
+    return _search_products(query, limit=limit)
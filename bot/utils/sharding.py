@@ -0,0 +1,319 @@
+"""
+Multi-process bot: bitta qabul qiluvchi jarayon va N ta worker
+
+Asosiy jarayon update larni (polling yoki webhook orqali) oladi va
+from_user.id bo'yicha workerlarga taqsimlaydi. Bitta foydalanuvchining
+update lari doim bitta workerga tushadi va u yerda navbat bilan qayta
+ishlanadi, shuning uchun FSM holati, user cache va xabarlar tartibi har
+bir worker ichida to'g'ri qoladi.
+"""
+import asyncio
+import hmac
+import logging
+import multiprocessing
+import queue
+import signal
+import time
+from collections import deque
+
+from aiohttp import web
+from aiogram import Dispatcher
+from aiogram.types import Update
+
+from bot.utils.webhook import serve_app, wait_for_shutdown
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+def shard_key(update):
+    """Id the update is routed by: sender, or chat for updates without one"""
+    event = update.event
+    user = getattr(event, 'from_user', None)
+    if user is not None:
+        return user.id
+    chat = getattr(event, 'chat', None)
+    if chat is not None:
+        return chat.id
+    return 0
+
+
+def shard_for(key, workers):
+    """Worker index of shard key"""
+    return key % workers
+
+
+class OrderedFeeder:
+    """
+    Process updates of one key strictly in order, different keys concurrently.
+
+    Har bir kalit uchun bitta vazifa o'z navbatidagi update larni ketma-ket
+    bajaradi; navbat bo'shaganda vazifa tugaydi.
+    """
+
+    def __init__(self, handle):
+        self.handle = handle
+        self._queues = {}
+        self._tasks = set()
+
+        self.processed = 0
+        self.failed = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.peak_active = 0
+        self.peak_backlog = 0
+
+    @property
+    def active(self):
+        return len(self._queues)
+
+    def submit(self, key, update):
+        pending = self._queues.get(key)
+        if pending is not None:
+            pending.append(update)
+            self.peak_backlog = max(self.peak_backlog, len(pending))
+            return
+
+        self._queues[key] = deque([update])
+        self.peak_active = max(self.peak_active, len(self._queues))
+        task = asyncio.create_task(self._drain(key))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _drain(self, key):
+        pending = self._queues[key]
+        try:
+            while pending:
+                update = pending.popleft()
+                started = time.monotonic()
+                try:
+                    await self.handle(update)
+                except Exception:
+                    self.failed += 1
+                    logger.exception("Failed to process update %s", update.update_id)
+                finally:
+                    elapsed = time.monotonic() - started
+                    self.processed += 1
+                    self.total_time += elapsed
+                    self.max_time = max(self.max_time, elapsed)
+        finally:
+            del self._queues[key]
+
+    async def join(self, timeout=None):
+        """Wait until all submitted updates are processed"""
+        if self._tasks:
+            await asyncio.wait(set(self._tasks), timeout=timeout)
+
+    def stats(self):
+        return {
+            'processed': self.processed,
+            'failed': self.failed,
+            'peak_active_users': self.peak_active,
+            'peak_backlog': self.peak_backlog,
+            'avg_ms': round(self.total_time / self.processed * 1000, 2) if self.processed else 0.0,
+            'max_ms': round(self.max_time * 1000, 2),
+        }
+
+
+def worker_main(index, token, updates, results, drain_timeout):
+    """Entry point of a worker process"""
+    # Ctrl+C butun guruhga yuboriladi; worker to'xtash signalini asosiy jarayondan kutadi
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+    import django
+    django.setup()
+    from bot.utils.log import configure_logging
+    listener = configure_logging()
+
+    try:
+        asyncio.run(_worker(index, token, updates, results, drain_timeout))
+    finally:
+        listener.stop()
+
+
+async def _worker(index, token, updates, results, drain_timeout):
+    from bot.dispatcher import create_bot, create_dispatcher
+    from bot.utils.catalog import catalog
+    from bot.utils.db import db_executor
+    from bot.utils.inline import inline_search
+    from bot.utils.keyboard_cache import keyboard_cache
+    from bot.utils.metrics import handler_metrics, install_dump_signal
+    from bot.utils.outbound import send_limiter
+    from bot.utils.user_cache import user_cache
+
+    bot = create_bot(token)
+    dp = create_dispatcher()
+    feeder = OrderedFeeder(lambda update: dp.feed_update(bot, update))
+    loop = asyncio.get_running_loop()
+    install_dump_signal()
+
+    await dp.emit_startup(bot=bot)
+    logger.info("Worker %s started", index)
+    try:
+        while True:
+            item = await loop.run_in_executor(None, updates.get)
+            if item is None:
+                break
+            key, payload = item
+            feeder.submit(key, Update.model_validate_json(payload, context={'bot': bot}))
+
+        await feeder.join(timeout=drain_timeout)
+    finally:
+        await dp.emit_shutdown(bot=bot)
+        await bot.session.close()
+        results.put({
+            'worker': index,
+            'updates': feeder.stats(),
+            'user_cache': user_cache.stats(),
+            'db': db_executor.stats(),
+            'outbound': send_limiter.stats(),
+            'catalog': catalog.stats(),
+            'keyboards': keyboard_cache.stats(),
+            'inline': inline_search.stats(),
+            'handlers': handler_metrics.stats(),
+        })
+        db_executor.shutdown()
+
+
+class ShardedBot:
+    """
+    Update distributor that runs the dispatcher in worker processes.
+
+    Workerlar spawn orqali ishga tushiriladi (asosiy jarayonning DB
+    ulanishlari va threadlari meros qolmaydi).
+    """
+
+    def __init__(self, bot, workers, drain_timeout=30):
+        self.bot = bot
+        self.workers = workers
+        self.drain_timeout = drain_timeout
+
+        self._context = multiprocessing.get_context('spawn')
+        self._results = self._context.Queue()
+        self._queues = [self._context.Queue() for _ in range(workers)]
+        self._processes = [None] * workers
+        self._stopping = False
+        self._watcher = None
+        self.secret_token = None
+
+        self.routed = [0] * workers
+        self.restarts = [0] * workers
+
+    def _start_worker(self, index):
+        process = self._context.Process(
+            target=worker_main,
+            args=(index, self.bot.token, self._queues[index], self._results, self.drain_timeout),
+            name=f'bot-worker-{index}',
+            daemon=True,
+        )
+        process.start()
+        self._processes[index] = process
+
+    def start(self):
+        for index in range(self.workers):
+            self._start_worker(index)
+        self._watcher = asyncio.create_task(self._watch())
+
+    def route(self, update):
+        key = shard_key(update)
+        index = shard_for(key, self.workers)
+        self._queues[index].put((key, update.model_dump_json(exclude_unset=True, by_alias=True)))
+        self.routed[index] += 1
+
+    async def _watch(self):
+        """Restart workers that died unexpectedly"""
+        while not self._stopping:
+            await asyncio.sleep(1)
+            for index, process in enumerate(self._processes):
+                if not self._stopping and not process.is_alive():
+                    logger.error("Worker %s exited with code %s, restarting", index, process.exitcode)
+                    self.restarts[index] += 1
+                    self._start_worker(index)
+
+    async def _poll(self, allowed_updates):
+        async for update in Dispatcher._listen_updates(self.bot, allowed_updates=allowed_updates):
+            self.route(update)
+
+    async def run_polling(self, allowed_updates=None):
+        self.start()
+        poller = asyncio.create_task(self._poll(allowed_updates))
+        try:
+            await wait_for_shutdown()
+        finally:
+            poller.cancel()
+            await self.stop()
+
+    async def _handle_webhook(self, request):
+        if self.secret_token and not hmac.compare_digest(
+            request.headers.get(SECRET_HEADER, ''), self.secret_token
+        ):
+            return web.Response(status=401, text='Unauthorized')
+
+        update = Update.model_validate(await request.json(), context={'bot': self.bot})
+        self.route(update)
+        return web.json_response({})
+
+    async def run_webhook(self, host, port, path, secret_token=None, webhook_url=None,
+                          allowed_updates=None):
+        self.secret_token = secret_token or None
+        app = web.Application()
+        app.router.add_post(path, self._handle_webhook)
+
+        async def on_shutdown(app):
+            await self.stop()
+
+        app.on_shutdown.append(on_shutdown)
+
+        if webhook_url:
+            await self.bot.set_webhook(
+                url=webhook_url.rstrip('/') + path,
+                secret_token=self.secret_token,
+                allowed_updates=allowed_updates,
+            )
+
+        self.start()
+        await serve_app(app, host, port)
+
+    async def stop(self):
+        """Let workers finish queued updates and collect their stats"""
+        if self._stopping:
+            return
+        self._stopping = True
+        loop = asyncio.get_running_loop()
+
+        if self._watcher is not None:
+            self._watcher.cancel()
+        for updates in self._queues:
+            updates.put(None)
+
+        reports = {}
+        deadline = time.monotonic() + self.drain_timeout + 10
+        while len(reports) < self.workers and time.monotonic() < deadline:
+            try:
+                report = await loop.run_in_executor(None, self._results.get, True, 1)
+            except queue.Empty:
+                if not any(process.is_alive() for process in self._processes):
+                    break
+                continue
+            reports[report['worker']] = report
+
+        for index, process in enumerate(self._processes):
+            await loop.run_in_executor(None, process.join, 5)
+            if process.is_alive():
+                logger.warning("Worker %s did not stop, terminating", index)
+                process.terminate()
+
+            report = reports.get(index, {})
+            logger.info(
+                "Worker %s: routed=%s restarts=%s updates=%s user_cache=%s db=%s outbound=%s "
+                "catalog=%s keyboards=%s inline=%s handlers=%s",
+                index, self.routed[index], self.restarts[index],
+                report.get('updates'), report.get('user_cache'), report.get('db'),
+                report.get('outbound'), report.get('catalog'), report.get('keyboards'),
+                report.get('inline'), report.get('handlers'),
+            )
+
+        await self.bot.session.close()
+
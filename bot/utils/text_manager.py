@@ -47,16 +47,15 @@ class TextManager:
     @staticmethod
     def get_order_summary(cart, address, language):
         """Get order summary text"""
-        cart_items = cart.items.all()
+        summary = cart.summary
         items_text = ""
-        total_price = cart.get_total_price()
+        total_price = summary.total
 
-        for item in cart_items:
+        for item in summary.items:
             product_name = item.color.product.get_name(language)
             color_name = item.color.get_name(language)
-            price = item.color.price
             quantity = item.quantity
-            item_total = price * quantity
+            item_total = item.line_total
 
             if language == 'uz':
                 items_text += f"- {product_name} ({color_name}) x {quantity} = {item_total} so'm\n"
@@ -0,0 +1,118 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from store.models import User
+from bot.utils.db import run_db
+
+_MISSING = object()
+
+
+class UserCache:
+    """
+    TTL bilan cheklangan LRU kesh: telegram_id -> User
+
+    Ro'yxatdan o'tmagan ID lar ham (None sifatida) qisqaroq TTL bilan
+    keshlanadi, shuning uchun /start bosmagan foydalanuvchilar ham har
+    safar bazaga murojaat qilmaydi.
+    """
+
+    def __init__(self, max_size=10000, ttl=300, negative_ttl=30):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries = OrderedDict()  # telegram_id -> (expires_at, user | None)
+        self._pending = {}  # telegram_id -> Future (bir xil ID uchun bitta so'rov)
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+        self.invalidations = 0
+
+    def lookup(self, telegram_id):
+        """Return cached user, None for cached "not registered", or _MISSING"""
+        entry = self._entries.get(telegram_id)
+        if entry is None:
+            return _MISSING
+
+        expires_at, user = entry
+        if expires_at < time.monotonic():
+            del self._entries[telegram_id]
+            return _MISSING
+
+        self._entries.move_to_end(telegram_id)
+        return user
+
+    def put(self, telegram_id, user):
+        """Store user (or None for unregistered ID) in cache"""
+        ttl = self.ttl if user is not None else self.negative_ttl
+        self._entries[telegram_id] = (time.monotonic() + ttl, user)
+        self._entries.move_to_end(telegram_id)
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, telegram_id):
+        """Drop cached entry after the user row has been written"""
+        self._entries.pop(telegram_id, None)
+        self.invalidations += 1
+
+    def clear(self):
+        self._entries.clear()
+
+    async def get(self, telegram_id):
+        """Get user by telegram_id, loading it from database on cache miss"""
+        user = self.lookup(telegram_id)
+        if user is not _MISSING:
+            self.hits += 1
+            if user is None:
+                self.negative_hits += 1
+            return user
+
+        self.misses += 1
+
+        pending = self._pending.get(telegram_id)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending[telegram_id] = future
+        try:
+            user = await run_db(self._load, telegram_id)
+            self.put(telegram_id, user)
+            future.set_result(user)
+            return user
+        except Exception as e:
+            future.set_exception(e)
+            # Kutayotgan so'rov bo'lmasa "exception was never retrieved" chiqmasin
+            future.exception()
+            raise
+        finally:
+            del self._pending[telegram_id]
+
+    @staticmethod
+    def _load(telegram_id):
+        try:
+            return User.objects.get(telegram_id=telegram_id)
+        except User.DoesNotExist:
+            return None
+
+    def stats(self):
+        """Hit/miss counters for monitoring"""
+        total = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'negative_hits': self.negative_hits,
+            'invalidations': self.invalidations,
+            'hit_ratio': self.hits / total if total else 0.0,
+        }
+
+
+user_cache = UserCache(
+    max_size=settings.BOT_USER_CACHE_SIZE,
+    ttl=settings.BOT_USER_CACHE_TTL,
+    negative_ttl=settings.BOT_USER_CACHE_NEGATIVE_TTL,
+)
@@ -0,0 +1,104 @@
+import asyncio
+import logging
+import signal
+
+from aiohttp import web
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+from bot.utils.metrics import handler_metrics
+
+logger = logging.getLogger(__name__)
+
+
+class DrainingRequestHandler(SimpleRequestHandler):
+    """
+    Webhook handler that waits for in-flight updates on shutdown.
+
+    Telegram ga darhol javob qaytariladi, update esa fon vazifasida
+    qayta ishlanadi. To'xtatishda bot sessiyasi yopilishidan oldin shu
+    vazifalar tugashi kutiladi.
+    """
+
+    def __init__(self, *args, drain_timeout=30, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.drain_timeout = drain_timeout
+
+    @property
+    def in_flight(self):
+        return len(self._background_feed_update_tasks)
+
+    async def close(self):
+        tasks = set(self._background_feed_update_tasks)
+        if tasks:
+            logger.info("Waiting for %s in-flight updates", len(tasks))
+            done, pending = await asyncio.wait(tasks, timeout=self.drain_timeout)
+            if pending:
+                logger.warning("%s updates did not finish in %ss, cancelling", len(pending), self.drain_timeout)
+                for task in pending:
+                    task.cancel()
+        await super().close()
+
+
+async def metrics_view(request):
+    """Per-handler metrics of this process as JSON"""
+    return web.json_response(handler_metrics.dump())
+
+
+async def run_webhook(dp, bot, host, port, path, secret_token=None, webhook_url=None,
+                      drain_timeout=30, allowed_updates=None, metrics_path=None):
+    """
+    Serve updates through aiohttp until SIGINT/SIGTERM.
+
+    webhook_url berilsa, ishga tushishda setWebhook chaqiriladi (bir nechta
+    worker bo'lsa, URL ni bittasi yoki reverse proxy sozlamasi o'rnatadi).
+    metrics_path berilsa, handler metrikalari shu yo'lda GET bilan beriladi
+    (reverse proxy uni tashqariga chiqarmasligi kerak).
+    """
+    app = web.Application()
+    handler = DrainingRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        secret_token=secret_token or None,
+        drain_timeout=drain_timeout,
+    )
+    handler.register(app, path=path)
+    if metrics_path:
+        app.router.add_get(metrics_path, metrics_view)
+    setup_application(app, dp, bot=bot)
+
+    if webhook_url:
+        await bot.set_webhook(
+            url=webhook_url.rstrip('/') + path,
+            secret_token=secret_token or None,
+            allowed_updates=allowed_updates,
+        )
+
+    await serve_app(app, host, port)
+
+
+async def wait_for_shutdown():
+    """Wait until the process receives SIGINT or SIGTERM"""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:  # Windows
+            pass
+    await stop.wait()
+
+
+async def serve_app(app, host, port):
+    """Run aiohttp application until SIGINT/SIGTERM"""
+    runner = web.AppRunner(app, handle_signals=False)
+    await runner.setup()
+    site = web.TCPSite(runner, host=host, port=port)
+    await site.start()
+    logger.info("Webhook server listening on %s:%s", host, port)
+
+    try:
+        await wait_for_shutdown()
+    finally:
+        # Listening socket closes first, then on_shutdown handlers run
+        logger.info("Stopping webhook server")
+        await runner.cleanup()
@@ -0,0 +1,418 @@
+"""
+Prometheus metrics of web workers and bot processes
+
+Har bir jarayon (gunicorn worker, bot yoki bot worker) o'z hisoblagichlarini
+oddiy dict larda saqlaydi va ularni vaqti-vaqti bilan
+METRICS_DIR/<hostname>-<pid>-<id>.json fayliga (atomik os.replace bilan)
+yozadi. Hostname va tasodifiy id tufayli boshqa konteynerdagi yoki qayta
+ishga tushgandan keyin shu pid ni olgan jarayon faylni ustidan yozmaydi.
+/metrics so'rovini qaysi worker olsa ham, papkadagi barcha fayllarni
+qo'shib (merge) Prometheus text formatida qaytaradi.
+
+Counter va histogramlar to'xtagan jarayonlar fayllaridan ham olinadi
+(jami kamaymasligi uchun), gauge lar esa faqat yaqinda yangilangan
+fayllardan olinadi. compact_after soniya yangilanmagan fayllar
+compacted.json ga qo'shilib o'chiriladi; jarayon keyinroq qayta yozsa,
+faylga faqat compaction dan keyingi o'sish yoziladi.
+"""
+import hmac
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: compaction lock yo'q
+    fcntl = None
+
+from django.conf import settings
+from django.db import connection
+from django.http import HttpResponse
+
+logger = logging.getLogger(__name__)
+
+# Request latency histogram bucket upper bounds (seconds); the last bucket is +Inf
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+COMPACTED = 'compacted.json'
+
+HELP = {
+    'http_requests_total': 'HTTP requests by view (DRF viewset action), method and status',
+    'http_request_duration_seconds': 'HTTP request latency by view',
+    'http_db_queries_total': 'SQL queries executed while handling HTTP requests',
+    'http_db_query_seconds_total': 'Time spent in SQL queries while handling HTTP requests',
+    'bot_updates_total': 'Bot updates handled, by handler',
+    'bot_update_errors_total': 'Bot updates whose handler raised, by handler',
+    'bot_update_duration_seconds': 'Bot update latency by handler',
+    'bot_db_queries_total': 'SQL queries executed by bot updates, by handler',
+    'bot_api_calls_total': 'Bot API calls made by bot updates, by handler',
+    'bot_cache_hits_total': 'Bot cache hits',
+    'bot_cache_misses_total': 'Bot cache misses',
+    'bot_outbound_sent_total': 'Messages sent through the outbound rate limiter, by lane',
+    'bot_outbound_retries_total': 'Outbound requests retried after 429',
+    'bot_outbound_failed_total': 'Outbound requests that failed after all retries',
+    'bot_outbound_queue_depth': 'Requests waiting in the outbound rate limiter, by lane (chat: per-chat waits)',
+    'bot_db_pool_active': 'Bot DB executor calls running now',
+    'bot_db_pool_queued': 'Bot DB executor calls waiting for a thread',
+}
+
+
+def _key(name, labels):
+    return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _merge(snapshot, counters, histograms):
+    """Add counters and histograms of a snapshot file to the given dicts"""
+    for name, labels, value in snapshot['counters']:
+        key = (name, tuple(map(tuple, labels)))
+        counters[key] = counters.get(key, 0) + value
+    for name, labels, buckets, counts, total in snapshot['histograms']:
+        key = (name, tuple(map(tuple, labels)))
+        merged = histograms.get(key)
+        if merged is None:
+            histograms[key] = [tuple(buckets), list(counts), total]
+        elif len(merged[1]) == len(counts):
+            merged[1] = [a + b for a, b in zip(merged[1], counts)]
+            merged[2] += total
+
+
+class Registry:
+    """
+    Per-process metrics.
+
+    runserver va gthread workerlar so'rovlarni bir nechta threadda
+    bajaradi, shuning uchun qiymatlar lock ostida o'zgaradi va faylni bir
+    vaqtda faqat bitta thread yozadi. Boshqa jarayonlar ularni faqat
+    flush() yozgan fayl orqali o'qiydi.
+    """
+
+    def __init__(self, directory, flush_interval=5.0, stale_after=60.0, compact_after=600.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.stale_after = stale_after
+        self.compact_after = compact_after
+        self.counters = {}  # (name, labels) -> value
+        self.gauges = {}
+        self.histograms = {}  # (name, labels) -> [bounds, counts, sum]
+        self._lock = threading.Lock()  # counters, gauges, histograms
+        self._flush_lock = threading.Lock()
+        self._flushed_at = 0.0
+        self._flush_failed = False
+        self._pid = None
+        self._name = None
+        self._written = None  # (counters, histograms) last written to the file
+        self._base = ({}, {})  # part of the totals already moved to compacted.json
+
+    # Web workers: incremental updates
+
+    def inc(self, name, value=1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [buckets, [0] * (len(buckets) + 1), 0.0]
+            histogram[1][bisect_left(buckets, value)] += 1
+            histogram[2] += value
+
+    # Bot: totals kept by the bot services themselves
+
+    def set_counter(self, name, value, **labels):
+        with self._lock:
+            self.counters[_key(name, labels)] = value
+
+    def set_gauge(self, name, value, **labels):
+        with self._lock:
+            self.gauges[_key(name, labels)] = value
+
+    def set_histogram(self, name, buckets, counts, total, **labels):
+        with self._lock:
+            self.histograms[_key(name, labels)] = [tuple(buckets), list(counts), total]
+
+    def totals(self):
+        """Consistent copy of (counters, gauges, histograms)"""
+        with self._lock:
+            return (
+                dict(self.counters),
+                dict(self.gauges),
+                {key: [buckets, list(counts), total] for key, (buckets, counts, total) in self.histograms.items()},
+            )
+
+    def snapshot(self, totals=None):
+        """File contents: totals minus the part already in compacted.json"""
+        counters, gauges, histogram_totals = totals or self.totals()
+        base_counters, base_histograms = self._base
+        histograms = []
+        for key, (buckets, counts, total) in histogram_totals.items():
+            base = base_histograms.get(key)
+            if base is not None and len(base[1]) == len(counts):
+                counts = [a - b for a, b in zip(counts, base[1])]
+                total -= base[2]
+            histograms.append([*key, buckets, counts, total])
+        return {
+            'counters': [
+                [name, labels, value - base_counters.get((name, labels), 0)]
+                for (name, labels), value in counters.items()
+            ],
+            'gauges': [[name, labels, value] for (name, labels), value in gauges.items()],
+            'histograms': histograms,
+        }
+
+    @property
+    def path(self):
+        pid = os.getpid()
+        if self._pid != pid:
+            # Yangi jarayon (yoki fork): o'z fayli, oldingi yozuvlar unga tegishli emas
+            self._pid = pid
+            self._name = f'{socket.gethostname()}-{pid}-{uuid.uuid4().hex[:8]}.json'
+            self._written = None
+            self._base = ({}, {})
+        return os.path.join(self.directory, self._name)
+
+    @contextmanager
+    def _directory_lock(self):
+        """Serializes flushes with compaction across processes sharing the directory"""
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.directory, '.lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def flush(self, force=False):
+        """
+        Write this process' snapshot (at most once per flush_interval unless forced).
+        Never raises: metrics must not fail the request that triggered the flush.
+        """
+        now = time.monotonic()
+        if not force and now - self._flushed_at < self.flush_interval:
+            return
+        # Boshqa thread ayni paytda yozayotgan bo'lsa, oddiy flush kutmaydi
+        if not self._flush_lock.acquire(blocking=force):
+            return
+        path = None
+        try:
+            self._flushed_at = now
+            path = self.path
+            os.makedirs(self.directory, exist_ok=True)
+            with self._directory_lock():
+                if self._written is not None and not os.path.exists(path):
+                    # Fayl compacted.json ga ko'chirilgan: o'shanda yozilgan jami endi asos
+                    self._base = self._written
+                counters, _, histograms = totals = self.totals()
+                with open(f'{path}.tmp', 'w') as file:
+                    json.dump(self.snapshot(totals), file)
+                os.replace(f'{path}.tmp', path)
+            self._written = (counters, histograms)
+            self._flush_failed = False
+        except Exception as e:
+            if not self._flush_failed:  # har flush da emas, bir marta loglanadi
+                logger.warning("Could not write metrics to %s: %s", path or self.directory, e)
+            self._flush_failed = True
+        finally:
+            self._flush_lock.release()
+
+    def compact(self):
+        """
+        Fold files not written for compact_after seconds (exited processes)
+        into compacted.json, so the directory does not grow forever
+        """
+        now = time.time()
+        try:
+            stale = [
+                entry for entry in os.scandir(self.directory)
+                if entry.name.endswith('.json') and entry.name != COMPACTED
+                and now - entry.stat().st_mtime > self.compact_after
+            ]
+        except FileNotFoundError:
+            return
+        if not stale:
+            return
+
+        compacted = os.path.join(self.directory, COMPACTED)
+        counters, histograms = {}, {}
+        try:
+            with open(compacted) as file:
+                _merge(json.load(file), counters, histograms)
+        except FileNotFoundError:
+            pass
+        for entry in stale:
+            with open(entry.path) as file:
+                _merge(json.load(file), counters, histograms)
+
+        with open(f'{compacted}.tmp', 'w') as file:
+            json.dump({
+                'counters': [[name, labels, value] for (name, labels), value in counters.items()],
+                'gauges': [],
+                'histograms': [[*key, *histogram] for key, histogram in histograms.items()],
+            }, file)
+        os.replace(f'{compacted}.tmp', compacted)
+        for entry in stale:
+            os.unlink(entry.path)
+
+    def collect(self):
+        """Snapshots of all processes merged: (counters, gauges, histograms)"""
+        counters, gauges, histograms = {}, {}, {}
+        try:
+            with self._directory_lock():
+                self.compact()
+        except FileNotFoundError:
+            pass  # hali hech bir jarayon yozmagan
+        except (OSError, ValueError) as e:
+            logger.warning("Could not compact metrics in %s: %s", self.directory, e)
+        try:
+            entries = [entry for entry in os.scandir(self.directory) if entry.name.endswith('.json')]
+        except FileNotFoundError:
+            entries = []
+
+        now = time.time()
+        for entry in entries:
+            try:
+                with open(entry.path) as file:
+                    snapshot = json.load(file)
+                modified = entry.stat().st_mtime
+            except (OSError, ValueError):
+                continue  # boshqa jarayon ayni paytda yozyapti yoki o'chirdi
+
+            _merge(snapshot, counters, histograms)
+            if now - modified <= self.stale_after:
+                for name, labels, value in snapshot['gauges']:
+                    key = (name, tuple(map(tuple, labels)))
+                    gauges[key] = gauges.get(key, 0) + value
+        return counters, gauges, histograms
+
+
+def _labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (
+        (key, value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in pairs
+    )
+    return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(counters, gauges, histograms):
+    """Prometheus text exposition format"""
+    families = {}
+    for kind, samples in (('counter', counters), ('gauge', gauges), ('histogram', histograms)):
+        for (name, labels), value in samples.items():
+            families.setdefault(name, (kind, []))[1].append((labels, value))
+
+    lines = []
+    for name in sorted(families):
+        kind, samples = families[name]
+        if name in HELP:
+            lines.append(f'# HELP {name} {HELP[name]}')
+        lines.append(f'# TYPE {name} {kind}')
+        for labels, value in sorted(samples):
+            if kind != 'histogram':
+                lines.append(f'{name}{_labels(labels)} {_number(value)}')
+                continue
+            buckets, counts, total = value
+            cumulative = 0
+            for bound, count in zip(tuple(buckets) + ('+Inf',), counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{_labels(labels, [("le", str(bound))])} {cumulative}')
+            lines.append(f'{name}_sum{_labels(labels)} {_number(total)}')
+            lines.append(f'{name}_count{_labels(labels)} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+
+registry = Registry(
+    settings.METRICS_DIR,
+    flush_interval=settings.METRICS_FLUSH_INTERVAL,
+    stale_after=settings.METRICS_STALE_AFTER,
+    compact_after=settings.METRICS_COMPACT_AFTER,
+)
+
+
+def view_label(request, view_func):
+    """'ProductViewSet.list' for DRF viewset actions, URL name or function name otherwise"""
+    cls = getattr(view_func, 'cls', None)
+    if cls is not None:
+        action = (getattr(view_func, 'actions', None) or {}).get(request.method.lower())
+        return f'{cls.__name__}.{action}' if action else cls.__name__
+    match = request.resolver_match
+    return (match.view_name if match else None) or getattr(view_func, '__name__', 'unknown')
+
+
+class QueryCounter:
+    """connection.execute_wrapper counting queries of one request"""
+
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.time += time.perf_counter() - started
+
+
+class MetricsMiddleware:
+    """Request count, latency and SQL queries per view"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        queries = QueryCounter()
+        with connection.execute_wrapper(queries):
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - started
+
+        try:
+            self.record(request, response, elapsed, queries)
+        except Exception:
+            logger.exception("Could not record request metrics")
+        return response
+
+    @staticmethod
+    def record(request, response, elapsed, queries):
+        # URL topilmagan so'rovlar bitta label ga yig'iladi (cardinality cheklangan)
+        view = getattr(request, 'metrics_view', 'unmatched')
+        registry.inc('http_requests_total', view=view, method=request.method, status=response.status_code)
+        registry.observe('http_request_duration_seconds', elapsed, view=view)
+        if queries.count:
+            registry.inc('http_db_queries_total', queries.count, view=view)
+            registry.inc('http_db_query_seconds_total', queries.time, view=view)
+        registry.flush()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.metrics_view = view_label(request, view_func)
+
+
+def metrics_view(request):
+    """All web and bot processes' metrics in Prometheus text format"""
+    token = settings.METRICS_TOKEN
+    authorization = request.headers.get('Authorization', '').encode()
+    if token and not hmac.compare_digest(authorization, f'Bearer {token}'.encode()):
+        return HttpResponse(status=401)
+
+    registry.flush(force=True)
+    return HttpResponse(render(*registry.collect()), content_type=CONTENT_TYPE)
@@ -1,4 +1,5 @@
 import os
+import tempfile
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -24,6 +25,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 
     # Third-party apps
     'rest_framework',
@@ -38,6 +40,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -129,6 +132,87 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # Telegram Bot Settings
 TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN', 'your-bot-token-here')
 
+# Bot user cache (AuthenticationMiddleware)
+BOT_USER_CACHE_SIZE = int(os.getenv('BOT_USER_CACHE_SIZE', '10000'))
+BOT_USER_CACHE_TTL = int(os.getenv('BOT_USER_CACHE_TTL', '300'))
+BOT_USER_CACHE_NEGATIVE_TTL = int(os.getenv('BOT_USER_CACHE_NEGATIVE_TTL', '30'))
+
+# Bot DB executor: number of worker threads (each keeps its own DB connection)
+BOT_DB_POOL_SIZE = int(os.getenv('BOT_DB_POOL_SIZE', '8'))
+
+# Bot webhook mode (runbot --webhook)
+BOT_WEBHOOK_URL = os.getenv('BOT_WEBHOOK_URL', '')  # public base URL, e.g. https://example.com
+BOT_WEBHOOK_PATH = os.getenv('BOT_WEBHOOK_PATH', '/telegram/webhook')
+BOT_WEBHOOK_SECRET = os.getenv('BOT_WEBHOOK_SECRET', '')
+BOT_WEBHOOK_HOST = os.getenv('BOT_WEBHOOK_HOST', '0.0.0.0')
+BOT_WEBHOOK_PORT = int(os.getenv('BOT_WEBHOOK_PORT', '8080'))
+BOT_WEBHOOK_DRAIN_TIMEOUT = int(os.getenv('BOT_WEBHOOK_DRAIN_TIMEOUT', '30'))
+
+# Bot worker processes (runbot --workers); updates are sharded by user id
+BOT_WORKERS = int(os.getenv('BOT_WORKERS', '1'))
+
+# Bot FSM storage: 'database' (FSMRecord table), 'redis' or 'memory'
+BOT_FSM_STORAGE = os.getenv('BOT_FSM_STORAGE', 'database')
+BOT_FSM_TTL = int(os.getenv('BOT_FSM_TTL', '86400'))  # seconds
+BOT_FSM_FLUSH_INTERVAL = int(os.getenv('BOT_FSM_FLUSH_INTERVAL', '50'))  # ms, database backend
+BOT_FSM_BATCH_SIZE = int(os.getenv('BOT_FSM_BATCH_SIZE', '500'))  # database backend
+BOT_FSM_REDIS_URL = os.getenv('BOT_FSM_REDIS_URL', 'redis://localhost:6379/0')
+
+# Bot outbound rate limits (Telegram flood control)
+BOT_SEND_GLOBAL_RATE = int(os.getenv('BOT_SEND_GLOBAL_RATE', '30'))  # messages per second
+BOT_SEND_CHAT_RATE = float(os.getenv('BOT_SEND_CHAT_RATE', '1'))  # messages per second in one chat
+BOT_SEND_CHAT_BURST = int(os.getenv('BOT_SEND_CHAT_BURST', '3'))
+BOT_SEND_GROUP_RATE = int(os.getenv('BOT_SEND_GROUP_RATE', '20'))  # messages per minute in a group
+BOT_SEND_MAX_RETRIES = int(os.getenv('BOT_SEND_MAX_RETRIES', '3'))  # retries after 429
+
+# Cart +/- taps within this window are applied as one update and one message edit
+BOT_QUANTITY_DEBOUNCE_MS = int(os.getenv('BOT_QUANTITY_DEBOUNCE_MS', '400'))
+
+# Bot serves catalog browsing from an in-memory snapshot; the catalog
+# version in the database is checked at most this often (seconds)
+BOT_CATALOG_CHECK_INTERVAL = float(os.getenv('BOT_CATALOG_CHECK_INTERVAL', '5'))
+
+# Catalog keyboards are cached per (kind, id, language, catalog version)
+BOT_KEYBOARD_CACHE_SIZE = int(os.getenv('BOT_KEYBOARD_CACHE_SIZE', '2048'))
+
+# Buttons per page in category and product list keyboards
+BOT_PAGE_SIZE = int(os.getenv('BOT_PAGE_SIZE', '8'))
+
+# Number of products shown for a bot search query
+BOT_SEARCH_LIMIT = int(os.getenv('BOT_SEARCH_LIMIT', '10'))
+
+# Inline mode (@bot query): results per answer (Telegram allows up to 50),
+# ranked results kept per query and how long they are cached (seconds)
+BOT_INLINE_PAGE_SIZE = int(os.getenv('BOT_INLINE_PAGE_SIZE', '20'))
+BOT_INLINE_MAX_RESULTS = int(os.getenv('BOT_INLINE_MAX_RESULTS', '100'))
+BOT_INLINE_CACHE_SIZE = int(os.getenv('BOT_INLINE_CACHE_SIZE', '1000'))
+BOT_INLINE_CACHE_TTL = int(os.getenv('BOT_INLINE_CACHE_TTL', '30'))
+
+# Updates slower than this (ms) are logged with their slowest SQL queries (0 disables)
+BOT_SLOW_UPDATE_MS = int(os.getenv('BOT_SLOW_UPDATE_MS', '500'))
+# Per-handler metrics JSON served by the webhook server on this path (empty disables;
+# single process only, with BOT_WORKERS > 1 use the web /metrics endpoint)
+BOT_METRICS_PATH = os.getenv('BOT_METRICS_PATH', '')
+
+# Bot log level (DEBUG records of handlers are not even built above DEBUG)
+BOT_LOG_LEVEL = os.getenv('BOT_LOG_LEVEL', 'DEBUG' if DEBUG else 'INFO')
+# Share of updates whose DEBUG/INFO records are kept, and per-handler overrides:
+# "products.process_product=0.01,cart.show_cart=0.1"
+BOT_LOG_SAMPLE_RATE = float(os.getenv('BOT_LOG_SAMPLE_RATE', '1.0'))
+BOT_LOG_SAMPLING = os.getenv('BOT_LOG_SAMPLING', '')
+
+# Prometheus /metrics: every web and bot process writes its counters to
+# METRICS_DIR (share it between the web and bot containers), at most once
+# per METRICS_FLUSH_INTERVAL seconds. Gauges of processes silent for
+# METRICS_STALE_AFTER seconds are dropped; their files are folded into
+# compacted.json after METRICS_COMPACT_AFTER seconds. METRICS_TOKEN requires
+# "Authorization: Bearer <token>" on /metrics
+METRICS_DIR = os.getenv('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'online_shop_metrics'))
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', '5'))
+METRICS_STALE_AFTER = float(os.getenv('METRICS_STALE_AFTER', '60'))
+METRICS_COMPACT_AFTER = float(os.getenv('METRICS_COMPACT_AFTER', '600'))
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
 # REST Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
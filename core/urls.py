@@ -10,6 +10,8 @@ from drf_spectacular.views import (
 from django.shortcuts import render
 from django.http import JsonResponse
 
+from core.metrics import metrics_view
+
 
 def home_view(request):
     """Bosh sahifa ko'rinishi"""
@@ -85,6 +87,9 @@ urlpatterns = [
     path('api/', include('api.urls')),
     path('api/info/', api_info, name='api-info'),
 
+    # Prometheus metrics (web workers va bot)
+    path('metrics', metrics_view, name='metrics'),
+
     # API dokumentatsiya - Spectacular
     path('api/schema/', SpectacularAPIView.as_view(), name='schema'),
     path('api/docs/', SpectacularSwaggerView.as_view(url_name='schema'), name='swagger-ui'),
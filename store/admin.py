@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import User, Category, Product, Color, ColorImage, Cart, CartItem, Order, OrderItem
+from .models import User, Category, Product, Color, ColorImage, ImageMetadata, TelegramFile, Cart, CartItem, Order, OrderItem
 
 @admin.register(User)
 class UserAdmin(admin.ModelAdmin):
@@ -31,6 +31,17 @@ class ColorImageAdmin(admin.ModelAdmin):
     # 'order' o'rniga 'image' ishlatilmoqda
     list_display = ('color', 'image')
 
+@admin.register(ImageMetadata)
+class ImageMetadataAdmin(admin.ModelAdmin):
+    list_display = ('path', 'format', 'width', 'height', 'size', 'is_valid', 'updated_at')
+    list_filter = ('is_valid', 'format')
+    search_fields = ('path',)
+
+@admin.register(TelegramFile)
+class TelegramFileAdmin(admin.ModelAdmin):
+    list_display = ('path', 'content_hash', 'file_id', 'created_at')
+    search_fields = ('path', 'file_id')
+
 @admin.register(Cart)
 class CartAdmin(admin.ModelAdmin):
     list_display = ('user', 'is_active', 'created_at')
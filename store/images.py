@@ -0,0 +1,91 @@
+import hashlib
+import logging
+import os
+
+from django.conf import settings
+from PIL import Image
+
+from .models import ImageMetadata
+
+logger = logging.getLogger(__name__)
+
+# Telegram photo limits
+MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
+MAX_DIMENSION = 10000
+SUPPORTED_FORMATS = ('JPEG', 'PNG', 'GIF', 'WEBP')
+
+
+def image_file_path(image_field):
+    """Absolute file path of image field (or None if field is empty)"""
+    if not image_field:
+        return None
+    return os.path.join(settings.MEDIA_ROOT, str(image_field))
+
+
+def inspect_image(file_path, stat=None):
+    """
+    Open image and check it for Telegram compatibility.
+    Returns ImageMetadata field values.
+    """
+    stat = stat or os.stat(file_path)
+    fields = {
+        'size': stat.st_size,
+        'mtime': stat.st_mtime,
+        'width': None,
+        'height': None,
+        'format': '',
+        'content_hash': '',
+        'is_valid': False,
+    }
+
+    # Check file size (max 10MB for photos)
+    if stat.st_size > MAX_FILE_SIZE:
+        logger.debug("File too large: %s (%s bytes)", file_path, stat.st_size)
+        return fields
+
+    try:
+        with Image.open(file_path) as img:
+            fields.update(width=img.width, height=img.height, format=img.format or '')
+    except Exception as e:
+        logger.debug("Error validating image %s: %s", file_path, e)
+        return fields
+
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b''):
+            digest.update(chunk)
+    fields['content_hash'] = digest.hexdigest()
+
+    fields['is_valid'] = (
+        fields['format'] in SUPPORTED_FORMATS
+        and fields['width'] <= MAX_DIMENSION
+        and fields['height'] <= MAX_DIMENSION
+    )
+    if not fields['is_valid']:
+        logger.debug("Unsupported image: %s (%s %sx%s)", file_path, fields['format'],
+                     fields['width'], fields['height'])
+
+    return fields
+
+
+def refresh_image_metadata(image_field):
+    """Inspect image file and store the result in ImageMetadata"""
+    file_path = image_file_path(image_field)
+    if not file_path:
+        return None
+
+    try:
+        stat = os.stat(file_path)
+    except OSError as e:
+        logger.warning("Cannot inspect image %s: %s", file_path, e)
+        return None
+
+    # Fayl o'zgarmagan bo'lsa qayta ochilmaydi
+    metadata = ImageMetadata.objects.filter(
+        path=str(image_field), mtime=stat.st_mtime, size=stat.st_size
+    ).first()
+    if metadata is None:
+        metadata, _ = ImageMetadata.objects.update_or_create(
+            path=str(image_field), defaults=inspect_image(file_path, stat)
+        )
+    return metadata
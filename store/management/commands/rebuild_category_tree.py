@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from store.models import Category
+
+
+class Command(BaseCommand):
+    help = 'Recompute materialized category paths from parent links'
+
+    def handle(self, *args, **options):
+        updated = Category.objects.rebuild_paths()
+        self.stdout.write(self.style.SUCCESS(f'{updated} categories updated'))
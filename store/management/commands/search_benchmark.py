@@ -0,0 +1,118 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from store.models import Product
+from store.search import search_products
+from store.translit import search_key, to_latin
+
+FIXTURE_TAG = 'search-benchmark'
+
+BRANDS = ['Artel', 'Samsung', 'Xiaomi', 'Nike', 'Adidas', 'Lenovo', 'Bosch', 'Tefal', 'Zara', 'Casio']
+ADJECTIVES = [
+    ('qizil', 'красный'), ("ko'k", 'синий'), ('yashil', 'зелёный'), ('qora', 'чёрный'),
+    ('oq', 'белый'), ('sariq', 'жёлтый'), ('katta', 'большой'), ('kichik', 'маленький'),
+    ('yangi', 'новый'), ('klassik', 'классический'),
+]
+NOUNS = [
+    ("ko'ylak", 'рубашка'), ('shim', 'брюки'), ('poyabzal', 'обувь'), ('soat', 'часы'),
+    ('sumka', 'сумка'), ('telefon', 'телефон'), ('kurtka', 'куртка'), ("do'ppi", 'тюбетейка'),
+    ("ro'mol", 'платок'), ('gilam', 'ковёр'), ('choynak', 'чайник'), ('qozon', 'казан'),
+    ('piyola', 'пиала'), ('paypoq', 'носки'), ('kostyum', 'костюм'), ('changyutgich', 'пылесос'),
+]
+
+
+def _typo(word, rng):
+    """Word with one letter dropped"""
+    if len(word) < 5:
+        return word
+    position = rng.randrange(1, len(word) - 1)
+    return word[:position] + word[position + 1:]
+
+
+QUERY_KINDS = {
+    'uz': lambda adj, noun, brand, rng: f'{adj[0]} {noun[0]}',
+    'ru': lambda adj, noun, brand, rng: f'{adj[1]} {noun[1]}',
+    'ru_latin': lambda adj, noun, brand, rng: f'{brand} {to_latin(noun[1])}',
+    'prefix': lambda adj, noun, brand, rng: noun[0][:4],
+    'typo': lambda adj, noun, brand, rng: f'{brand} {_typo(noun[0], rng)}',
+}
+
+
+class Command(BaseCommand):
+    help = 'Benchmark ranked product search on a generated product fixture (use a development database)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=100_000, help='Fixture size')
+        parser.add_argument('--queries', type=int, default=200, help='Queries per kind')
+        parser.add_argument('--limit', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--keep', action='store_true', help='Keep the fixture for the next run')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        fixture = Product.objects.filter(description_uz=FIXTURE_TAG)
+        existing = fixture.count()
+        try:
+            if existing < options['products']:
+                self.create_fixture(options['products'] - existing, existing, rng)
+            self.stdout.write(f'{connection.vendor}, {Product.objects.count():,} products')
+
+            for kind, make_query in QUERY_KINDS.items():
+                self.run_kind(kind, make_query, rng, options)
+        finally:
+            if not options['keep']:
+                self.remove_fixture()
+
+    def create_fixture(self, count, offset, rng):
+        started = time.perf_counter()
+        batch = []
+        for number in range(offset, offset + count):
+            brand, adj, noun = rng.choice(BRANDS), rng.choice(ADJECTIVES), rng.choice(NOUNS)
+            name_uz = f'{brand} {adj[0]} {noun[0]} {number}'
+            name_ru = f'{brand} {adj[1]} {noun[1]} {number}'
+            batch.append(Product(
+                name_uz=name_uz, name_ru=name_ru,
+                description_uz=FIXTURE_TAG, description_ru=FIXTURE_TAG,
+                search_name=search_key(name_uz, name_ru), search_text=search_key(FIXTURE_TAG),
+            ))
+            if len(batch) == 5000:
+                Product.objects.bulk_create(batch)
+                batch = []
+        Product.objects.bulk_create(batch)
+
+        Product.objects.filter(description_uz=FIXTURE_TAG).update_search_vectors()
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE store_product')
+        self.stdout.write(f'fixture: {count:,} products in {time.perf_counter() - started:.1f} s')
+
+    def remove_fixture(self):
+        # Fixture mahsulotlarining rang/kategoriyasi yo'q; queryset.delete() esa
+        # har bir qator uchun post_delete signalini (katalog versiyasi) chaqirardi
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {Product._meta.db_table} WHERE description_uz = %s', [FIXTURE_TAG]
+            )
+            self.stdout.write(f'fixture removed ({cursor.rowcount:,} rows)')
+
+    def run_kind(self, kind, make_query, rng, options):
+        latencies, found = [], []
+        for _ in range(options['queries']):
+            query = make_query(rng.choice(ADJECTIVES), rng.choice(NOUNS), rng.choice(BRANDS), rng)
+            started = time.perf_counter()
+            results = search_products(query, limit=options['limit'])
+            latencies.append(time.perf_counter() - started)
+            found.append(len(results))
+
+        latencies.sort()
+        p95 = latencies[int(len(latencies) * 0.95) - 1] if latencies else 0
+        p99 = latencies[int(len(latencies) * 0.99) - 1] if latencies else 0
+        self.stdout.write(
+            f'  {kind}: p50 {statistics.median(latencies) * 1000:.2f} ms, '
+            f'p95 {p95 * 1000:.2f} ms, p99 {p99 * 1000:.2f} ms, '
+            f'avg results {statistics.mean(found):.1f}'
+        )
@@ -1,6 +1,15 @@
-from django.db import models
+from decimal import Decimal
+
+from django.contrib.postgres.search import SearchVector, SearchVectorField
+from django.db import connections, models
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Subquery, Sum, Value, Window
+from django.db.models.functions import Concat, Substr
+from django.utils.functional import cached_property
+from django.utils.timezone import now
 from django.utils.translation import gettext_lazy as _
 
+from .translit import search_key
+
 
 class User(models.Model):
     """User model for storing Telegram user data"""
@@ -22,6 +31,75 @@ class User(models.Model):
         return f"{self.first_name} ({self.telegram_id})"
 
 
+def path_segment(pk):
+    """Materialized path segment of one category: zero padded id and '/'"""
+    return f'{pk:08d}/'
+
+
+class CategoryQuerySet(models.QuerySet):
+    """
+    Category tree queries over the materialized path.
+
+    Har bir kategoriyaning `path` i barcha ota-kategoriyalar id lari va
+    o'zining id sidan iborat ("00000001/00000005/"), shuning uchun
+    subtree - bitta LIKE 'path%', ota-kategoriyalar - path dagi id lar.
+    """
+
+    def subtree(self, category, include_self=True):
+        """Category and all its descendants, in tree (path) order"""
+        queryset = self.filter(path__startswith=category.path).order_by('path')
+        if not include_self:
+            queryset = queryset.exclude(pk=category.pk)
+        return queryset
+
+    def ancestors(self, category, include_self=False):
+        """Ancestors of loaded category, root first"""
+        ids = category.path_ids if include_self else category.path_ids[:-1]
+        return self.filter(pk__in=ids).order_by('depth')
+
+    def breadcrumb(self, category_id):
+        """Category with all its ancestors by id only, root first, in one query"""
+        target = self.model.objects.filter(pk=category_id).values('path')[:1]
+        return (
+            self.alias(target_path=Subquery(target))
+            .filter(target_path__startswith=F('path'))
+            .order_by('depth')
+        )
+
+    def children_map(self):
+        """parent_id -> children (in path order) of all categories in queryset"""
+        children = {}
+        for category in self.filter(parent__isnull=False).order_by('path'):
+            children.setdefault(category.parent_id, []).append(category)
+        return children
+
+    def rebuild_paths(self):
+        """
+        Recompute path/depth of all categories from parent links
+        (e.g. after queryset.update(parent=...) that bypasses save()).
+        Returns number of updated categories.
+        """
+        manager = self.model.objects.db_manager(self.db)
+        rows = list(manager.values_list('id', 'parent_id', 'path', 'depth'))
+        parents = {row[0]: row[1] for row in rows}
+        paths = {}
+
+        def build(pk):
+            if pk not in paths:
+                parent_id = parents[pk]
+                paths[pk] = (build(parent_id) if parent_id else '') + path_segment(pk)
+            return paths[pk]
+
+        changed = []
+        for pk, parent_id, path, depth in rows:
+            new_path = build(pk)
+            new_depth = new_path.count('/') - 1
+            if (path, depth) != (new_path, new_depth):
+                changed.append(self.model(id=pk, path=new_path, depth=new_depth))
+        manager.bulk_update(changed, ['path', 'depth'], batch_size=500)
+        return len(changed)
+
+
 class Category(models.Model):
     """Category model for product categories"""
     name_uz = models.CharField(max_length=200)
@@ -29,9 +107,13 @@ class Category(models.Model):
     parent = models.ForeignKey('self', on_delete=models.CASCADE, blank=True, null=True, related_name='children')
     image = models.ImageField(upload_to='categories/', blank=True, null=True)
     is_active = models.BooleanField(default=True)
+    path = models.CharField(max_length=255, db_index=True, editable=False, default='')
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = CategoryQuerySet.as_manager()
+
     class Meta:
         verbose_name = _("Kategoriya")
         verbose_name_plural = _("Kategoriyalar")
@@ -43,6 +125,92 @@ class Category(models.Model):
         """Get name based on language"""
         return getattr(self, f'name_{language}')
 
+    @property
+    def path_ids(self):
+        """Ids of ancestors and self, root first"""
+        return [int(part) for part in self.path.split('/') if part]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_parent_id = instance.__dict__.get('parent_id')
+        return instance
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        parent_unchanged = self.path and self.parent_id == getattr(self, '_loaded_parent_id', None)
+        if parent_unchanged or (update_fields is not None and 'parent' not in update_fields):
+            return super().save(*args, **kwargs)
+
+        old_path, old_depth = self.path, self.depth
+        parent_path = ''
+        if self.parent_id:
+            parent_path = Category.objects.filter(pk=self.parent_id).values_list('path', flat=True).get()
+            if old_path and parent_path.startswith(old_path):
+                raise ValueError("Category cannot be moved into its own subtree")
+
+        if self.pk is None:
+            # Path needs the id, so it is written right after the INSERT
+            super().save(*args, **kwargs)
+            self.path = parent_path + path_segment(self.pk)
+            self.depth = self.path.count('/') - 1
+            Category.objects.filter(pk=self.pk).update(path=self.path, depth=self.depth)
+            self._loaded_parent_id = self.parent_id
+            return
+
+        self.path = parent_path + path_segment(self.pk)
+        self.depth = self.path.count('/') - 1
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'path', 'depth'}
+        super().save(*args, **kwargs)
+        self._loaded_parent_id = self.parent_id
+
+        if old_path and old_path != self.path:
+            # Move the whole subtree with one UPDATE
+            Category.objects.filter(path__startswith=old_path).exclude(pk=self.pk).update(
+                path=Concat(Value(self.path), Substr('path', len(old_path) + 1)),
+                depth=F('depth') + (self.depth - old_depth),
+            )
+
+
+class ProductQuerySet(models.QuerySet):
+    def in_category_tree(self, category):
+        """Products of category or any of its descendants, without recursion"""
+        return self.filter(categories__path__startswith=category.path).distinct()
+
+    def update_search_vectors(self):
+        """
+        Recompute search_vector from search_name/search_text with one UPDATE.
+        Full-text columns exist only on PostgreSQL, elsewhere this is a no-op.
+        """
+        if connections[self.db].vendor != 'postgresql':
+            return 0
+        return self.update(search_vector=(
+            SearchVector('search_name', weight='A', config='simple')
+            + SearchVector('search_text', weight='B', config='simple')
+        ))
+
+    def rebuild_search_index(self, batch_size=1000):
+        """
+        Recompute search keys of products (e.g. after bulk_create/update that
+        bypass save()). Returns number of processed products.
+        """
+        manager = self.model.objects.db_manager(self.db)
+        rows = self.order_by().values_list('id', *self.model.SEARCH_NAME_FIELDS, *self.model.SEARCH_TEXT_FIELDS)
+        name_count = len(self.model.SEARCH_NAME_FIELDS)
+        batch, total = [], 0
+        for pk, *texts in rows.iterator(chunk_size=batch_size):
+            batch.append(self.model(
+                id=pk, search_name=search_key(*texts[:name_count]), search_text=search_key(*texts[name_count:])
+            ))
+            if len(batch) == batch_size:
+                total += manager.bulk_update(batch, ['search_name', 'search_text'])
+                batch = []
+        if batch:
+            total += manager.bulk_update(batch, ['search_name', 'search_text'])
+        self.update_search_vectors()
+        return total
+
 
 class Product(models.Model):
     """Product model"""
@@ -56,6 +224,16 @@ class Product(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # Qidiruv kalitlari (store.translit.search_key): lotin yozuvida, ikkala tilda
+    search_name = models.TextField(default='', editable=False)
+    search_text = models.TextField(default='', editable=False)
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    SEARCH_NAME_FIELDS = ('name_uz', 'name_ru')
+    SEARCH_TEXT_FIELDS = ('description_uz', 'description_ru')
+
+    objects = ProductQuerySet.as_manager()
+
     class Meta:
         verbose_name = _("Mahsulot")
         verbose_name_plural = _("Mahsulotlar")
@@ -63,6 +241,19 @@ class Product(models.Model):
     def __str__(self):
         return self.name_uz
 
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        searchable = {*self.SEARCH_NAME_FIELDS, *self.SEARCH_TEXT_FIELDS}
+        if update_fields is not None and not searchable.intersection(update_fields):
+            return super().save(*args, **kwargs)
+
+        self.search_name = search_key(*(getattr(self, field) for field in self.SEARCH_NAME_FIELDS))
+        self.search_text = search_key(*(getattr(self, field) for field in self.SEARCH_TEXT_FIELDS))
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'search_name', 'search_text'}
+        super().save(*args, **kwargs)
+        Product.objects.using(self._state.db).filter(pk=self.pk).update_search_vectors()
+
     def get_name(self, language):
         """Get name based on language"""
         return getattr(self, f'name_{language}')
@@ -109,6 +300,74 @@ class ColorImage(models.Model):
         return f"{self.color} - {self.id}"
 
 
+class CatalogVersion(models.Model):
+    """
+    Catalog change counter (single row).
+
+    Kategoriya, mahsulot, rang yoki rasm o'zgarganda signal orqali
+    oshiriladi; bot xotiradagi katalogni shu raqam o'zgarganda qayta quradi.
+    """
+    version = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = _("Katalog versiyasi")
+        verbose_name_plural = _("Katalog versiyalari")
+
+    def __str__(self):
+        return f"v{self.version}"
+
+    @classmethod
+    def current(cls, using=None):
+        return cls.objects.using(using).filter(pk=1).values_list('version', flat=True).first() or 0
+
+    @classmethod
+    def bump(cls, using=None):
+        """Increase version in one UPDATE (same transaction as the catalog change)"""
+        updated = cls.objects.using(using).filter(pk=1).update(version=F('version') + 1, updated_at=now())
+        if not updated:
+            cls.objects.using(using).get_or_create(pk=1, defaults={'version': 1})
+
+
+class ImageMetadata(models.Model):
+    """Precomputed image checks (size, format, dimensions, content hash)"""
+    path = models.CharField(max_length=255, unique=True)  # MEDIA_ROOT ga nisbatan
+    size = models.PositiveIntegerField()
+    mtime = models.FloatField()
+    width = models.PositiveIntegerField(blank=True, null=True)
+    height = models.PositiveIntegerField(blank=True, null=True)
+    format = models.CharField(max_length=10, blank=True)
+    content_hash = models.CharField(max_length=64, blank=True)  # sha256
+    is_valid = models.BooleanField(default=False)  # Telegram uchun yaroqli
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = _("Rasm ma'lumoti")
+        verbose_name_plural = _("Rasm ma'lumotlari")
+
+    def __str__(self):
+        return self.path
+
+
+class TelegramFile(models.Model):
+    """Telegram file_id of an already uploaded image (path + content hash)"""
+    path = models.CharField(max_length=255)  # MEDIA_ROOT ga nisbatan
+    content_hash = models.CharField(max_length=64)  # sha256
+    file_id = models.CharField(max_length=255)
+    file_unique_id = models.CharField(max_length=100, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = _("Telegram fayli")
+        verbose_name_plural = _("Telegram fayllari")
+        constraints = [
+            models.UniqueConstraint(fields=['path', 'content_hash'], name='unique_telegram_file'),
+        ]
+
+    def __str__(self):
+        return f"{self.path} ({self.content_hash[:8]})"
+
+
 class Cart(models.Model):
     """Cart model"""
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='carts')
@@ -123,9 +382,128 @@ class Cart(models.Model):
     def __str__(self):
         return f"Savatcha #{self.id} - {self.user}"
 
+    @cached_property
+    def summary(self):
+        """
+        Items, count and total of the cart (CartSummary).
+        Uses prefetched items if they were loaded with CartItem.objects.with_totals().
+        """
+        prefetched = getattr(self, '_prefetched_objects_cache', {}).get('items')
+        if prefetched is not None:
+            items = list(prefetched)
+            if not items or hasattr(items[0], 'cart_total'):
+                return CartSummary.from_items(items)
+        return CartSummary.from_items(list(self.items.with_totals()))
+
     def get_total_price(self):
         """Calculate total price of cart items"""
-        return sum(item.get_price() for item in self.items.all())
+        if 'summary' in self.__dict__:
+            return self.summary.total
+        return self.items.totals()['total']
+
+
+def money_field():
+    return DecimalField(max_digits=12, decimal_places=2)
+
+
+def line_total():
+    """quantity * color price, computed in SQL"""
+    return ExpressionWrapper(F('quantity') * F('color__price'), output_field=money_field())
+
+
+class CartItemQuerySet(models.QuerySet):
+    def with_totals(self):
+        """
+        Items with color and product, their line_total and, on every row,
+        cart_total / cart_count of the whole cart (window aggregates),
+        so the cart view is a single query.
+        """
+        partition = {'partition_by': [F('cart_id')]}
+        return (
+            self.select_related('color__product')
+            .annotate(
+                line_total=line_total(),
+                cart_total=Window(Sum(line_total()), output_field=money_field(), **partition),
+                cart_count=Window(Count('id'), **partition),
+            )
+            .order_by('id')
+        )
+
+    def totals(self):
+        """{'total': ..., 'count': ...} of items, aggregated in SQL"""
+        result = self.aggregate(total=Sum(line_total(), output_field=money_field()), count=Count('id'))
+        return {'total': result['total'] or Decimal('0'), 'count': result['count']}
+
+    # Django'ning update() yangi qiymatni qaytarmaydi, shuning uchun quyidagi
+    # ikki metod RETURNING bilan bitta SQL so'rov yuboradi
+
+    def _columns(self):
+        meta, quote = self.model._meta, connections[self.db].ops.quote_name
+        return (
+            quote(meta.db_table),
+            quote(meta.pk.column),
+            quote(meta.get_field('cart').column),
+            quote(meta.get_field('color').column),
+            quote(meta.get_field('quantity').column),
+        )
+
+    def add(self, cart, color, quantity=1):
+        """
+        Add color to cart or increase its quantity, as one upsert on the
+        (cart, color) unique constraint. Returns CartItem with new quantity.
+        """
+        table, pk, cart_id, color_id, qty = self._columns()
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {table} ({cart_id}, {color_id}, {qty}) VALUES (%s, %s, %s) "
+                f"ON CONFLICT ({cart_id}, {color_id}) DO UPDATE SET {qty} = {table}.{qty} + EXCLUDED.{qty} "
+                f"RETURNING {pk}, {qty}",
+                [cart.pk, color.pk, quantity],
+            )
+            item_id, new_quantity = cursor.fetchone()
+        return self.model(pk=item_id, cart=cart, color=color, quantity=new_quantity)
+
+    def change_quantity(self, item_id, delta, minimum=1, clamp=False):
+        """
+        quantity = quantity + delta in one UPDATE, applied only if the result
+        stays >= minimum (with clamp=True the result is raised to minimum
+        instead, unless quantity already is minimum).
+        Returns (quantity, color_id) or None if nothing changed.
+        """
+        table, pk, cart_id, color_id, qty = self._columns()
+        if clamp:
+            value = f"CASE WHEN {qty} + %s < %s THEN %s ELSE {qty} + %s END"
+            guard = f"({qty} + %s >= %s OR {qty} > %s)"
+            params = [delta, minimum, minimum, delta, item_id, delta, minimum, minimum]
+        else:
+            value = f"{qty} + %s"
+            guard = f"{qty} + %s >= %s"
+            params = [delta, item_id, delta, minimum]
+
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {table} SET {qty} = {value} "
+                f"WHERE {pk} = %s AND {guard} "
+                f"RETURNING {qty}, {color_id}",
+                params,
+            )
+            return cursor.fetchone()
+
+
+class CartSummary:
+    """Cart read model: items (annotated with line_total), count and total"""
+    __slots__ = ('items', 'count', 'total')
+
+    def __init__(self, items, count, total):
+        self.items = items
+        self.count = count
+        self.total = total
+
+    @classmethod
+    def from_items(cls, items):
+        if not items:
+            return cls([], 0, Decimal('0'))
+        return cls(items, items[0].cart_count, items[0].cart_total)
 
 
 class CartItem(models.Model):
@@ -134,15 +512,22 @@ class CartItem(models.Model):
     color = models.ForeignKey(Color, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
 
+    objects = CartItemQuerySet.as_manager()
+
     class Meta:
         verbose_name = _("Savatcha elementi")
         verbose_name_plural = _("Savatcha elementlari")
+        constraints = [
+            models.UniqueConstraint(fields=['cart', 'color'], name='unique_cart_color'),
+        ]
 
     def __str__(self):
         return f"{self.color.product.name_uz} ({self.color.name_uz}) x {self.quantity}"
 
     def get_price(self):
         """Calculate price of cart item"""
+        if hasattr(self, 'line_total'):
+            return self.line_total
         return self.color.price * self.quantity
 
 
@@ -160,12 +545,16 @@ class Order(models.Model):
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='new')
     address = models.TextField()
     total_price = models.DecimalField(max_digits=12, decimal_places=2)
+    checkout_key = models.CharField(max_length=64, null=True, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         verbose_name = _("Buyurtma")
         verbose_name_plural = _("Buyurtmalar")
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'checkout_key'], name='unique_user_checkout_key'),
+        ]
 
     def __str__(self):
         return f"Buyurtma #{self.id} - {self.user.first_name}"
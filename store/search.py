@@ -0,0 +1,84 @@
+"""
+Ranked product search
+
+PostgreSQL da ikki indeks ishlatiladi:
+  * search_vector bo'yicha GIN (to'liq matnli qidiruv, nom A, tavsif B og'irlikda)
+  * search_name bo'yicha pg_trgm GIN (xato yozilgan so'zlar uchun)
+
+So'rov va mahsulot nomlari store.translit.fold bilan bitta lotin
+ko'rinishiga keltiriladi, shuning uchun lotin/kirill farqi yo'q.
+Boshqa bazalarda (testlar uchun SQLite) oddiy icontains ishlatiladi.
+"""
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramWordSimilarity
+from django.db import connections
+from django.db.models import Case, F, FloatField, Q, Value, When
+
+from .models import Product
+from .translit import fold
+
+RESULT_FIELDS = ('id', 'name_uz', 'name_ru', 'main_image')
+
+SEARCH_INDEXES = (
+    'CREATE INDEX IF NOT EXISTS store_product_search_vector_gin '
+    'ON store_product USING gin (search_vector)',
+    'CREATE INDEX IF NOT EXISTS store_product_search_name_trgm '
+    'ON store_product USING gin (search_name gin_trgm_ops)',
+)
+
+
+def ensure_search_extensions(using='default'):
+    """pg_trgm extension (needed before trigram indexes and lookups)"""
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+
+
+def ensure_search_indexes(using='default'):
+    """GIN indexes of product search (migrations are generated, so they are created here)"""
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            for statement in SEARCH_INDEXES:
+                cursor.execute(statement)
+
+
+def prefix_query(words):
+    """to_tsquery text matching every word as a prefix: 'ko & soat' -> 'ko:* & soat:*'"""
+    return ' & '.join(f'{word}:*' for word in words)
+
+
+def search_products(query, limit=20, queryset=None):
+    """
+    Active products matching query, best match first.
+    Returns a list of products annotated with `rank`.
+    """
+    key = fold(query)
+    if not key:
+        return []
+
+    if queryset is None:
+        queryset = Product.objects.filter(is_active=True).only(*RESULT_FIELDS)
+    if connections[queryset.db].vendor != 'postgresql':
+        return list(_search_fallback(queryset, key.split(), limit))
+
+    ts_query = SearchQuery(prefix_query(key.split()), config='simple', search_type='raw')
+    return list(
+        queryset
+        # @@ va %> operatorlari ikkala GIN indeksdan BitmapOr bilan foydalanadi
+        .filter(Q(search_vector=ts_query) | Q(search_name__trigram_word_similar=key))
+        .annotate(rank=SearchRank(F('search_vector'), ts_query) + TrigramWordSimilarity(key, 'search_name'))
+        .order_by('-rank', 'id')[:limit]
+    )
+
+
+def _search_fallback(queryset, words, limit):
+    in_name, anywhere = Q(), Q()
+    for word in words:
+        in_name &= Q(search_name__icontains=word)
+        anywhere &= Q(search_name__icontains=word) | Q(search_text__icontains=word)
+    return (
+        queryset.filter(anywhere)
+        .annotate(rank=Case(When(in_name, then=Value(1.0)), default=Value(0.5), output_field=FloatField()))
+        .order_by('-rank', 'id')[:limit]
+    )
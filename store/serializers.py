@@ -33,9 +33,17 @@ class CategorySerializer(serializers.ModelSerializer):
 
     @extend_schema_field(serializers.ListSerializer(child=serializers.DictField()))
     def get_children(self, obj):
-        if obj.children.exists():
-            return CategorySerializer(obj.children.filter(is_active=True), many=True).data
-        return []
+        return CategorySerializer(self._children_map().get(obj.pk, []), many=True, context=self.context).data
+
+    def _children_map(self):
+        """
+        parent_id -> active children. Whole tree is loaded with one query
+        per response and kept in the (shared) serializer context.
+        """
+        children = self.context.get('category_children')
+        if children is None:
+            children = self.context['category_children'] = Category.objects.filter(is_active=True).children_map()
+        return children
 
 
 class ProductSerializer(serializers.ModelSerializer):
@@ -48,6 +56,15 @@ class ProductSerializer(serializers.ModelSerializer):
                   'categories', 'colors', 'main_image', 'is_active']
 
 
+class ProductSearchSerializer(serializers.ModelSerializer):
+    """Compact search result (no nested categories/colors, so no extra queries)"""
+    rank = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = Product
+        fields = ['id', 'name_uz', 'name_ru', 'main_image', 'rank']
+
+
 class CartItemSerializer(serializers.ModelSerializer):
     color = ColorSerializer(read_only=True)
     product = serializers.SerializerMethodField()
@@ -75,7 +92,8 @@ class CartItemSerializer(serializers.ModelSerializer):
 
 
 class CartSerializer(serializers.ModelSerializer):
-    items = CartItemSerializer(many=True, read_only=True)
+    # Hammasi Cart.summary dan: bitta so'rov (yoki prefetch)
+    items = CartItemSerializer(source='summary.items', many=True, read_only=True)
     total_price = serializers.SerializerMethodField()
     items_count = serializers.SerializerMethodField()
 
@@ -87,12 +105,12 @@ class CartSerializer(serializers.ModelSerializer):
     @extend_schema_field(serializers.DecimalField(max_digits=12, decimal_places=2))
     def get_total_price(self, obj):
         """Calculate total price of all items in cart"""
-        return obj.get_total_price()
+        return obj.summary.total
 
     @extend_schema_field(serializers.IntegerField())
     def get_items_count(self, obj):
         """Get total number of items in cart"""
-        return obj.items.count()
+        return obj.summary.count
 
 
 class OrderItemSerializer(serializers.ModelSerializer):
@@ -125,4 +143,6 @@ class UpdateCartItemSerializer(serializers.Serializer):
 
 class CreateOrderSerializer(serializers.Serializer):
     """Serializer for creating order"""
+    user = serializers.PrimaryKeyRelatedField(queryset=User.objects.all())
     address = serializers.CharField(max_length=500)
+    checkout_key = serializers.CharField(max_length=64, required=False, allow_blank=True)
@@ -0,0 +1,102 @@
+"""
+Store business operations shared by the bot and the REST API
+"""
+from django.db import IntegrityError, connections, transaction
+
+from store.models import Cart, CartItem, CartSummary, Order, OrderItem
+
+
+def _existing_order(user, checkout_key):
+    # Kalit faqat shu foydalanuvchi buyurtmalari orasida qidiriladi
+    if not checkout_key:
+        return None
+    return Order.objects.filter(user=user, checkout_key=checkout_key).first()
+
+
+def checkout(user, address, checkout_key=None):
+    """
+    Create order from user's active cart and deactivate the cart.
+
+    Hammasi bitta tranzaksiyada: savatcha qatori bloklanadi, elementlar va
+    jami summa bitta so'rovda olinadi, OrderItem lar bulk_create bilan
+    yoziladi va savatcha bitta UPDATE bilan yopiladi.
+
+    checkout_key berilsa, foydalanuvchining shu kalit bilan yaratilgan
+    buyurtmasi qaytariladi (ikki marta "Tasdiqlash" bosilsa ikkinchi buyurtma yaratilmaydi).
+
+    Returns (order, created). Raises Cart.DoesNotExist if there is no
+    active cart or it is empty.
+    """
+    order = _existing_order(user, checkout_key)
+    if order is not None:
+        return order, False
+
+    try:
+        with transaction.atomic():
+            try:
+                cart = Cart.objects.select_for_update().get(user=user, is_active=True)
+            except Cart.DoesNotExist:
+                # Parallel so'rov savatchani shu kalit bilan yopgan bo'lishi mumkin
+                order = _existing_order(user, checkout_key)
+                if order is not None:
+                    return order, False
+                raise
+
+            summary = CartSummary.from_items(list(CartItem.objects.filter(cart=cart).with_totals()))
+            if not summary.items:
+                raise Cart.DoesNotExist("Cart is empty")
+
+            order = Order.objects.create(
+                user=user,
+                address=address,
+                total_price=summary.total,
+                checkout_key=checkout_key or None,
+            )
+            OrderItem.objects.bulk_create([
+                OrderItem(
+                    order=order,
+                    product_name=item.color.product.name_uz,  # Store current names
+                    color_name=item.color.name_uz,
+                    price=item.color.price,
+                    quantity=item.quantity,
+                )
+                for item in summary.items
+            ])
+            Cart.objects.filter(pk=cart.pk).update(is_active=False)
+    except IntegrityError:
+        order = _existing_order(user, checkout_key)
+        if order is None:
+            raise
+        return order, False
+
+    return order, True
+
+
+def merge_duplicate_cart_items(using='default'):
+    """
+    Merge cart rows of the same color into one (quantities summed), so the
+    unique (cart, color) constraint can be added to existing data.
+
+    Migratsiyalar generatsiya qilinadi, shuning uchun bu pre_migrate da
+    ishlaydi; jadval hali yo'q yoki constraint allaqachon bor bo'lsa hech
+    narsa qilmaydi. Faqat eski ustunlar (id, cart_id, color_id, quantity)
+    ishlatiladi.
+    """
+    connection = connections[using]
+    table = CartItem._meta.db_table
+    with connection.cursor() as cursor:
+        if table not in connection.introspection.table_names(cursor):
+            return
+        if 'unique_cart_color' in connection.introspection.get_constraints(cursor, table):
+            return
+
+    quoted = connection.ops.quote_name(table)
+    keep = f'SELECT MIN(id) FROM {quoted} GROUP BY cart_id, color_id'
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        cursor.execute(
+            f'UPDATE {quoted} SET quantity = ('
+            f'SELECT SUM(d.quantity) FROM {quoted} d '
+            f'WHERE d.cart_id = {quoted}.cart_id AND d.color_id = {quoted}.color_id'
+            f') WHERE id IN ({keep} HAVING COUNT(*) > 1)'
+        )
+        cursor.execute(f'DELETE FROM {quoted} WHERE id NOT IN ({keep})')
@@ -0,0 +1,71 @@
+from django.db.models.signals import m2m_changed, post_delete, post_migrate, post_save, pre_migrate
+from django.dispatch import receiver
+
+from .images import refresh_image_metadata
+from .models import CatalogVersion, Category, Product, Color, ColorImage
+from .search import ensure_search_extensions, ensure_search_indexes
+from .services import merge_duplicate_cart_items
+
+CATALOG_MODELS = (Category, Product, Color, ColorImage)
+
+
+@receiver(post_save, sender=Category)
+def category_image_saved(sender, instance, **kwargs):
+    if instance.image:
+        refresh_image_metadata(instance.image)
+
+
+@receiver(post_save, sender=Product)
+def product_image_saved(sender, instance, **kwargs):
+    if instance.main_image:
+        refresh_image_metadata(instance.main_image)
+
+
+@receiver(post_save, sender=ColorImage)
+def color_image_saved(sender, instance, **kwargs):
+    if instance.image:
+        refresh_image_metadata(instance.image)
+
+
+@receiver(post_migrate)
+def category_paths_migrated(sender, app_config=None, using='default', **kwargs):
+    # Yangi path/depth ustunlari mavjud kategoriyalar uchun to'ldiriladi
+    if app_config is not None and app_config.name == 'store':
+        Category.objects.using(using).rebuild_paths()
+
+
+@receiver(pre_migrate)
+def search_extensions_migrating(sender, app_config=None, using='default', **kwargs):
+    if app_config is not None and app_config.name == 'store':
+        ensure_search_extensions(using)
+
+
+@receiver(pre_migrate)
+def cart_items_migrating(sender, app_config=None, using='default', **kwargs):
+    # unique_cart_color qo'shilishidan oldin takrorlangan qatorlar birlashtiriladi
+    if app_config is not None and app_config.name == 'store':
+        merge_duplicate_cart_items(using)
+
+
+@receiver(post_migrate)
+def search_index_migrated(sender, app_config=None, using='default', **kwargs):
+    # Qidiruv indekslari va mavjud mahsulotlarning qidiruv kalitlari
+    if app_config is not None and app_config.name == 'store':
+        ensure_search_indexes(using)
+        Product.objects.using(using).filter(search_name='').rebuild_search_index()
+
+
+def catalog_changed(sender, using='default', **kwargs):
+    # Botdagi katalog snapshot i keyingi tekshiruvda qayta quriladi
+    CatalogVersion.bump(using)
+
+
+for model in CATALOG_MODELS:
+    post_save.connect(catalog_changed, sender=model, dispatch_uid=f'catalog_saved_{model.__name__}')
+    post_delete.connect(catalog_changed, sender=model, dispatch_uid=f'catalog_deleted_{model.__name__}')
+
+
+@receiver(m2m_changed, sender=Product.categories.through)
+def product_categories_changed(sender, action, using='default', **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        CatalogVersion.bump(using)
@@ -0,0 +1,50 @@
+"""
+Uzbek/Russian Latin <-> Cyrillic folding for product search
+
+Mahsulot nomlari va qidiruv so'rovi bitta ko'rinishga keltiriladi:
+kirill harflari o'zbek lotin yozuviga o'giriladi, apostroflar (o', g')
+va tinish belgilari olib tashlanadi. Natijada "Ko'ylak", "Кўйлак" va
+"koylak" bir xil kalitga aylanadi va qaysi yozuvda qidirilsa ham topiladi.
+"""
+import re
+
+CYRILLIC_TO_LATIN = {
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'yo',
+    'ж': 'j', 'з': 'z', 'и': 'i', 'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm',
+    'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't', 'у': 'u',
+    'ф': 'f', 'х': 'x', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'sh', 'ъ': '',
+    'ы': 'i', 'ь': '', 'э': 'e', 'ю': 'yu', 'я': 'ya',
+    # O'zbek kirill harflari
+    'ў': 'o', 'қ': 'q', 'ғ': 'g', 'ҳ': 'h',
+}
+
+_CYRILLIC_TABLE = str.maketrans(CYRILLIC_TO_LATIN)
+_APOSTROPHES = re.compile(r"['`ʻʼ‘’]")
+_NON_WORD = re.compile(r'[^a-z0-9]+')
+
+
+def to_latin(text):
+    """Cyrillic letters of text in Uzbek Latin spelling, lower case"""
+    return text.lower().translate(_CYRILLIC_TABLE)
+
+
+def fold(text):
+    """
+    Search key of text: Latin, lower case, without apostrophes and punctuation.
+    "Qo'l soati" / "Қўл соати" -> "qol soati"
+    """
+    if not text:
+        return ''
+    text = _APOSTROPHES.sub('', to_latin(text))
+    # Rus lotin transliteratsiyasi (Khurshid) o'zbekcha x ga tenglashtiriladi
+    text = text.replace('kh', 'x')
+    return _NON_WORD.sub(' ', text).strip()
+
+
+def search_key(*texts):
+    """Folded texts joined into one search key, duplicate words removed"""
+    words = {}
+    for text in texts:
+        for word in fold(text).split():
+            words.setdefault(word, None)
+    return ' '.join(words)
@@ -0,0 +1,7 @@
+import os
+
+import django
+
+# Bot tests run under plain pytest (Django TestCase modules use manage.py test)
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+django.setup()
@@ -1,10 +1,18 @@
 import json
+import os
+import tempfile
+import threading
+import time
 from decimal import Decimal
+from unittest.mock import patch
+from django.db import connection
 from django.urls import reverse
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from rest_framework import status
 from rest_framework.test import APIClient
-from store.models import User, Category, Product, Color, Cart, CartItem, Order, OrderItem
+from core.metrics import Registry, registry, render
+from store.models import User, Category, Product, Color, ColorImage, Cart, CartItem, Order, OrderItem
 
 
 class TestUserAPI(TestCase):
@@ -177,6 +185,48 @@ class TestProductAPI(TestCase):
         self.assertEqual(response.data['name_uz'], self.product1.name_uz)
         self.assertEqual(len(response.data['colors']), 2)
 
+    def test_search_products(self):
+        """Test ranked product search endpoint"""
+        url = reverse('product-search')
+        response = self.client.get(url, {'q': 'самсунг'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 1)
+        self.assertEqual(response.data['results'][0]['id'], self.product2.id)
+
+        response = self.client.get(url, {'q': 'telefon', 'limit': 100})
+        self.assertEqual([item['id'] for item in response.data['results']], [self.product1.id])
+
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(url, {'q': 'a', 'limit': 'x'}).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_catalog_query_count_is_constant(self):
+        """Product and category lists do not depend on page size or tree depth"""
+        def count_queries(url):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return len(queries)
+
+        product_list, category_list = reverse('product-list'), reverse('category-list')
+        products_before, categories_before = count_queries(product_list), count_queries(category_list)
+
+        # Deeper tree, more products, colors and images
+        parent = self.category
+        for depth in range(4):
+            parent = Category.objects.create(name_uz=f"Kategoriya {depth}", name_ru=f"Категория {depth}", parent=parent)
+        for index in range(15):
+            product = Product.objects.create(name_uz=f"Mahsulot {index}", name_ru=f"Товар {index}")
+            product.categories.add(self.category, parent)
+            color = Color.objects.create(product=product, name_uz="Qora", name_ru="Черный", price=Decimal('1000.00'))
+            ColorImage.objects.create(color=color, image=f"colors/{index}.jpg", order=1)
+
+        response = self.client.get(product_list)
+        self.assertEqual(len(response.data['results']), 17)
+        self.assertEqual(len(response.data['results'][0]['categories'][0]['children']), 1)
+        self.assertEqual(count_queries(product_list), products_before)
+        self.assertEqual(count_queries(category_list), categories_before)
+
 
 class TestCartAPI(TestCase):
     """Test Cart API"""
@@ -244,6 +294,41 @@ class TestCartAPI(TestCase):
         self.assertEqual(len(response.data['items']), 1)
         self.assertEqual(response.data['total_price'], '2400000.00')
 
+    def test_checkout(self):
+        """Test checkout creates order once per idempotency key"""
+        url = reverse('order-checkout')
+        data = {'user': self.user.id, 'address': "Test Address, 123"}
+
+        response = self.client.post(url, data, HTTP_IDEMPOTENCY_KEY='key-1')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.data['items']), 1)
+        self.assertEqual(Decimal(response.data['total_price']), Decimal('2400000.00'))
+
+        response = self.client.post(url, data, HTTP_IDEMPOTENCY_KEY='key-1')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Order.objects.count(), 1)
+
+        response = self.client.post(url, data, HTTP_IDEMPOTENCY_KEY='key-2')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_checkout_key_is_per_user(self):
+        """Test same idempotency key of another user creates that user's own order"""
+        url = reverse('order-checkout')
+        other = User.objects.create(telegram_id=987654321, first_name="Other User")
+        other_cart = Cart.objects.create(user=other, is_active=True)
+        CartItem.objects.create(cart=other_cart, color=self.color, quantity=1)
+
+        response = self.client.post(url, {'user': self.user.id, 'address': "A"}, HTTP_IDEMPOTENCY_KEY='same')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        first_id = response.data['id']
+
+        response = self.client.post(url, {'user': other.id, 'address': "B"}, HTTP_IDEMPOTENCY_KEY='same')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertNotEqual(response.data['id'], first_id)
+        self.assertEqual(response.data['user']['id'], other.id)
+        self.assertEqual(Decimal(response.data['total_price']), Decimal('1200000.00'))
+        self.assertEqual(Order.objects.filter(checkout_key='same').count(), 2)
+
 
 class TestOrderAPI(TestCase):
     """Test Order API"""
@@ -312,4 +397,134 @@ class TestOrderAPI(TestCase):
 
         # Refresh from DB
         self.order.refresh_from_db()
-        self.assertEqual(self.order.status, 'processing')
\ No newline at end of file
+        self.assertEqual(self.order.status, 'processing')
+
+class TestMetricsAPI(TestCase):
+    """Test Prometheus /metrics endpoint"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        patcher = patch.object(registry, 'directory', self.directory.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_requests_are_counted_per_viewset_action(self):
+        """Request count, latency histogram and queries are labelled with the viewset action"""
+        Category.objects.create(name_uz="Kiyim", name_ru="Одежда")
+        self.client.get(reverse('category-list'))
+
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+
+        body = response.content.decode()
+        self.assertIn('http_requests_total{method="GET",status="200",view="CategoryViewSet.list"}', body)
+        self.assertIn('http_request_duration_seconds_bucket{view="CategoryViewSet.list",le="+Inf"}', body)
+        self.assertIn('http_db_queries_total{view="CategoryViewSet.list"}', body)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_token_is_required_when_configured(self):
+        url = reverse('metrics')
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_401_UNAUTHORIZED)
+        response = self.client.get(url, HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_process_snapshots_are_merged(self):
+        """Counters and histograms of all processes are summed"""
+        first, second = Registry(self.directory.name), Registry(self.directory.name)
+        first.inc('http_requests_total', view='ProductViewSet.list', method='GET', status=200)
+        second.inc('http_requests_total', 2, view='ProductViewSet.list', method='GET', status=200)
+        first.observe('http_request_duration_seconds', 0.02, view='ProductViewSet.list')
+        second.observe('http_request_duration_seconds', 3, view='ProductViewSet.list')
+        second.set_gauge('bot_outbound_queue_depth', 4)
+
+        # Bitta pid da bo'lsa ham har bir registry o'z fayliga yozadi
+        first.flush(force=True)
+        second.flush(force=True)
+        self.assertNotEqual(first.path, second.path)
+
+        body = render(*first.collect())
+        self.assertIn('http_requests_total{method="GET",status="200",view="ProductViewSet.list"} 3', body)
+        self.assertIn('http_request_duration_seconds_bucket{view="ProductViewSet.list",le="0.025"} 1', body)
+        self.assertIn('http_request_duration_seconds_bucket{view="ProductViewSet.list",le="5"} 2', body)
+        self.assertIn('http_request_duration_seconds_count{view="ProductViewSet.list"} 2', body)
+        self.assertIn('# TYPE bot_outbound_queue_depth gauge\nbot_outbound_queue_depth 4', body)
+
+    def test_same_pid_in_another_container_keeps_own_file(self):
+        """Processes with equal pids on different hosts do not overwrite each other"""
+        web, bot = Registry(self.directory.name), Registry(self.directory.name)
+        web.inc('http_requests_total', view='ProductViewSet.list', method='GET', status=200)
+        bot.inc('bot_updates_total', 5, handler='start.cmd_start')
+
+        with patch('core.metrics.os.getpid', return_value=1):
+            with patch('core.metrics.socket.gethostname', return_value='web'):
+                web.flush(force=True)
+            with patch('core.metrics.socket.gethostname', return_value='bot'):
+                bot.flush(force=True)
+
+        counters = bot.collect()[0]
+        self.assertEqual(counters[('bot_updates_total', (('handler', 'start.cmd_start'),))], 5)
+        self.assertEqual(sum(value for (name, _), value in counters.items() if name == 'http_requests_total'), 1)
+
+    def test_threads_share_registry(self):
+        """Concurrent requests lose no increments and flushes never raise"""
+        shared = Registry(self.directory.name, flush_interval=0)
+
+        def serve(thread):
+            for number in range(200):
+                shared.inc('http_requests_total', view=f'view-{thread}-{number}', method='GET', status=200)
+                shared.inc('http_db_queries_total', view='ProductViewSet.list')
+                if number % 20 == 0:
+                    shared.flush()
+
+        threads = [threading.Thread(target=serve, args=(thread,)) for thread in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        shared.flush(force=True)
+
+        self.assertFalse(shared._flush_failed)
+        counters = shared.collect()[0]
+        self.assertEqual(counters[('http_db_queries_total', (('view', 'ProductViewSet.list'),))], 1600)
+        self.assertEqual(sum(value for (name, _), value in counters.items() if name == 'http_requests_total'), 1600)
+
+    def test_metrics_errors_do_not_fail_requests(self):
+        """A failing flush is logged and the response is still returned"""
+        with patch.object(registry, 'snapshot', side_effect=RuntimeError("dictionary changed size")):
+            with self.assertLogs('core.metrics', 'WARNING'):
+                registry.flush(force=True)
+        with patch.object(registry, 'flush', side_effect=RuntimeError("boom")):
+            with self.assertLogs('core.metrics', 'ERROR'):
+                response = self.client.get(reverse('category-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_old_files_are_compacted_without_losing_counts(self):
+        """Files of exited processes are folded into one; a live process resumes from there"""
+        exited, idle = Registry(self.directory.name, compact_after=60), Registry(self.directory.name)
+        exited.inc('http_requests_total', 2, view='ProductViewSet.list', method='GET', status=200)
+        idle.inc('http_requests_total', 3, view='ProductViewSet.list', method='GET', status=200)
+        idle.observe('http_request_duration_seconds', 0.02, view='ProductViewSet.list')
+        exited.flush(force=True)
+        idle.flush(force=True)
+
+        old = time.time() - 120
+        for entry in os.scandir(self.directory.name):
+            if entry.name.endswith('.json'):
+                os.utime(entry.path, (old, old))
+
+        body = render(*exited.collect())
+        self.assertEqual(
+            sorted(name for name in os.listdir(self.directory.name) if name.endswith('.json')), ['compacted.json']
+        )
+        self.assertIn('http_requests_total{method="GET",status="200",view="ProductViewSet.list"} 5', body)
+
+        # Jarayon tirik edi: keyingi flush faqat compaction dan keyingi o'sishni yozadi
+        idle.inc('http_requests_total', view='ProductViewSet.list', method='GET', status=200)
+        idle.observe('http_request_duration_seconds', 3, view='ProductViewSet.list')
+        idle.flush(force=True)
+        body = render(*exited.collect())
+        self.assertIn('http_requests_total{method="GET",status="200",view="ProductViewSet.list"} 6', body)
+        self.assertIn('http_request_duration_seconds_count{view="ProductViewSet.list"} 2', body)
@@ -1,145 +1,120 @@
+import asyncio
+from types import SimpleNamespace
 from unittest.mock import AsyncMock, patch, MagicMock
 
 import pytest
 from aiogram import types
 from aiogram.fsm.context import FSMContext
-
-from bot.handlers.cart import show_cart, remove_from_cart
-from bot.handlers.categories import show_categories, process_category
-from bot.handlers.products import process_product, process_add_to_cart
-from bot.handlers.start import start_cmd, language_selection, name_input, phone_handler_contact
-from store.models import User, Cart
+from aiogram.fsm.storage.base import StorageKey
+
+from bot.handlers import cart, categories, products, start
+from bot.storage.redis import RedisStorage
+from bot.storage.resp import RespStandIn
+from bot.utils import inline, media
+from bot.utils.catalog import ColorNode, ProductNode
+from bot.utils.coalescer import DeltaCoalescer
+from bot.utils.db import DatabaseExecutor
+from bot.utils.keyboard_cache import KeyboardCache
+from bot.utils.log import BotLogger, NonBlockingQueueHandler, Sampler, StructuredFormatter, parse_sampling
+from bot.utils.metrics import ApiCallCounter, HandlerMetrics, UpdateMetrics, current_update, handler_name
+from bot.middlewares.metrics import HandlerNameMiddleware, MetricsMiddleware
+from bot.utils.user_cache import UserCache
+from bot.utils.callbacks import LANGUAGES, Action, CallbackTable, pack, unpack
+from bot.utils.pagination import AFTER, keyset_page, page_cursor
+from bot.utils.outbound import BROADCAST, OutboundLimiter, send_lane
+from bot.utils.sharding import OrderedFeeder, shard_for, shard_key
+from bot.utils.webhook import DrainingRequestHandler
 
 
 class TestStartHandlers:
     """Test start.py handlers"""
 
     @pytest.mark.asyncio
-    async def test_start_cmd_new_user(self):
-        """Test start command for new user"""
-        # Mock objects
-        message = AsyncMock(spec=types.Message)
+    async def test_start_command_new_user(self):
+        """New user is asked for language"""
+        message = AsyncMock()
         message.from_user.id = 123456789
-        message.chat.id = 123456789
-
         state = AsyncMock(spec=FSMContext)
 
-        # Mock User.objects.get to raise DoesNotExist
-        with patch('store.models.User.objects.get', side_effect=User.DoesNotExist):
-            await start_cmd(message, state)
+        with patch.object(start.user_cache, 'get', AsyncMock(return_value=None)):
+            await start.start_command(message, state)
 
-        # Check behavior
         state.clear.assert_called_once()
         message.answer.assert_called_once()
         args, kwargs = message.answer.call_args
         assert "Tilni tanlang" in args[0]
 
     @pytest.mark.asyncio
-    async def test_start_cmd_existing_user(self):
-        """Test start command for existing user"""
-        # Mock objects
-        message = AsyncMock(spec=types.Message)
+    async def test_start_command_existing_user(self):
+        """Registered user gets the main menu"""
+        message = AsyncMock()
         message.from_user.id = 123456789
-        message.chat.id = 123456789
-
         state = AsyncMock(spec=FSMContext)
+        user = MagicMock(language="uz")
 
-        # Mock user
-        mock_user = MagicMock()
-        mock_user.first_name = "Test User"
-        mock_user.language = "uz"
+        with patch.object(start.user_cache, 'get', AsyncMock(return_value=user)):
+            await start.start_command(message, state)
 
-        # Mock User.objects.get to return user
-        with patch('store.models.User.objects.get', return_value=mock_user):
-            await start_cmd(message, state)
-
-        # Check behavior
-        state.clear.assert_called_once()
+        state.clear.assert_not_called()
         message.answer.assert_called_once()
         args, kwargs = message.answer.call_args
         assert "Xush kelibsiz" in args[0]
 
     @pytest.mark.asyncio
-    async def test_language_selection_valid(self):
-        """Test language selection with valid input"""
-        # Mock objects
-        message = AsyncMock(spec=types.Message)
-        message.text = "🇺🇿 O'zbekcha"
-
-        state = AsyncMock(spec=FSMContext)
-
-        await language_selection(message, state)
-
-        # Check behavior
-        state.update_data.assert_called_once_with(language="uz")
-        message.answer.assert_called_once()
-
-    @pytest.mark.asyncio
-    async def test_language_selection_invalid(self):
-        """Test language selection with invalid input"""
-        # Mock objects
-        message = AsyncMock(spec=types.Message)
-        message.text = "Invalid"
-
+    async def test_process_language(self):
+        """Selected language is stored and contact is requested"""
+        callback = AsyncMock()
         state = AsyncMock(spec=FSMContext)
 
-        await language_selection(message, state)
+        await start.process_language(callback, LANGUAGES.index('ru'), state)
 
-        # Check behavior
-        state.update_data.assert_not_called()
-        message.answer.assert_called_once()
+        state.update_data.assert_called_once_with(language="ru")
+        state.set_state.assert_called_once_with(start.RegistrationStates.waiting_for_contact)
+        callback.answer.assert_called_once()
 
     @pytest.mark.asyncio
-    async def test_name_input_valid(self):
-        """Test name input with valid name"""
-        # Mock objects
-        message = AsyncMock(spec=types.Message)
-        message.text = "John Doe"
-
+    async def test_process_contact_valid(self):
+        """Shared contact is stored and name is requested"""
+        message = AsyncMock()
+        message.contact.phone_number = "+998901234567"
         state = AsyncMock(spec=FSMContext)
         state.get_data.return_value = {"language": "uz"}
 
-        await name_input(message, state)
+        await start.process_contact(message, state)
 
-        # Check behavior
-        state.update_data.assert_called_once_with(first_name="John Doe")
+        state.update_data.assert_called_once_with(phone_number="+998901234567")
+        state.set_state.assert_called_once_with(start.RegistrationStates.waiting_for_name)
         message.answer.assert_called_once()
 
     @pytest.mark.asyncio
-    async def test_name_input_invalid(self):
-        """Test name input with invalid name"""
-        # Mock objects
-        message = AsyncMock(spec=types.Message)
-        message.text = "A"  # Too short
-
+    async def test_process_contact_invalid(self):
+        """Text that is not a phone number is rejected"""
+        message = AsyncMock()
+        message.contact = None
+        message.text = "Invalid"
         state = AsyncMock(spec=FSMContext)
         state.get_data.return_value = {"language": "uz"}
 
-        await name_input(message, state)
+        await start.process_contact(message, state)
 
-        # Check behavior
         state.update_data.assert_not_called()
         message.answer.assert_called_once()
 
     @pytest.mark.asyncio
-    async def test_phone_handler_contact(self):
-        """Test phone handler with contact"""
-        # Mock objects
-        message = AsyncMock(spec=types.Message)
-        message.contact.phone_number = "+998901234567"
-
+    async def test_process_name_registers_user(self):
+        """Name completes registration"""
+        message = AsyncMock()
+        message.text = "John Doe"
+        message.from_user.id = 123456789
         state = AsyncMock(spec=FSMContext)
-        state.get_data.return_value = {
-            "language": "uz",
-            "first_name": "John Doe"
-        }
+        state.get_data.return_value = {"language": "uz", "phone_number": "+998901234567"}
 
-        # Mock User.objects.create
-        with patch('store.models.User.objects.create') as mock_create:
-            await phone_handler_contact(message, state)
+        with patch.object(start.queries, 'register_user', AsyncMock()) as register_user, \
+                patch.object(start.user_cache, 'invalidate') as invalidate:
+            await start.process_name(message, state)
 
-        # Check behavior
-        mock_create.assert_called_once()
+        register_user.assert_awaited_once_with(message.from_user, "John Doe", "uz", "+998901234567")
+        invalidate.assert_called_once_with(123456789)
         state.clear.assert_called_once()
         message.answer.assert_called_once()
 
@@ -149,75 +124,52 @@ class TestCategoryHandlers:
 
     @pytest.mark.asyncio
     async def test_show_categories_with_categories(self):
-        """Test show_categories with existing categories"""
-        # Mock objects
-        message = AsyncMock(spec=types.Message)
-
-        user = MagicMock()
-        user.language = "uz"
+        """Root categories are shown as a page keyboard"""
+        message = AsyncMock()
+        user = MagicMock(language="uz")
+        snapshot = MagicMock()
+        snapshot.root_categories.return_value = [MagicMock(), MagicMock()]
 
-        # Mock categories
-        categories = [MagicMock(), MagicMock()]
+        with patch.object(categories.catalog, 'get', AsyncMock(return_value=snapshot)), \
+                patch.object(categories, 'get_category_page_kb') as get_kb:
+            await categories.show_categories(message, user=user)
 
-        # Mock Category.objects.filter
-        with patch('store.models.Category.objects.filter') as mock_filter:
-            mock_filter.return_value.exists.return_value = True
-            mock_filter.return_value.__iter__.return_value = categories
-
-            await show_categories(message, user)
-
-        # Check behavior
+        get_kb.assert_called_once_with(snapshot, None, "uz")
         message.answer.assert_called_once()
 
     @pytest.mark.asyncio
     async def test_show_categories_no_categories(self):
-        """Test show_categories with no categories"""
-        # Mock objects
-        message = AsyncMock(spec=types.Message)
-
-        user = MagicMock()
-        user.language = "uz"
-
-        # Mock Category.objects.filter
-        with patch('store.models.Category.objects.filter') as mock_filter:
-            mock_filter.return_value.exists.return_value = False
+        """Empty catalog is reported"""
+        message = AsyncMock()
+        user = MagicMock(language="uz")
+        snapshot = MagicMock()
+        snapshot.root_categories.return_value = []
 
-            await show_categories(message, user)
+        with patch.object(categories.catalog, 'get', AsyncMock(return_value=snapshot)):
+            await categories.show_categories(message, user=user)
 
-        # Check behavior
         message.answer.assert_called_once()
         args, kwargs = message.answer.call_args
         assert "mavjud emas" in args[0]
 
     @pytest.mark.asyncio
-    async def test_process_category_with_subcategories(self):
-        """Test process_category with subcategories"""
-        # Mock objects
-        callback = AsyncMock(spec=types.CallbackQuery)
-        callback.data = "category_1"
-
-        user = MagicMock()
-        user.language = "uz"
-
-        # Mock category
+    async def test_show_category_with_subcategories(self):
+        """Category with children shows its subcategories"""
+        callback = AsyncMock()
+        user = MagicMock(language="uz")
         category = MagicMock()
-        category.id = 1
         category.get_name.return_value = "Test Category"
+        snapshot = MagicMock()
+        snapshot.category_listing.return_value = ([category], [MagicMock(), MagicMock()], [])
 
-        # Mock subcategories
-        subcategories = [MagicMock(), MagicMock()]
-
-        # Mock Category.objects.get and subcategories
-        with patch('store.models.Category.objects.get', return_value=category), \
-                patch.object(category.children, 'filter') as mock_filter:
-            mock_filter.return_value.exists.return_value = True
-            mock_filter.return_value.__iter__.return_value = subcategories
-
-            await process_category(callback, user)
+        with patch.object(categories.catalog, 'get', AsyncMock(return_value=snapshot)), \
+                patch.object(categories, 'get_category_page_kb') as get_kb:
+            await categories.show_category_products(callback, 1, user=user)
 
-        # Check behavior
+        get_kb.assert_called_once_with(snapshot, 1, "uz")
         callback.message.edit_text.assert_called_once()
-        callback.answer.assert_called_once()
+        args, kwargs = callback.message.edit_text.call_args
+        assert args[0] == "Test Category"
 
 
 class TestProductHandlers:
@@ -225,50 +177,64 @@ class TestProductHandlers:
 
     @pytest.mark.asyncio
     async def test_process_product(self):
-        """Test process_product handler"""
-        # Mock objects
-        callback = AsyncMock(spec=types.CallbackQuery)
-        callback.data = "product_1"
-
-        user = MagicMock()
-        user.language = "uz"
-
-        # Mock product
-        product = MagicMock()
+        """Product without image is sent as a text message"""
+        callback = AsyncMock()
+        user = MagicMock(language="uz")
+        product = MagicMock(id=1, main_image=None)
         product.get_name.return_value = "Test Product"
         product.get_description.return_value = "Test Description"
-        product.main_image = None
+        snapshot = MagicMock(version=1)
+        snapshot.product_view.return_value = (product, [])
 
-        # Mock Product.objects.get
-        with patch('store.models.Product.objects.get', return_value=product):
-            await process_product(callback, user)
+        with patch.object(products.catalog, 'get', AsyncMock(return_value=snapshot)), \
+                patch.object(products, 'telegram_image_path', AsyncMock(return_value=None)), \
+                patch.object(products.keyboard_cache, 'get'):
+            await products.process_product(callback, 1, 0, user=user)
 
-        # Check behavior
-        callback.message.edit_text.assert_called_once()
+        callback.message.delete.assert_called_once()
+        callback.message.answer.assert_called_once()
+        args, kwargs = callback.message.answer.call_args
+        assert "Test Product" in args[0]
         callback.answer.assert_called_once()
 
     @pytest.mark.asyncio
-    async def test_process_add_to_cart(self):
-        """Test process_add_to_cart handler"""
-        # Mock objects
-        callback = AsyncMock(spec=types.CallbackQuery)
-        callback.data = "add_to_cart_1_1"
-
-        user = MagicMock()
+    async def test_partly_sent_gallery_falls_back_to_text(self):
+        """After a delivered album the main image is not sent again, only the caption"""
+        callback = AsyncMock()
+        user = MagicMock(language="uz")
+        color = MagicMock(id=3, price=100000)
+        snapshot = MagicMock(version=1)
+        snapshot.color_view.return_value = (color, [f'product_colors/{index}.jpg' for index in range(12)])
+
+        async def first_album_only(message, file_paths, messages=None):
+            messages.extend(['album'] * 10)
+            raise RuntimeError("second album failed")
+
+        with patch.object(products.catalog, 'get', AsyncMock(return_value=snapshot)), \
+                patch.object(products, 'telegram_image_path', AsyncMock(side_effect=lambda path: path)), \
+                patch.object(products, 'answer_media_group', first_album_only), \
+                patch.object(products, 'answer_photo', AsyncMock()) as answer_photo, \
+                patch.object(products.keyboard_cache, 'get'):
+            await products.process_color(callback, 3, 1, 0, user=user)
+
+        answer_photo.assert_not_called()
+        callback.message.answer.assert_called_once()
+        assert "100,000" in callback.message.answer.call_args.args[0]
 
-        # Mock color and cart
-        color = MagicMock()
-        cart = MagicMock()
-        cart_item = MagicMock()
+    @pytest.mark.asyncio
+    async def test_process_add_to_cart(self):
+        """Color is added to the active cart"""
+        callback = AsyncMock()
+        user = MagicMock(language="uz")
+        color = MagicMock(price=100000)
+        cart_item = MagicMock(id=5, quantity=1)
 
-        # Mock Color.objects.get and Cart operations
-        with patch('store.models.Color.objects.get', return_value=color), \
-                patch('store.models.Cart.objects.get_or_create', return_value=(cart, True)), \
-                patch('store.models.CartItem.objects.get_or_create', return_value=(cart_item, True)):
-            await process_add_to_cart(callback, user)
+        with patch.object(products.queries, 'add_to_cart', AsyncMock(return_value=(color, cart_item))) as add:
+            await products.process_add_to_cart(callback, 7, user=user)
 
-        # Check behavior
+        add.assert_awaited_once_with(user, 7, 1)
         callback.answer.assert_called_once()
+        callback.message.answer.assert_called_once()
 
 
 class TestCartHandlers:
@@ -276,65 +242,731 @@ class TestCartHandlers:
 
     @pytest.mark.asyncio
     async def test_show_cart_with_items(self):
-        """Test show_cart with items in cart"""
-        # Mock objects
-        message = AsyncMock(spec=types.Message)
+        """Cart items are shown with a cart keyboard"""
+        message = AsyncMock()
+        user = MagicMock(language="uz")
+        items = [{'id': 1}, {'id': 2}]
 
-        user = MagicMock()
-        user.language = "uz"
-
-        # Mock cart and items
-        cart = MagicMock()
-        cart_items = [MagicMock(), MagicMock()]
-        cart.items.all.return_value = cart_items
-
-        # Mock Cart.objects.get
-        with patch('store.models.Cart.objects.get', return_value=cart):
-            await show_cart(message, user)
+        with patch.object(cart.queries, 'get_cart_view', AsyncMock(return_value=(items, 200000))), \
+                patch.object(cart, 'get_cart_kb') as get_kb:
+            await cart.show_cart(message, user=user)
 
-        # Check behavior
+        get_kb.assert_called_once_with(items, "uz", 200000)
         message.answer.assert_called_once()
 
     @pytest.mark.asyncio
     async def test_show_cart_empty(self):
-        """Test show_cart with empty cart"""
-        # Mock objects
-        message = AsyncMock(spec=types.Message)
-
-        user = MagicMock()
-        user.language = "uz"
+        """Empty cart is reported"""
+        message = AsyncMock()
+        user = MagicMock(language="uz")
 
-        # Mock Cart.objects.get to raise DoesNotExist
-        with patch('store.models.Cart.objects.get', side_effect=Cart.DoesNotExist):
-            await show_cart(message, user)
+        with patch.object(cart.queries, 'get_cart_view', AsyncMock(return_value=([], 0))):
+            await cart.show_cart(message, user=user)
 
-        # Check behavior
         message.answer.assert_called_once()
         args, kwargs = message.answer.call_args
         assert "bo'sh" in args[0]
 
     @pytest.mark.asyncio
     async def test_remove_from_cart(self):
-        """Test remove_from_cart handler"""
-        # Mock objects
-        callback = AsyncMock(spec=types.CallbackQuery)
-        callback.data = "remove_1"
+        """Item is deleted and the updated cart is shown"""
+        callback = AsyncMock()
+        user = MagicMock(language="uz")
 
+        with patch.object(cart.queries, 'delete_cart_item', AsyncMock()) as delete_item, \
+                patch.object(cart.queries, 'get_cart_view', AsyncMock(return_value=([], 0))):
+            await cart.remove_from_cart(callback, 3, user=user)
+
+        delete_item.assert_awaited_once_with(3)
+        callback.message.edit_text.assert_called_once()
+        assert callback.answer.await_count == 2
+
+    @pytest.mark.asyncio
+    async def test_decrease_at_quantity_one(self):
+        """➖ at quantity 1 says the minimum is 1 and changes nothing"""
+        callback = AsyncMock()
+        user = MagicMock(language="uz", telegram_id=7)
+        coalescer = DeltaCoalescer(window=0.01)
+
+        with patch.object(cart, 'quantity_coalescer', coalescer), \
+                patch.dict(cart.known_quantities, {(7, 5): 2}), \
+                patch.object(cart.queries, 'change_cart_item_quantity', AsyncMock(return_value=(
+                    SimpleNamespace(id=5, quantity=1, color=MagicMock(price=100000)), "decreased"
+                ))) as change:
+            # 2 -> 1 qabul qilinadi, keyingi bosish esa rad etiladi
+            await cart.change_quantity(callback, 5, 0, user=user)
+            await cart.change_quantity(callback, 5, 0, user=user)
+            await coalescer.close()
+
+        answers = [call.args[0] for call in callback.answer.await_args_list]
+        assert answers == ["Miqdor kamaytirildi.", "Miqdor kamida 1 bo'lishi kerak."]
+        change.assert_awaited_once_with(5, -1)
+        callback.message.edit_caption.assert_awaited_once()
+
+
+class TestUserCache:
+    """Test bot/utils/user_cache.py"""
+
+    @pytest.mark.asyncio
+    async def test_hit_after_miss(self):
+        """Second lookup is served from cache"""
+        cache = UserCache(max_size=10, ttl=60, negative_ttl=60)
         user = MagicMock()
-        user.language = "uz"
 
-        # Mock cart item and cart
-        cart_item = MagicMock()
-        cart = MagicMock()
-        cart.items.exists.return_value = True
+        with patch.object(UserCache, '_load', return_value=user) as mock_load:
+            assert await cache.get(1) is user
+            assert await cache.get(1) is user
 
-        # Mock CartItem.objects.get and related operations
-        with patch('store.models.CartItem.objects.get', return_value=cart_item), \
-                patch('store.models.Cart.objects.get', return_value=cart):
-            await remove_from_cart(callback, user)
+        mock_load.assert_called_once_with(1)
+        assert cache.stats()['hits'] == 1
+        assert cache.stats()['misses'] == 1
 
-        # Check behavior
-        cart_item.delete.assert_called_once()
-        callback.answer.assert_called_once()
-        callback.message.delete.assert_called_once()
-        callback.message.answer.assert_called_once()
\ No newline at end of file
+    @pytest.mark.asyncio
+    async def test_negative_caching_and_invalidate(self):
+        """Unregistered IDs are cached until invalidated"""
+        cache = UserCache(max_size=10, ttl=60, negative_ttl=60)
+
+        with patch.object(UserCache, '_load', return_value=None) as mock_load:
+            assert await cache.get(1) is None
+            assert await cache.get(1) is None
+            cache.invalidate(1)
+            assert await cache.get(1) is None
+
+        assert mock_load.call_count == 2
+        assert cache.stats()['negative_hits'] == 1
+
+    def test_lru_eviction(self):
+        """Oldest entry is evicted when cache is full"""
+        cache = UserCache(max_size=2, ttl=60, negative_ttl=60)
+        cache.put(1, MagicMock())
+        cache.put(2, MagicMock())
+        cache.lookup(1)
+        cache.put(3, MagicMock())
+
+        assert set(cache._entries) == {1, 3}
+
+
+
+class TestKeyboardCache:
+    """Tests for catalog keyboard cache"""
+
+    def test_keyboard_built_once_per_version_and_language(self):
+        """Same key returns cached markup, new version or language rebuilds"""
+        cache = KeyboardCache(max_size=10)
+        build = MagicMock(side_effect=lambda *args: object())
+
+        first = cache.get(('colors', 1, 'uz', 1), build, 'colors', 1)
+        assert cache.get(('colors', 1, 'uz', 1), build, 'colors', 1) is first
+        assert cache.get(('colors', 1, 'ru', 1), build, 'colors', 1) is not first
+        assert cache.get(('colors', 1, 'uz', 2), build, 'colors', 1) is not first
+
+        assert build.call_count == 3
+        assert cache.stats()['hits'] == 1
+        assert cache.stats()['hit_ratio'] == 0.25
+
+    def test_least_recently_used_is_evicted(self):
+        """Cache keeps at most max_size keyboards"""
+        cache = KeyboardCache(max_size=2)
+        cache.get('a', object)
+        cache.get('b', object)
+        cache.get('a', object)
+        cache.get('c', object)
+
+        assert cache.stats()['evictions'] == 1
+        assert cache.stats()['size'] == 2
+        cache.get('a', object)
+        assert cache.stats()['hits'] == 2
+
+
+class TestInlineSearch:
+    """Tests for inline mode product search"""
+
+    def snapshot(self, version=1):
+        products = {}
+        for product_id in (1, 2, 3):
+            product = products[product_id] = ProductNode(
+                product_id, f"Ko'ylak {product_id}", f"Рубашка {product_id}", '', '', f'products/{product_id}.jpg'
+            )
+            product.colors.append(ColorNode(product_id * 10, product, "Qora", "Черный", 150000))
+        return SimpleNamespace(version=version, products=products)
+
+    @pytest.mark.asyncio
+    async def test_results_are_paginated_from_cache(self):
+        """One database call per (query, language, version), pages are sliced with next_offset"""
+        search = inline.InlineSearch(page_size=2)
+        snapshot = self.snapshot()
+        hits = ([3, 1, 2], {'products/3.jpg': 'FILE_ID'})
+
+        with patch.object(inline, '_load_hits', return_value=hits) as load_hits:
+            first, next_offset = await search.page(snapshot, "Ko'ylak", 'uz')
+            second, last_offset = await search.page(snapshot, 'КЎЙЛАК', 'uz', int(next_offset))
+            await search.page(snapshot, "ko'ylak", 'ru')
+
+        assert load_hits.call_count == 2
+        assert [result.id for result in first] == ['3', '1'] and next_offset == '2'
+        assert [result.id for result in second] == ['2'] and last_offset == ''
+        assert first[0].type == 'photo' and first[0].photo_file_id == 'FILE_ID'
+        assert first[1].type == 'article'
+        assert first[1].description == "Qora — 150,000 so'm"
+        assert search.stats()['hits'] == 1
+
+    @pytest.mark.asyncio
+    async def test_missing_products_are_skipped(self):
+        """Products not in the snapshot yet (or inactive) are left out"""
+        search = inline.InlineSearch()
+        with patch.object(inline, '_load_hits', return_value=([7, 2], {})):
+            results, next_offset = await search.page(self.snapshot(), 'shirt', 'ru')
+
+        assert [result.title for result in results] == ["Рубашка 2"]
+        assert next_offset == ''
+
+
+class TestKeysetPagination:
+    """Tests for cursor paginated list keyboards"""
+
+    items = [SimpleNamespace(id=item_id) for item_id in (2, 3, 5, 8, 13, 21, 34)]
+
+    def ids(self, page):
+        return [item.id for item in page.items]
+
+    def follow(self, callback_data):
+        action, (entity_id, direction, cursor_id) = unpack(callback_data)
+        kind = 'products' if action == Action.PRODUCT_PAGE else 'categories'
+        return keyset_page(self.items, kind, entity_id or None, page_cursor(direction, cursor_id), page_size=3)
+
+    def test_pages_forward_and_back(self):
+        """Next/previous cursors walk the list without offsets"""
+        first = keyset_page(self.items, 'products', 7, page_size=3)
+        assert self.ids(first) == [2, 3, 5]
+        assert (first.has_previous, first.has_next) == (False, True)
+        assert first.next_callback == pack(Action.PRODUCT_PAGE, 7, AFTER, 5)
+
+        second = self.follow(first.next_callback)
+        assert self.ids(second) == [8, 13, 21]
+        last = self.follow(second.next_callback)
+        assert self.ids(last) == [34]
+        assert (last.has_previous, last.has_next) == (True, False)
+
+        back = self.follow(last.previous_callback)
+        assert self.ids(back) == [8, 13, 21]
+        assert (back.has_previous, back.has_next) == (True, True)
+
+    def test_root_list_and_invalid_cursor(self):
+        """Entity 0 stands for the root list, malformed cursors are rejected"""
+        page = keyset_page(self.items, 'categories', None, page_size=10)
+        assert unpack(page.next_callback) == (Action.CATEGORY_PAGE, (0, AFTER, 34))
+        assert page_cursor(1, 5) == 'b5'
+        with pytest.raises(ValueError):
+            page_cursor(2, 5)
+
+
+class TestCallbackCodec:
+    """Tests for compact callback_data and the action table"""
+
+    def test_round_trip_and_size(self):
+        """Arguments survive encoding, None is 0 and large ids fit into 64 bytes"""
+        data = pack(Action.COLOR, 12345, 678, None)
+        assert len(data) < len('color_12345_678_0')
+        assert unpack(data) == (Action.COLOR, (12345, 678, 0))
+        assert unpack(pack(Action.SHOW_CART)) == (Action.SHOW_CART, ())
+
+        big = pack(Action.COLOR, 2 ** 63, 2 ** 63, 2 ** 63)
+        assert len(big) <= 64
+        assert unpack(big)[1] == (2 ** 63,) * 3
+
+    @pytest.mark.parametrize('data', ['product_1_2', 'back_to_categories', 'checkout', '', 'yA', 'B4A'])
+    def test_foreign_data_is_rejected(self, data):
+        """Old prefix strings, unknown actions and truncated varints raise ValueError"""
+        with pytest.raises(ValueError):
+            unpack(data)
+
+    @pytest.mark.asyncio
+    async def test_dispatch_passes_decoded_arguments(self):
+        """Handler is found by action and gets ids positionally, middleware data as kwargs"""
+        handler = AsyncMock()
+        table = CallbackTable({Action.BACK_TO_PRODUCT: handler})
+        user = MagicMock()
+
+        callback = AsyncMock(data=pack(Action.BACK_TO_PRODUCT, 5, 9))
+        await table.dispatch(callback, user=user)
+        handler.assert_awaited_once_with(callback, 5, 9, user=user)
+
+        # Handler siz action va eskirgan tugma faqat javob oladi
+        for data in (pack(Action.CART_TOTAL), 'remove_1'):
+            callback = AsyncMock(data=data)
+            await table.dispatch(callback, user=user)
+            callback.answer.assert_awaited_once()
+        assert (table.dispatched, table.invalid) == (1, 1)
+
+
+class TestDatabaseExecutor:
+    """Test bot/utils/db.py"""
+
+    @pytest.mark.asyncio
+    async def test_runs_in_pool_thread(self):
+        """Calls run in worker threads and are counted"""
+        import threading
+
+        executor = DatabaseExecutor(max_workers=2)
+        names = await asyncio.gather(*[
+            executor.run(lambda: threading.current_thread().name) for _ in range(4)
+        ])
+        executor.shutdown()
+
+        assert all(name.startswith('bot-db') for name in names)
+        stats = executor.stats()
+        assert stats['calls'] == 4
+        assert stats['queued'] == 0 and stats['active'] == 0
+
+
+
+class TestPhotoFileIdCache:
+    """Test bot/utils/media.py"""
+
+    @pytest.mark.asyncio
+    async def test_cached_file_id_is_reused(self):
+        """Known file_id is sent without uploading the file"""
+        message = AsyncMock()
+
+        with patch.object(media, '_resolve', return_value=('a.jpg', 'hash', 'FILE_ID')):
+            await media.answer_photo(message, '/media/a.jpg', caption='x')
+
+        message.answer_photo.assert_called_once_with(photo='FILE_ID', caption='x')
+
+    @pytest.mark.asyncio
+    async def test_rejected_file_id_falls_back_to_upload(self):
+        """Rejected file_id is forgotten and the file is uploaded again"""
+        from aiogram.exceptions import TelegramBadRequest
+
+        message = AsyncMock()
+        message.answer_photo.side_effect = [
+            TelegramBadRequest(method=MagicMock(), message="wrong file identifier"),
+            MagicMock(),
+        ]
+
+        with patch.object(media, '_resolve', return_value=('a.jpg', 'hash', 'OLD_ID')), \
+                patch.object(media, '_forget') as mock_forget, \
+                patch.object(media, '_remember') as mock_remember:
+            await media.answer_photo(message, '/media/a.jpg')
+
+        mock_forget.assert_called_once_with('a.jpg', 'hash')
+        mock_remember.assert_called_once()
+        assert message.answer_photo.call_count == 2
+
+
+    @pytest.mark.asyncio
+    async def test_gallery_sent_in_batches_of_ten(self):
+        """12 images are sent as two albums, known file_ids are not uploaded"""
+        message = AsyncMock()
+        message.answer_media_group.side_effect = lambda media: [MagicMock() for _ in media]
+        paths = [f'/media/{i}.jpg' for i in range(12)]
+
+        def resolve(path):
+            return path, 'hash', 'FILE_ID' if path.endswith('0.jpg') else None
+
+        with patch.object(media, '_resolve', side_effect=resolve), \
+                patch.object(media, '_remember') as mock_remember:
+            sent = await media.answer_media_group(message, paths)
+
+        assert len(sent) == 12
+        sizes = [len(call.kwargs['media']) for call in message.answer_media_group.call_args_list]
+        assert sizes == [10, 2]
+        assert mock_remember.call_count == 10  # 0.jpg and 10.jpg already have file_id
+
+
+class TestWebhookDrain:
+    """Tests for graceful webhook shutdown"""
+
+    @pytest.mark.asyncio
+    async def test_close_waits_for_in_flight_updates(self):
+        """Bot session is closed only after background updates finish"""
+        bot = MagicMock()
+        bot.session.close = AsyncMock()
+        handler = DrainingRequestHandler(dispatcher=MagicMock(), bot=bot, drain_timeout=5)
+
+        finished = []
+
+        async def slow_update():
+            await asyncio.sleep(0.05)
+            finished.append(True)
+
+        task = asyncio.create_task(slow_update())
+        handler._background_feed_update_tasks.add(task)
+        task.add_done_callback(handler._background_feed_update_tasks.discard)
+
+        await handler.close()
+
+        assert finished == [True]
+        assert handler.in_flight == 0
+        bot.session.close.assert_awaited_once()
+
+    @pytest.mark.asyncio
+    async def test_close_cancels_updates_after_timeout(self):
+        """Updates still running after drain_timeout are cancelled"""
+        bot = MagicMock()
+        bot.session.close = AsyncMock()
+        handler = DrainingRequestHandler(dispatcher=MagicMock(), bot=bot, drain_timeout=0.01)
+
+        task = asyncio.create_task(asyncio.sleep(10))
+        handler._background_feed_update_tasks.add(task)
+
+        await handler.close()
+        await asyncio.sleep(0)
+
+        assert task.cancelled()
+        bot.session.close.assert_awaited_once()
+
+
+class TestSharding:
+    """Tests for user-affine update sharding"""
+
+    def test_shard_key_uses_sender(self):
+        """Updates are routed by from_user.id, falling back to chat id"""
+        message = {"message_id": 1, "date": 0, "chat": {"id": -100, "type": "channel"}, "text": "hi"}
+        sender = {"id": 42, "is_bot": False, "first_name": "A"}
+
+        assert shard_key(types.Update(update_id=1, message={**message, "from": sender})) == 42
+        assert shard_key(types.Update(update_id=2, channel_post=message)) == -100
+        assert shard_for(42, 4) == shard_for(42, 4) == 2
+
+    @pytest.mark.asyncio
+    async def test_feeder_keeps_per_user_order(self):
+        """Updates of one user run one after another, other users run concurrently"""
+        events = []
+
+        async def handle(update):
+            user_id, n = update
+            events.append(('start', user_id, n))
+            await asyncio.sleep(0.01 if user_id == 1 else 0)
+            events.append(('end', user_id, n))
+
+        feeder = OrderedFeeder(handle)
+        for update in [(1, 0), (1, 1), (2, 0), (1, 2)]:
+            feeder.submit(update[0], update)
+        await feeder.join()
+
+        user_1 = [event for event in events if event[1] == 1]
+        assert user_1 == [(kind, 1, n) for n in range(3) for kind in ('start', 'end')]
+        # user 2 is not blocked behind user 1's slow updates
+        assert events.index(('end', 2, 0)) < events.index(('end', 1, 0))
+        assert feeder.stats()['processed'] == 4
+
+
+class TestRedisFSMStorage:
+    """Tests for Redis-protocol FSM storage against the local stand-in"""
+
+    @pytest.mark.asyncio
+    async def test_state_and_data_round_trip(self):
+        """State and data are stored, cleared and read back"""
+        key = StorageKey(bot_id=1, chat_id=10, user_id=10)
+
+        async with RespStandIn() as server:
+            storage = RedisStorage(url=server.url)
+            assert await storage.get_state(key) is None
+            assert await storage.get_data(key) == {}
+
+            await asyncio.gather(
+                storage.set_state(key, 'OrderStates:waiting_for_address'),
+                storage.set_data(key, {'address': 'Toshkent'}),
+            )
+            assert await storage.get_state(key) == 'OrderStates:waiting_for_address'
+            assert await storage.update_data(key, {'language': 'uz'}) == {'address': 'Toshkent', 'language': 'uz'}
+
+            await storage.set_state(key, None)
+            await storage.set_data(key, {})
+            assert await storage.get_state(key) is None
+            assert await storage.get_data(key) == {}
+            await storage.close()
+
+
+class TestOutboundLimiter:
+    """Tests for outbound Telegram rate limiting"""
+
+    @staticmethod
+    def send(chat_id, text='test'):
+        from aiogram.methods import SendMessage
+        return SendMessage(chat_id=chat_id, text=text)
+
+    @pytest.mark.asyncio
+    async def test_chat_limit_does_not_block_other_chats(self):
+        """Second message to one chat waits, another chat is sent at once"""
+        limiter = OutboundLimiter(global_rate=100, chat_rate=10, chat_burst=1)
+        sent_at = {}
+
+        async def make_request(bot, method):
+            sent_at[method.text] = asyncio.get_running_loop().time()
+
+        start = asyncio.get_running_loop().time()
+        await asyncio.gather(
+            limiter(make_request, None, self.send(1, 'a1')),
+            limiter(make_request, None, self.send(1, 'a2')),
+            limiter(make_request, None, self.send(2, 'b1')),
+        )
+
+        assert sent_at['a2'] - start >= 0.09
+        assert sent_at['b1'] - start < 0.05
+        assert limiter.stats()['sent']['interactive'] == 3
+
+    @pytest.mark.asyncio
+    async def test_interactive_replies_go_before_broadcasts(self):
+        """Queued interactive request is sent before earlier broadcasts"""
+        limiter = OutboundLimiter(global_rate=20, chat_rate=100, chat_burst=100)
+        limiter.global_bucket.tokens = 0
+        order = []
+
+        async def make_request(bot, method):
+            order.append(method.text)
+
+        async def broadcast(chat_id):
+            with send_lane(BROADCAST):
+                await limiter(make_request, None, self.send(chat_id, 'broadcast'))
+
+        tasks = [asyncio.create_task(broadcast(chat_id)) for chat_id in range(1, 4)]
+        await asyncio.sleep(0)
+        assert limiter.queue_depth()['broadcast'] == 3
+        await limiter(make_request, None, self.send(99, 'reply'))
+        await asyncio.gather(*tasks)
+
+        assert order[0] == 'reply'
+
+    @pytest.mark.asyncio
+    async def test_retry_after_is_retried(self):
+        """429 pauses the chat and the request is sent again"""
+        from aiogram.exceptions import TelegramRetryAfter
+
+        limiter = OutboundLimiter()
+        method = self.send(1)
+        make_request = AsyncMock(side_effect=[
+            TelegramRetryAfter(method=method, message="Too Many Requests", retry_after=0),
+            'ok',
+        ])
+
+        assert await limiter(make_request, None, method) == 'ok'
+        assert make_request.call_count == 2
+        assert limiter.stats()['retries'] == 1
+
+    @pytest.mark.asyncio
+    async def test_requests_without_chat_are_not_limited(self):
+        """getUpdates and similar requests pass straight through"""
+        from aiogram.methods import GetUpdates
+
+        limiter = OutboundLimiter(global_rate=1)
+        limiter.global_bucket.tokens = 0
+        make_request = AsyncMock(return_value=[])
+
+        await asyncio.wait_for(limiter(make_request, None, GetUpdates()), timeout=0.1)
+        assert limiter.stats()['sent']['interactive'] == 0
+
+    @pytest.mark.asyncio
+    async def test_album_counts_as_one_message(self):
+        """Caption and keyboard after a 10-photo album are not held back"""
+        from aiogram.methods import SendMediaGroup
+
+        limiter = OutboundLimiter(global_rate=100, chat_rate=1, chat_burst=3)
+        make_request = AsyncMock()
+        album = SendMediaGroup(chat_id=1, media=[
+            types.InputMediaPhoto(media=f'file-{index}') for index in range(10)
+        ])
+
+        await asyncio.wait_for(limiter(make_request, None, album), timeout=0.1)
+        await asyncio.wait_for(limiter(make_request, None, self.send(1, 'caption')), timeout=0.1)
+        assert make_request.call_count == 2
+
+    @pytest.mark.asyncio
+    async def test_deletes_and_edits_are_not_limited(self):
+        """Browsing (delete + edit + answer) does not use the chat's send budget"""
+        from aiogram.methods import AnswerCallbackQuery, DeleteMessage, EditMessageText
+
+        limiter = OutboundLimiter(global_rate=100, chat_rate=1, chat_burst=1)
+        make_request = AsyncMock()
+        for _ in range(3):
+            await asyncio.wait_for(limiter(make_request, None, DeleteMessage(chat_id=1, message_id=1)), timeout=0.1)
+            await asyncio.wait_for(
+                limiter(make_request, None, EditMessageText(chat_id=1, message_id=2, text='page')), timeout=0.1
+            )
+            await asyncio.wait_for(limiter(make_request, None, AnswerCallbackQuery(callback_query_id='1')), timeout=0.1)
+
+        await asyncio.wait_for(limiter(make_request, None, self.send(1)), timeout=0.1)
+        assert limiter.stats()['sent']['interactive'] == 1
+
+
+class TestDeltaCoalescer:
+    """Tests for coalescing rapid cart quantity taps"""
+
+    @pytest.mark.asyncio
+    async def test_taps_in_window_are_applied_once(self):
+        """Taps within the window become one flush with the summed delta"""
+        coalescer = DeltaCoalescer(window=0.02)
+        flush = AsyncMock()
+
+        for delta in (1, 1, 1, -1):
+            coalescer.submit((1, 10), delta, flush)
+        coalescer.submit((1, 11), -1, flush)
+        await asyncio.sleep(0.05)
+
+        flush.assert_any_await(2, 4)
+        flush.assert_any_await(-1, 1)
+        assert flush.await_count == 2
+        assert coalescer.stats()['coalescing_ratio'] == 2.5
+
+    @pytest.mark.asyncio
+    async def test_zero_delta_and_close(self):
+        """Cancelling taps skip the write, close() applies pending deltas"""
+        coalescer = DeltaCoalescer(window=10)
+        flush = AsyncMock()
+
+        coalescer.submit((1, 10), 1, flush)
+        coalescer.submit((1, 10), -1, flush)
+        coalescer.submit((1, 11), 1, flush)
+        await coalescer.close()
+
+        flush.assert_awaited_once_with(1, 1)
+        assert coalescer.stats()['skipped'] == 1
+
+
+class TestHandlerMetrics:
+    """Tests for per-update handler metrics"""
+
+    @pytest.mark.asyncio
+    async def test_update_is_recorded_under_handler_name(self):
+        """Handler name, DB wait, SQL queries and API calls end up in the handler histogram"""
+        from django.db import connection
+
+        metrics = HandlerMetrics(slow_ms=0)
+        executor = DatabaseExecutor(max_workers=1)
+        counter = ApiCallCounter()
+
+        def query():
+            # execute_wrapper o'rnatilgan: soxta execute bilan chaqiramiz
+            wrapper = connection.execute_wrappers[-1]
+            return wrapper(lambda *args: 'row', 'SELECT 1', None, False, {})
+
+        async def process_product(event, **kwargs):
+            assert await executor.run(query) == 'row'
+            await counter(AsyncMock(return_value=True), None, MagicMock())
+            await counter(AsyncMock(return_value=True), None, MagicMock())
+
+        async def handler_step(event, data):
+            return await process_product(event, **data)
+
+        async def name_step(event, data):
+            data['handler'] = SimpleNamespace(callback=process_product)
+            return await HandlerNameMiddleware()(handler_step, event, data)
+
+        await MetricsMiddleware(metrics)(name_step, MagicMock(), {})
+        executor.shutdown()
+
+        summary = metrics.dump()['handlers'][handler_name(process_product)]
+        assert summary['count'] == 1 and summary['errors'] == 0
+        assert summary['avg_queries'] == 1
+        assert summary['avg_api_calls'] == 2
+        assert sum(summary['histogram']) == 1
+        assert metrics.stats()['updates'] == 1
+        assert current_update.get() is None
+
+    def test_export_to_prometheus_registry(self):
+        """Handler histograms and cache counters are exported for /metrics"""
+        from core.metrics import Registry, render
+        from bot.utils import exporter
+
+        metrics = HandlerMetrics(slow_ms=0)
+        record = UpdateMetrics()
+        record.handler = 'cart.show_cart'
+        record.wall = 0.03
+        metrics.observe(record)
+
+        registry = Registry('/nonexistent')
+        with patch.object(exporter, 'handler_metrics', metrics):
+            exporter.export_bot_metrics(registry)
+
+        body = render(registry.counters, registry.gauges, registry.histograms)
+        assert 'bot_updates_total{handler="cart.show_cart"} 1' in body
+        assert 'bot_update_duration_seconds_bucket{handler="cart.show_cart",le="0.05"} 1' in body
+        assert 'bot_cache_hits_total{cache="user"}' in body
+        assert 'bot_outbound_queue_depth{queue="interactive"} 0' in body
+
+    def test_slow_update_logs_slowest_queries(self, caplog):
+        """Updates over the threshold are logged with their slowest queries"""
+        metrics = HandlerMetrics(slow_ms=100, slow_queries=1)
+        record = UpdateMetrics()
+        record.handler = 'cart.show_cart'
+        record.queries = [(0.001, 'SELECT fast'), (0.2, 'SELECT slow')]
+        record.wall = 0.25
+
+        with caplog.at_level('WARNING', logger='bot.utils.metrics'):
+            metrics.observe(record)
+
+        assert 'SELECT slow' in caplog.text and 'SELECT fast' not in caplog.text
+        stats = metrics.handlers['cart.show_cart']
+        assert stats.buckets[5] == 1  # 100 < 250 ms
+        assert stats.quantile(0.95) == 250
+        assert metrics.stats()['slow_updates'] == 1
+
+
+class ReprCounter:
+    """Field value counting how many times it was formatted"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def __repr__(self):
+        self.calls += 1
+        return 'counted'
+
+
+class TestBotLogging:
+    """Tests for bot/utils/log.py"""
+
+    def make_logger(self, level, sampler=None):
+        import logging
+        import queue
+
+        records = queue.SimpleQueue()
+        logger = logging.getLogger('tests.bot_log')
+        logger.handlers = [NonBlockingQueueHandler(records)]
+        logger.propagate = False
+        logger.setLevel(level)
+        return BotLogger(logger, sampler or Sampler()), records
+
+    def test_disabled_level_formats_nothing(self):
+        """Records below the logger level are dropped before any formatting"""
+        log, records = self.make_logger('INFO')
+        value = ReprCounter()
+
+        log.debug('cart.shown', items=value)
+
+        assert records.empty()
+        assert value.calls == 0
+
+    def test_records_are_formatted_by_the_listener(self):
+        """The queue handler passes records unformatted; the formatter adds fields"""
+        log, records = self.make_logger('DEBUG')
+        value = ReprCounter()
+
+        log.debug('cart.shown', items=value, total=1200)
+
+        record = records.get_nowait()
+        assert value.calls == 0
+        assert StructuredFormatter('%(message)s').format(record) == 'cart.shown items=counted total=1200'
+
+    def test_sampling_is_per_handler_and_per_update(self):
+        """Unsampled updates drop DEBUG/INFO records but keep warnings"""
+        sampler = Sampler(rate=1.0, rates=parse_sampling('cart.show_cart=0, products.process_product=1'))
+        log, records = self.make_logger('DEBUG', sampler)
+
+        record = UpdateMetrics()
+        record.handler = 'cart.show_cart'
+        token = current_update.set(record)
+        try:
+            log.debug('cart.shown', items=1)
+            log.info('cart.shown', items=1)
+            log.warning('cart.item_photo_failed', item_id=1)
+        finally:
+            current_update.reset(token)
+        log.debug('catalog.loaded')
+
+        messages = []
+        while not records.empty():
+            messages.append(records.get_nowait().getMessage())
+        assert messages == ['cart.item_photo_failed', 'catalog.loaded']
+        assert record.log_sampled is False
@@ -1,7 +1,25 @@
+import os
+import tempfile
+
 import pytest
-from django.test import TestCase
+from aiogram.fsm.storage.base import StorageKey
+from asgiref.sync import async_to_sync
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
 from decimal import Decimal
-from store.models import User, Category, Product, Color, Cart, CartItem, Order, OrderItem
+from unittest.mock import patch
+from PIL import Image
+from bot.models import FSMRecord
+from bot.storage.database import DatabaseStorage
+from bot.utils.catalog import CatalogService, CatalogSnapshot
+from bot.utils.media import cached_file_ids
+from store.models import (
+    User, Category, Product, Color, ColorImage, ImageMetadata, Cart, CartItem, Order, OrderItem, CatalogVersion,
+    TelegramFile
+)
+from store.search import search_products
+from store.services import checkout, merge_duplicate_cart_items
+from store.translit import fold, search_key
 
 
 class TestUser(TestCase):
@@ -68,6 +86,45 @@ class TestCategory(TestCase):
         self.assertEqual(self.child_category.get_name("uz"), "Telefonlar")
         self.assertEqual(self.child_category.get_name("ru"), "Телефоны")
 
+    def test_materialized_path(self):
+        """Subtree, ancestors and breadcrumb come from the path"""
+        grandchild = Category.objects.create(name_uz="Smartfonlar", name_ru="Смартфоны", parent=self.child_category)
+        product = Product.objects.create(name_uz="iPhone 14", name_ru="Айфон 14")
+        product.categories.add(grandchild)
+
+        self.assertEqual(grandchild.depth, 2)
+        self.assertEqual(grandchild.path_ids, [self.parent_category.id, self.child_category.id, grandchild.id])
+        with self.assertNumQueries(1):
+            self.assertEqual(list(Category.objects.subtree(self.parent_category)),
+                             [self.parent_category, self.child_category, grandchild])
+        with self.assertNumQueries(1):
+            self.assertEqual(list(Category.objects.breadcrumb(grandchild.id)),
+                             [self.parent_category, self.child_category, grandchild])
+        self.assertEqual(list(Category.objects.ancestors(grandchild)), [self.parent_category, self.child_category])
+        self.assertEqual(list(Product.objects.in_category_tree(self.parent_category)), [product])
+
+    def test_move_subtree(self):
+        """Moving a category updates paths of its whole subtree"""
+        grandchild = Category.objects.create(name_uz="Smartfonlar", name_ru="Смартфоны", parent=self.child_category)
+        other = Category.objects.create(name_uz="Maishiy texnika", name_ru="Бытовая техника")
+
+        self.child_category.parent = other
+        self.child_category.save()
+        grandchild.refresh_from_db()
+        self.assertEqual(grandchild.path_ids, [other.id, self.child_category.id, grandchild.id])
+        self.assertEqual(list(Category.objects.subtree(self.parent_category)), [self.parent_category])
+
+        other.parent = grandchild
+        with self.assertRaises(ValueError):
+            other.save()
+
+    def test_rebuild_paths(self):
+        """Paths broken by queryset.update() are restored"""
+        Category.objects.filter(pk=self.child_category.pk).update(parent=None)
+        self.assertEqual(Category.objects.rebuild_paths(), 1)
+        self.child_category.refresh_from_db()
+        self.assertEqual(self.child_category.depth, 0)
+
 
 class TestProduct(TestCase):
     """Test Product model"""
@@ -115,6 +172,32 @@ class TestProduct(TestCase):
         self.assertEqual(self.product.get_description("uz"), "Apple kompaniyasi telefoni")
         self.assertEqual(self.product.get_description("ru"), "Телефон компании Apple")
 
+    def test_search_keys(self):
+        """Search keys are Latin, in both languages, and follow name changes"""
+        self.assertEqual(fold("Qo'l soati"), fold("Қўл соати"))
+        self.assertEqual(fold("Ko‘ylak, Khiva!"), "koylak xiva")
+        self.assertEqual(self.product.search_name, "iphone 14 ayfon")
+        self.assertEqual(self.product.search_text, search_key("Apple kompaniyasi telefoni", "Телефон компании Apple"))
+
+        self.product.name_ru = "Смартфон"
+        self.product.save(update_fields=['name_ru'])
+        self.assertEqual(Product.objects.get(pk=self.product.pk).search_name, "iphone 14 smartfon")
+
+        Product.objects.filter(pk=self.product.pk).update(search_name='')
+        self.assertEqual(Product.objects.filter(pk=self.product.pk).rebuild_search_index(), 1)
+        self.assertEqual(Product.objects.get(pk=self.product.pk).search_name, "iphone 14 smartfon")
+
+    def test_search_products(self):
+        """Search finds products in either script, names first, active only"""
+        other = Product.objects.create(name_uz="Telefon g'ilofi", name_ru="Чехол для телефона")
+        Product.objects.create(name_uz="Eski telefon", name_ru="Старый телефон", is_active=False)
+
+        self.assertEqual([product.id for product in search_products("айфон")], [self.product.id])
+        self.assertEqual([product.id for product in search_products("Ayfon 14")], [self.product.id])
+        # "telefon" nomda (other) va tavsifda (self.product) bor
+        self.assertEqual([product.id for product in search_products("ТЕЛЕФОН")], [other.id, self.product.id])
+        self.assertEqual(search_products("  !! "), [])
+
 
 class TestColorAndColorImage(TestCase):
     """Test Color and ColorImage models"""
@@ -232,6 +315,79 @@ class TestCartAndCartItem(TestCase):
         # Recalculate total price
         self.assertEqual(self.cart.get_total_price(), Decimal('3700000.00'))
 
+    def test_cart_summary_single_query(self):
+        """Test items, count and total of cart are loaded with one query"""
+        color2 = Color.objects.create(
+            product=self.product,
+            name_uz="Oq",
+            name_ru="Белый",
+            price=Decimal('1300000.00')
+        )
+        CartItem.objects.create(cart=self.cart, color=color2, quantity=1)
+        cart = Cart.objects.get(id=self.cart.id)
+
+        with self.assertNumQueries(1):
+            summary = cart.summary
+            names = [item.color.product.name_uz for item in summary.items]
+            line_totals = [item.get_price() for item in summary.items]
+
+        self.assertEqual(names, ["iPhone 14", "iPhone 14"])
+        self.assertEqual(line_totals, [Decimal('2400000.00'), Decimal('1300000.00')])
+        self.assertEqual(summary.count, 2)
+        self.assertEqual(summary.total, Decimal('3700000.00'))
+
+    def test_add_is_upsert(self):
+        """Test adding the same color increases quantity of the existing item"""
+        with self.assertNumQueries(1):
+            item = CartItem.objects.add(self.cart, self.color, 3)
+
+        self.assertEqual(item.id, self.cart_item.id)
+        self.assertEqual(item.quantity, 5)
+        self.assertEqual(CartItem.objects.filter(cart=self.cart).count(), 1)
+
+    def test_change_quantity_guard(self):
+        """Test quantity is changed in SQL and never goes below minimum"""
+        with self.assertNumQueries(1):
+            self.assertEqual(CartItem.objects.change_quantity(self.cart_item.id, -1), (1, self.color.id))
+
+        self.assertIsNone(CartItem.objects.change_quantity(self.cart_item.id, -1))
+        self.cart_item.refresh_from_db()
+        self.assertEqual(self.cart_item.quantity, 1)
+
+        self.assertEqual(CartItem.objects.change_quantity(self.cart_item.id, 1), (2, self.color.id))
+
+    def test_change_quantity_clamped(self):
+        """Test summed negative delta stops at minimum quantity"""
+        self.assertEqual(CartItem.objects.change_quantity(self.cart_item.id, -5, clamp=True), (1, self.color.id))
+        self.assertIsNone(CartItem.objects.change_quantity(self.cart_item.id, -1, clamp=True))
+        self.assertEqual(CartItem.objects.change_quantity(self.cart_item.id, 3, clamp=True), (4, self.color.id))
+
+    def test_empty_cart_summary(self):
+        """Test summary of cart without items"""
+        self.cart_item.delete()
+        summary = Cart.objects.get(id=self.cart.id).summary
+        self.assertEqual((summary.items, summary.count, summary.total), ([], 0, Decimal('0')))
+
+    def test_checkout(self):
+        """Checkout creates order with items and closes cart, once per key"""
+        # key lookup, cart lock, items+total, order, items, cart update + savepoint pair
+        with self.assertNumQueries(8):
+            order, created = checkout(self.user, "Toshkent", checkout_key="abc")
+        self.assertTrue(created)
+        self.assertEqual(order.total_price, Decimal('2400000.00'))
+        self.assertEqual(list(order.items.values_list('product_name', 'color_name', 'quantity')),
+                         [("iPhone 14", "Qora", 2)])
+        self.cart.refresh_from_db()
+        self.assertFalse(self.cart.is_active)
+
+        again, created = checkout(self.user, "Toshkent", checkout_key="abc")
+        self.assertFalse(created)
+        self.assertEqual(again, order)
+        self.assertEqual(Order.objects.count(), 1)
+
+        with self.assertRaises(Cart.DoesNotExist):
+            checkout(self.user, "Toshkent", checkout_key="other")
+
 
 class TestOrderAndOrderItem(TestCase):
     """Test Order and OrderItem models"""
@@ -281,4 +437,208 @@ class TestOrderAndOrderItem(TestCase):
 
     def test_order_item_str(self):
         """Test order item string representation"""
-        self.assertEqual(str(self.order_item), "iPhone 14 (Qora) x 2")
\ No newline at end of file
+        self.assertEqual(str(self.order_item), "iPhone 14 (Qora) x 2")
+
+
+class TestImageMetadata(TestCase):
+    """Test image metadata precomputed on save"""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.media_root, 'product_colors'))
+        Image.new('RGB', (20, 10)).save(os.path.join(self.media_root, 'product_colors', 'a.png'))
+
+        self.product = Product.objects.create(name_uz="iPhone 14", name_ru="Айфон 14")
+        self.color = Color.objects.create(
+            product=self.product,
+            name_uz="Qora",
+            name_ru="Черный",
+            price=Decimal('1200000.00')
+        )
+
+    def test_metadata_saved_with_color_image(self):
+        """Saving ColorImage inspects the file once"""
+        with override_settings(MEDIA_ROOT=self.media_root):
+            ColorImage.objects.create(color=self.color, image='product_colors/a.png')
+
+        metadata = ImageMetadata.objects.get(path='product_colors/a.png')
+        self.assertTrue(metadata.is_valid)
+        self.assertEqual(metadata.format, 'PNG')
+        self.assertEqual((metadata.width, metadata.height), (20, 10))
+        self.assertEqual(len(metadata.content_hash), 64)
+
+    def test_cached_file_ids_follow_current_content(self):
+        """Only file_ids uploaded for the current content of an image are returned"""
+        with override_settings(MEDIA_ROOT=self.media_root):
+            ColorImage.objects.create(color=self.color, image='product_colors/a.png')
+        content_hash = ImageMetadata.objects.get(path='product_colors/a.png').content_hash
+        TelegramFile.objects.create(path='product_colors/a.png', content_hash='old', file_id='OLD_ID')
+        TelegramFile.objects.create(path='product_colors/a.png', content_hash=content_hash, file_id='FILE_ID')
+
+        self.assertEqual(
+            cached_file_ids(['product_colors/a.png', 'product_colors/b.png']),
+            {'product_colors/a.png': 'FILE_ID'}
+        )
+
+
+class TestMergeDuplicateCartItems(TransactionTestCase):
+    """Test duplicate cart rows are merged before the (cart, color) constraint"""
+
+    def test_duplicates_are_merged(self):
+        user = User.objects.create(telegram_id=123456789, first_name="Test User")
+        product = Product.objects.create(name_uz="iPhone 14", name_ru="Айфон 14")
+        black = Color.objects.create(product=product, name_uz="Qora", name_ru="Черный", price=Decimal('100'))
+        white = Color.objects.create(product=product, name_uz="Oq", name_ru="Белый", price=Decimal('100'))
+        cart = Cart.objects.create(user=user)
+
+        # Constraint dan oldingi holat: bir rang uchun bir nechta qator
+        constraint = CartItem._meta.constraints[0]
+        with patch.object(CartItem._meta, 'constraints', []), connection.schema_editor() as editor:
+            editor.remove_constraint(CartItem, constraint)
+        try:
+            first = CartItem.objects.create(cart=cart, color=black, quantity=2)
+            CartItem.objects.create(cart=cart, color=black, quantity=3)
+            CartItem.objects.create(cart=cart, color=white, quantity=1)
+
+            merge_duplicate_cart_items()
+
+            self.assertEqual(
+                sorted(CartItem.objects.values_list('id', 'color_id', 'quantity')),
+                sorted([(first.id, black.id, 5), (first.id + 2, white.id, 1)]),
+            )
+        finally:
+            with connection.schema_editor() as editor:
+                editor.add_constraint(CartItem, constraint)
+
+
+class TestDatabaseFSMStorage(TransactionTestCase):
+    """Test write-behind FSM storage (runs queries on bot DB pool threads)"""
+
+    key = StorageKey(bot_id=1, chat_id=10, user_id=10)
+
+    def test_writes_are_batched_and_persisted(self):
+        """Several writes of one key become one row, visible after restart"""
+        async def scenario():
+            storage = DatabaseStorage(flush_interval=60)
+            await storage.set_state(self.key, 'OrderStates:waiting_for_address')
+            await storage.set_data(self.key, {'language': 'uz'})
+            await storage.update_data(self.key, {'address': 'Toshkent'})
+            # Read-your-writes before flush
+            self.assertEqual(await storage.get_data(self.key), {'language': 'uz', 'address': 'Toshkent'})
+            await storage.close()
+            self.assertEqual(storage.stats()['flushed_records'], 1)
+
+            restarted = DatabaseStorage()
+            state = await restarted.get_state(self.key)
+            data = await restarted.get_data(self.key)
+            await restarted.close()
+            return state, data
+
+        state, data = async_to_sync(scenario)()
+        self.assertEqual(state, 'OrderStates:waiting_for_address')
+        self.assertEqual(data, {'language': 'uz', 'address': 'Toshkent'})
+        self.assertEqual(FSMRecord.objects.count(), 1)
+
+    def test_partial_write_keeps_other_field(self):
+        """set_state does not overwrite data stored earlier"""
+        async def scenario():
+            storage = DatabaseStorage()
+            await storage.set_data(self.key, {'language': 'ru'})
+            await storage.flush()
+            await storage.set_state(self.key, 'SettingsStates:waiting_for_name')
+            await storage.close()
+
+        async_to_sync(scenario)()
+        record = FSMRecord.objects.get()
+        self.assertEqual(record.state, 'SettingsStates:waiting_for_name')
+        self.assertEqual(record.data, {'language': 'ru'})
+
+    def test_expired_records_are_ignored(self):
+        """Records past their TTL are not read back"""
+        async def scenario():
+            storage = DatabaseStorage(ttl=-1)
+            await storage.set_state(self.key, 'OrderStates:confirm_order')
+            await storage.close()
+            return await DatabaseStorage().get_state(self.key)
+
+        self.assertIsNone(async_to_sync(scenario)())
+
+
+class TestCatalogSnapshot(TransactionTestCase):
+    """Test in-memory catalog snapshot used by the bot"""
+
+    def setUp(self):
+        self.root = Category.objects.create(name_uz="Elektronika", name_ru="Электроника")
+        self.child = Category.objects.create(name_uz="Telefonlar", name_ru="Телефоны", parent=self.root)
+        self.product = Product.objects.create(name_uz="iPhone 14", name_ru="Айфон 14")
+        self.product.categories.add(self.child)
+        self.color = Color.objects.create(
+            product=self.product, name_uz="Qora", name_ru="Черный", price=Decimal('1200000.00')
+        )
+        ColorImage.objects.create(color=self.color, image="product_colors/2.jpg", order=2)
+        ColorImage.objects.create(color=self.color, image="product_colors/1.jpg", order=1)
+        Color.objects.create(product=self.product, name_uz="Oq", name_ru="Белый", price=1, is_active=False)
+
+    def test_snapshot_lookups(self):
+        """Browsing lookups are answered from the snapshot"""
+        # version, categories, products, links, colors, images + BEGIN/COMMIT
+        with self.assertNumQueries(8):
+            snapshot = CatalogSnapshot.load()
+
+        with self.assertNumQueries(0):
+            self.assertEqual([c.id for c in snapshot.root_categories()], [self.root.id])
+            breadcrumb, children, products = snapshot.category_listing(self.child.id)
+            self.assertEqual([c.get_name('ru') for c in breadcrumb], ["Электроника", "Телефоны"])
+            self.assertEqual((children, [p.id for p in products]), ([], [self.product.id]))
+
+            category, products, parent = snapshot.category_products(self.root.id)
+            self.assertEqual(([p.id for p in products], parent), ([self.product.id], None))
+
+            product, colors = snapshot.product_view(self.product.id)
+            self.assertEqual([c.id for c in colors], [self.color.id])
+            color, images = snapshot.color_view(self.color.id)
+            self.assertEqual(images, ["product_colors/1.jpg", "product_colors/2.jpg"])
+            self.assertEqual(color.product.get_name('uz'), "iPhone 14")
+
+        with self.assertRaises(Product.DoesNotExist):
+            snapshot.product(0)
+        self.assertEqual(snapshot.stats()['colors'], 1)
+        self.assertGreater(snapshot.memory_bytes, 0)
+
+    def test_rows_added_during_load_are_skipped(self):
+        """Rows whose parent was created after its own query do not break the load"""
+        inserted = []
+
+        def add_rows_after_links(execute, sql, params, many, context):
+            result = execute(sql, params, many, context)
+            if not inserted and 'FROM "store_product_categories"' in sql:
+                # Admin so'rovlar orasida yangi mahsulot, rang va rasm qo'shadi
+                inserted.append(True)
+                product = Product.objects.create(name_uz="Yangi", name_ru="Новый")
+                product.categories.add(self.child)
+                color = Color.objects.create(product=product, name_uz="Qizil", name_ru="Красный", price=1)
+                ColorImage.objects.create(color=color, image="product_colors/3.jpg")
+            return result
+
+        with connection.execute_wrapper(add_rows_after_links):
+            snapshot = CatalogSnapshot.load()
+
+        self.assertTrue(inserted)
+        self.assertEqual([p.id for p in snapshot.category(self.child.id).products], [self.product.id])
+        self.assertEqual(snapshot.stats()['colors'], 1)
+
+    def test_rebuilt_on_version_bump(self):
+        """Catalog changes bump the version and the service rebuilds"""
+        service = CatalogService(check_interval=0)
+        first = async_to_sync(service.get)()
+        self.assertIs(async_to_sync(service.get)(), first)
+
+        version = CatalogVersion.current()
+        self.product.categories.add(self.root)
+        self.assertEqual(CatalogVersion.current(), version + 1)
+
+        second = async_to_sync(service.get)()
+        self.assertIsNot(second, first)
+        self.assertEqual(second.version, version + 1)
+        self.assertEqual([p.id for p in second.categories[self.root.id].products], [self.product.id])
+        self.assertEqual(service.stats()['rebuilds'], 2)